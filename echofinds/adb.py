@@ -0,0 +1,221 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+
+import db
+
+try:
+    import aiomysql
+except ImportError:
+    # aiomysql is only needed for the async entry point on the mysql backend
+    aiomysql = None
+
+# Async connection pool for the ASGI entry point (asgi.py).
+# Same backends, schema and %s placeholders as db.py. On MySQL each connection
+# is an aiomysql connection; on SQLite, which has no async driver, each
+# connection is a db.py SQLite connection driven from its own single worker
+# thread, so a slow query only occupies that connection and never the event loop.
+POOL_SIZE = db.POOL_SIZE
+POOL_TIMEOUT = db.POOL_TIMEOUT
+
+
+class _SqliteAsyncConnection:
+    def __init__(self, raw):
+        self._raw = raw
+        # sqlite connections must stay on one thread at a time; one worker per connection
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="adb-sqlite")
+
+    async def _run(self, fn, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+
+    async def _query(self, query, params, *args):
+        # timed here, on the loop, where the request context (and its metrics) is visible
+        started = time.perf_counter()
+        try:
+            return await self._run(self._execute, query, params, *args)
+        finally:
+            db.notify_query(query, params, time.perf_counter() - started)
+
+    def _execute(self, query, params, dictionary, fetch, many=False):
+        cursor = self._raw.cursor(dictionary=dictionary)
+        try:
+            if many:
+                cursor.executemany(query, params)
+            else:
+                cursor.execute(query, params)
+            if fetch == "all":
+                return cursor.fetchall()
+            if fetch == "one":
+                return cursor.fetchone()
+            return cursor.lastrowid, cursor.rowcount
+        finally:
+            cursor.close()
+
+    async def fetchall(self, query, params=(), dictionary=True):
+        return await self._query(query, params, dictionary, "all")
+
+    async def fetchone(self, query, params=(), dictionary=True):
+        return await self._query(query, params, dictionary, "one")
+
+    async def execute(self, query, params=()):
+        # returns (lastrowid, rowcount)
+        return await self._query(query, params, False, None)
+
+    async def executemany(self, query, seq_params):
+        return await self._query(query, seq_params, False, None, True)
+
+    async def begin(self):
+        await self._run(self._raw.rollback)
+        await self._run(self._raw.start_transaction)
+
+    async def commit(self):
+        await self._run(self._raw.commit)
+
+    async def rollback(self):
+        await self._run(self._raw.rollback)
+
+    async def close(self):
+        await self._run(self._raw.close)
+        self._executor.shutdown(wait=False)
+
+
+class _MysqlAsyncConnection:
+    def __init__(self, raw):
+        self._raw = raw
+
+    async def _execute(self, query, params, dictionary, fetch, many=False):
+        cursor_class = aiomysql.DictCursor if dictionary else aiomysql.Cursor
+        started = time.perf_counter()
+        try:
+            async with self._raw.cursor(cursor_class) as cursor:
+                if many:
+                    await cursor.executemany(query, params)
+                else:
+                    await cursor.execute(query, params)
+                if fetch == "all":
+                    return await cursor.fetchall()
+                if fetch == "one":
+                    return await cursor.fetchone()
+                return cursor.lastrowid, cursor.rowcount
+        finally:
+            db.notify_query(query, params, time.perf_counter() - started)
+
+    async def fetchall(self, query, params=(), dictionary=True):
+        return await self._execute(query, params, dictionary, "all")
+
+    async def fetchone(self, query, params=(), dictionary=True):
+        return await self._execute(query, params, dictionary, "one")
+
+    async def execute(self, query, params=()):
+        return await self._execute(query, params, False, None)
+
+    async def executemany(self, query, seq_params):
+        return await self._execute(query, seq_params, False, None, True)
+
+    async def begin(self):
+        await self._raw.rollback()
+        await self._raw.begin()
+
+    async def commit(self):
+        await self._raw.commit()
+
+    async def rollback(self):
+        await self._raw.rollback()
+
+    async def close(self):
+        self._raw.close()
+
+
+async def _connect():
+    if db.DB_BACKEND == "sqlite":
+        return _SqliteAsyncConnection(db._connect_sqlite())
+    if aiomysql is None:
+        raise RuntimeError("aiomysql is not installed; it is required for the async entry point on mysql")
+    cfg = db.MYSQL_CONFIG
+    raw = await aiomysql.connect(host=cfg["host"], user=cfg["user"], password=cfg["password"],
+                                 db=cfg["database"], autocommit=False)
+    return _MysqlAsyncConnection(raw)
+
+
+class AsyncPool:
+    # bounded pool; acquire() waits up to timeout seconds for a free connection
+    def __init__(self, size=POOL_SIZE, timeout=POOL_TIMEOUT):
+        self.size = size
+        self.timeout = timeout
+        self._idle = []
+        self._slots = asyncio.Semaphore(size)
+        self.checkouts = 0
+        self.created = 0
+        self.timeouts = 0
+        self.wait_total = 0.0
+
+    @asynccontextmanager
+    async def acquire(self):
+        started = time.monotonic()
+        try:
+            await asyncio.wait_for(self._slots.acquire(), self.timeout)
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            raise db.PoolTimeout(f"no async connection available within {self.timeout}s")
+        self.wait_total += time.monotonic() - started
+        self.checkouts += 1
+        try:
+            conn = self._idle.pop() if self._idle else None
+            if conn is None:
+                conn = await _connect()
+                self.created += 1
+        except BaseException:
+            self._slots.release()
+            raise
+        try:
+            yield conn
+        finally:
+            try:
+                # never hand back a connection with an open transaction
+                await conn.rollback()
+                self._idle.append(conn)
+            except Exception:
+                # broken connection: discard it
+                try:
+                    await conn.close()
+                except Exception:
+                    pass
+            self._slots.release()
+
+    def stats(self):
+        return {
+            "size": self.size,
+            "idle": len(self._idle),
+            "checkouts": self.checkouts,
+            "created": self.created,
+            "timeouts": self.timeouts,
+            "wait_avg": self.wait_total / self.checkouts if self.checkouts else 0.0,
+        }
+
+    async def close(self):
+        while self._idle:
+            await self._idle.pop().close()
+
+
+_pool = None
+_pool_lock = asyncio.Lock()
+
+
+async def get_pool():
+    # created on first use in the running event loop; the sync pool creates the schema
+    global _pool
+    if _pool is not None:
+        return _pool
+    async with _pool_lock:
+        if _pool is None:
+            await asyncio.to_thread(db.get_pool)
+            _pool = AsyncPool()
+    return _pool
+
+
+async def close_pool():
+    global _pool
+    if _pool is not None:
+        await _pool.close()
+        _pool = None
@@ -0,0 +1,339 @@
+import argparse
+import atexit
+import os
+import threading
+import time
+from decimal import Decimal
+
+import db
+
+# Seller analytics: listing views, cart adds and sales per day, per listing
+# and per category. Request handlers only count events in memory
+# (record_view, record_cart_add, record_sales); a background thread adds the
+# pending counts to two rollup tables (migration 4) every FLUSH_INTERVAL
+# seconds, or sooner once MAX_PENDING (listing, day) keys are waiting:
+#   product_daily    (seller_id, day, product_id) -> views, cart_adds, units_sold, revenue
+#   category_daily   (seller_id, day, category)   -> the same, summed over the seller's listings
+# One flush is one transaction of two executemany upserts, however many
+# events it carries. The dashboard reads only these tables, so it costs the
+# same whatever the order volume: at most days x categories rows for the
+# series and a seller's active listings x days for the top listings, read in
+# primary key order. Events on listings without a seller are not kept.
+# Counts still in memory when a process is killed are lost (a normal exit
+# flushes them); sales can be rebuilt from the orders with
+#   python analytics.py backfill [--days 365]
+# Seller and category are looked up when a batch is flushed, and revenue uses
+# the price at checkout time. The backfill takes that price from the order
+# lines (migration 11); lines bought before it was recorded are counted at
+# the listing's current price.
+ENABLED = os.environ.get("ECOFINDS_ANALYTICS", "1") == "1"
+FLUSH_INTERVAL = float(os.environ.get("ECOFINDS_ANALYTICS_FLUSH_INTERVAL", "5"))
+MAX_PENDING = int(os.environ.get("ECOFINDS_ANALYTICS_MAX_PENDING", "5000"))
+# dashboard date ranges, in days
+RANGES = (7, 30, 90)
+TOP_LISTINGS = 20
+# ids per "WHERE id IN (...)" when looking up sellers and categories
+LOOKUP_CHUNK = 500
+
+COUNTERS = ("views", "cart_adds", "units_sold", "revenue")
+if db.DB_BACKEND == "sqlite":
+    _UPSERT = " ON CONFLICT ({key}) DO UPDATE SET " + ", ".join(f"{c} = {c} + excluded.{c}" for c in COUNTERS)
+    DAY_SQL = "o.created_at / 86400"
+else:
+    _UPSERT = " ON DUPLICATE KEY UPDATE " + ", ".join(f"{c} = {c} + VALUES({c})" for c in COUNTERS)
+    DAY_SQL = "o.created_at DIV 86400"
+PRODUCT_UPSERT_SQL = ("INSERT INTO product_daily (seller_id, day, product_id, views, cart_adds, units_sold, revenue) "
+                      "VALUES (%s,%s,%s,%s,%s,%s,%s)" + _UPSERT.format(key="seller_id, day, product_id"))
+CATEGORY_UPSERT_SQL = ("INSERT INTO category_daily (seller_id, day, category, views, cart_adds, units_sold, revenue) "
+                       "VALUES (%s,%s,%s,%s,%s,%s,%s)" + _UPSERT.format(key="seller_id, day, category"))
+TOTALS = "SUM(views) AS views, SUM(cart_adds) AS cart_adds, SUM(units_sold) AS units_sold, SUM(revenue) AS revenue"
+
+
+def day_number(ts=None):
+    # UTC days since the epoch
+    return int((time.time() if ts is None else ts) // 86400)
+
+
+def day_date(day):
+    return time.strftime("%Y-%m-%d", time.gmtime(day * 86400))
+
+
+# ------------------ EVENT BUFFER ------------------
+class EventBuffer:
+    def __init__(self):
+        # (product_id, day) -> [views, cart_adds, units_sold, revenue]
+        self._counts = {}
+        self._lock = threading.Lock()
+        self.events = 0
+        self.flushes = 0
+        self.failed_flushes = 0
+        self.last_flush = None
+
+    def add(self, product_id, day, views=0, cart_adds=0, units=0, revenue=0):
+        # returns the number of pending keys
+        with self._lock:
+            counts = self._counts.get((product_id, day))
+            if counts is None:
+                counts = self._counts[(product_id, day)] = [0, 0, 0, Decimal(0)]
+            counts[0] += views
+            counts[1] += cart_adds
+            counts[2] += units
+            counts[3] += revenue
+            self.events += 1
+            return len(self._counts)
+
+    def take(self):
+        with self._lock:
+            counts, self._counts = self._counts, {}
+        return counts
+
+    def restore(self, counts):
+        # put back the counts of a failed flush
+        with self._lock:
+            for key, (views, cart_adds, units, revenue) in counts.items():
+                mine = self._counts.setdefault(key, [0, 0, 0, Decimal(0)])
+                mine[0] += views
+                mine[1] += cart_adds
+                mine[2] += units
+                mine[3] += revenue
+
+    def stats(self):
+        with self._lock:
+            return {"pending": len(self._counts), "events": self.events, "flushes": self.flushes,
+                    "failed_flushes": self.failed_flushes, "last_flush": self.last_flush}
+
+
+_buffer = EventBuffer()
+_wake = threading.Event()
+
+
+def _record(product_id, **counts):
+    if not ENABLED or not product_id:
+        return
+    if _buffer.add(int(product_id), day_number(), **counts) >= MAX_PENDING:
+        _wake.set()
+
+
+def record_view(product_id):
+    _record(product_id, views=1)
+
+
+def record_cart_add(product_id):
+    _record(product_id, cart_adds=1)
+
+
+def record_sales(counts, prices):
+    # after a committed checkout: counts is {product_id: quantity}, prices {product_id: unit price}
+    for pid, qty in counts.items():
+        _record(pid, units=qty, revenue=Decimal(str(prices.get(pid) or 0)) * qty)
+
+
+# ------------------ FLUSHING ------------------
+def _owners(cursor, product_ids):
+    # product_id -> (seller_id, category) for listings that still exist
+    ids = sorted(product_ids)
+    owners = {}
+    for i in range(0, len(ids), LOOKUP_CHUNK):
+        chunk = ids[i:i + LOOKUP_CHUNK]
+        placeholders = ','.join(['%s'] * len(chunk))
+        cursor.execute(f"SELECT id, user_id, category FROM products WHERE id IN ({placeholders})", tuple(chunk))
+        for pid, seller_id, category in cursor.fetchall():
+            owners[pid] = (seller_id, category or "")
+    return owners
+
+
+def _write(cursor, counts):
+    # add {(product_id, day): [views, cart_adds, units, revenue]} to both rollups
+    owners = _owners(cursor, {pid for pid, _ in counts})
+    product_rows = []
+    category_totals = {}
+    for (pid, day), (views, cart_adds, units, revenue) in counts.items():
+        seller_id, category = owners.get(pid, (None, None))
+        if seller_id is None:
+            continue  # deleted since, or no seller
+        product_rows.append((seller_id, day, pid, views, cart_adds, units, str(revenue)))
+        totals = category_totals.setdefault((seller_id, day, category), [0, 0, 0, Decimal(0)])
+        totals[0] += views
+        totals[1] += cart_adds
+        totals[2] += units
+        totals[3] += revenue
+    # rows go in key order so concurrent flushes from several processes can't deadlock
+    if product_rows:
+        cursor.executemany(PRODUCT_UPSERT_SQL, sorted(product_rows))
+    if category_totals:
+        cursor.executemany(CATEGORY_UPSERT_SQL, [(s, d, c, v, a, u, str(r)) for (s, d, c), (v, a, u, r)
+                                                 in sorted(category_totals.items())])
+    return len(product_rows)
+
+
+def flush():
+    # write everything pending; returns the number of (listing, day) rows written
+    counts = _buffer.take()
+    if not counts:
+        return 0
+    conn = db.get_db_connection()
+    cursor = conn.cursor()
+    try:
+        conn.begin()
+        written = _write(cursor, counts)
+        conn.commit()
+    except Exception as e:
+        conn.rollback()
+        _buffer.restore(counts)
+        _buffer.failed_flushes += 1
+        print(f"Warning: analytics flush failed, keeping {len(counts)} pending counts: {e}")
+        return 0
+    finally:
+        cursor.close()
+        conn.close()
+    _buffer.flushes += 1
+    _buffer.last_flush = int(time.time())
+    return written
+
+
+_flusher = None
+
+
+def start_flusher(interval=FLUSH_INTERVAL):
+    # daemon thread flushing every interval seconds, or early when the buffer fills
+    global _flusher
+    if _flusher is not None:
+        return _flusher
+
+    def run():
+        while True:
+            _wake.wait(interval)
+            _wake.clear()
+            try:
+                flush()
+            except Exception as e:
+                print(f"Warning: analytics flush failed: {e}")
+
+    _flusher = threading.Thread(target=run, name="analytics-flusher", daemon=True)
+    _flusher.start()
+    atexit.register(flush)
+    return _flusher
+
+
+def stats():
+    return _buffer.stats()
+
+
+# ------------------ DASHBOARD ------------------
+def _totals(row):
+    return {
+        "views": int(row.get("views") or 0),
+        "cart_adds": int(row.get("cart_adds") or 0),
+        "units_sold": int(row.get("units_sold") or 0),
+        "revenue": Decimal(str(row.get("revenue") or 0)).quantize(Decimal("0.01")),
+    }
+
+
+def seller_report(conn, seller_id, days=30):
+    # the seller's last `days` days (today included): totals, one entry per
+    # day, per category and the top listings by revenue
+    first_day = day_number() - days + 1
+    cursor = conn.cursor(dictionary=True)
+    cursor.execute(f"SELECT day, {TOTALS} FROM category_daily WHERE seller_id=%s AND day >= %s GROUP BY day",
+                   (seller_id, first_day))
+    by_day = {r["day"]: _totals(r) for r in cursor.fetchall()}
+    cursor.execute(f"SELECT category, {TOTALS} FROM category_daily WHERE seller_id=%s AND day >= %s "
+                   "GROUP BY category ORDER BY SUM(revenue) DESC, SUM(views) DESC", (seller_id, first_day))
+    categories = [dict(_totals(r), category=r["category"] or "Uncategorised") for r in cursor.fetchall()]
+    cursor.execute(f"SELECT product_id, {TOTALS} FROM product_daily WHERE seller_id=%s AND day >= %s "
+                   "GROUP BY product_id ORDER BY SUM(revenue) DESC, SUM(views) DESC LIMIT %s",
+                   (seller_id, first_day, TOP_LISTINGS))
+    listings = [dict(_totals(r), product_id=r["product_id"], title=None) for r in cursor.fetchall()]
+    # titles only for the rows shown, not for every row aggregated
+    if listings:
+        placeholders = ','.join(['%s'] * len(listings))
+        cursor.execute(f"SELECT id, title FROM products WHERE id IN ({placeholders})",
+                       tuple(p["product_id"] for p in listings))
+        titles = {r["id"]: r["title"] for r in cursor.fetchall()}
+        for p in listings:
+            p["title"] = titles.get(p["product_id"])
+    cursor.close()
+
+    series = []
+    totals = _totals({})
+    for day in range(first_day, first_day + days):
+        entry = by_day.get(day) or _totals({})
+        series.append(dict(entry, date=day_date(day)))
+        for key in COUNTERS:
+            totals[key] += entry[key]
+    peak = max([1] + [e["views"] for e in series])
+    for entry in series:
+        entry["bar"] = round(entry["views"] * 100 / peak)
+    totals["conversion"] = round(totals["units_sold"] * 100 / totals["views"], 1) if totals["views"] else None
+    return {"days": days, "totals": totals, "series": series, "categories": categories, "listings": listings}
+
+
+# ------------------ BACKFILL ------------------
+def backfill(days=365, log=print):
+    # recompute units_sold and revenue for the last `days` days from the orders
+    # (views and cart adds only exist as rollups). Sales buffered by running
+    # processes at that moment are added on top when they flush. Order lines
+    # without a recorded price are counted at the listing's current price.
+    first_day = day_number() - days + 1
+    conn = db.get_db_connection()
+    cursor = conn.cursor()
+    try:
+        conn.begin()
+        cursor.execute("UPDATE product_daily SET units_sold = 0, revenue = 0 WHERE day >= %s", (first_day,))
+        cursor.execute("UPDATE category_daily SET units_sold = 0, revenue = 0 WHERE day >= %s", (first_day,))
+        cursor.execute(f"SELECT oi.product_id, {DAY_SQL} AS day, SUM(oi.quantity), "
+                       "SUM(oi.quantity * COALESCE(oi.price, p.price)) "
+                       "FROM orders o JOIN order_items oi ON oi.order_id = o.id JOIN products p ON p.id = oi.product_id "
+                       "WHERE o.created_at >= %s GROUP BY oi.product_id, day", (first_day * 86400,))
+        counts = {(pid, int(day)): [0, 0, int(units), Decimal(str(revenue or 0))]
+                  for pid, day, units, revenue in cursor.fetchall()}
+        written = _write(cursor, counts)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+        conn.close()
+    log(f"Rebuilt sales for {written} listing-days since {day_date(first_day)}")
+    return written
+
+
+# ------------------ HTTP ------------------
+def debug_analytics():
+    # dev helper: buffered event counts and flush history
+    return dict(stats(), enabled=ENABLED, flush_interval=FLUSH_INTERVAL)
+
+
+def init_app(app):
+    app.add_url_rule("/debug_analytics", "debug_analytics", debug_analytics)
+    if ENABLED:
+        start_flusher()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Maintain the seller analytics rollups.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    fill = sub.add_parser("backfill", help="rebuild sales counters from the orders; revenue of order lines "
+                                           "from before migration 11 uses the listing's current price")
+    fill.add_argument("--days", type=int, default=365)
+    report = sub.add_parser("report", help="print a seller's report")
+    report.add_argument("--seller", type=int, required=True, help="seller user id")
+    report.add_argument("--days", type=int, default=30)
+    args = parser.parse_args()
+
+    if args.command == "backfill":
+        backfill(args.days)
+        return
+    conn = db.get_db_connection()
+    data = seller_report(conn, args.seller, args.days)
+    conn.close()
+    t = data["totals"]
+    print(f"last {args.days} days: {t['views']} views, {t['cart_adds']} cart adds, "
+          f"{t['units_sold']} sold, {t['revenue']} revenue")
+    for c in data["categories"]:
+        print(f"  {c['category']:<20} {c['views']:>8} views {c['units_sold']:>6} sold {c['revenue']:>12}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,213 @@
+import gzip
+import hashlib
+import json
+from decimal import Decimal
+
+from flask import Response, request, session
+
+try:
+    import orjson
+except ImportError:
+    # orjson is optional; the json module is the slower fallback
+    orjson = None
+
+try:
+    import brotli
+except ImportError:
+    # brotli is optional; gzip is always available
+    brotli = None
+
+import db
+import facets
+import fragments
+import images
+import pagination
+import purchases
+import repository
+
+# Read-only JSON API for the mobile client and crawlers, versioned by path:
+#   GET /api/v1/products          listings, newest first; category, min_price,
+#                                 max_price, sort and cursor as on /products
+#   GET /api/v1/products/<id>     one listing with its description and seller
+#   GET /api/v1/categories        categories and how many listings each has
+#   GET /api/v1/purchases         the logged-in user's orders, newest first
+# - Lists are keyset pages ({"items": [...], "next_cursor", "prev_cursor"});
+#   pass a cursor back as ?cursor= for the next page.
+# - fields=a,b keeps only those fields of each item (FIELDS); an unknown
+#   field is a 400.
+# - Responses carry a weak ETag derived from the rows they show: the
+#   (id, version) of each listing (products.version, migration 9), the facet
+#   counts, the user's order ids; plus the query. A matching If-None-Match
+#   gets a 304 before anything is serialized. Weak, because the same data is
+#   sent plain, gzip'd or brotli'd.
+# - Bodies are encoded with orjson when it is installed and compressed (br,
+#   else gzip) when the client accepts it and they are MIN_COMPRESS_SIZE or
+#   more.
+# - Listing pages come from the fragment cache (their own entries, with
+#   API_COLUMNS) and detail reads the replica, as the HTML pages do.
+# Errors are {"error": message} with a 4xx status.
+PREFIX = "/api/v1"
+API_COLUMNS = "id, user_id, title, category, price, image_url, image_variants, version"
+FIELDS = {
+    "product": ("id", "title", "category", "price", "seller_id", "image", "images"),
+    "product_detail": ("id", "title", "description", "category", "price", "stock", "seller_id", "seller",
+                       "image", "images"),
+    "category": ("name", "listings"),
+    "order": ("id", "created_at", "items"),
+}
+MIN_COMPRESS_SIZE = 512
+# per response, so far below the quality assets.py spends on static files
+BROTLI_QUALITY = 4
+GZIP_LEVEL = 6
+
+_json = json.JSONEncoder(ensure_ascii=False, separators=(",", ":"), check_circular=False)
+
+
+class ApiError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+def dumps(value):
+    # bytes of value as JSON; prices are converted by the serializers
+    return orjson.dumps(value) if orjson is not None else _json.encode(value).encode()
+
+
+def _number(value):
+    # mysql returns DECIMAL prices as Decimal
+    return float(value) if isinstance(value, Decimal) else value
+
+
+def _fields(kind):
+    # the fields= selection (None: all of them)
+    raw = request.args.get("fields")
+    if not raw:
+        return None
+    fields = tuple(dict.fromkeys(f.strip() for f in raw.split(",") if f.strip()))
+    unknown = [f for f in fields if f not in FIELDS[kind]]
+    if unknown:
+        raise ApiError(400, f"unknown field {unknown[0]!r}; use {', '.join(FIELDS[kind])}")
+    return fields
+
+
+def _project(item, fields):
+    return item if fields is None else {f: item[f] for f in fields}
+
+
+def _etag(*parts):
+    return hashlib.blake2b(repr(parts).encode(), digest_size=12).hexdigest()
+
+
+def _compress(resp):
+    body = resp.get_data()
+    if len(body) < MIN_COMPRESS_SIZE:
+        return
+    accepted = request.accept_encodings
+    if brotli is not None and accepted["br"]:
+        resp.set_data(brotli.compress(body, quality=BROTLI_QUALITY))
+        resp.headers["Content-Encoding"] = "br"
+    elif accepted["gzip"]:
+        resp.set_data(gzip.compress(body, compresslevel=GZIP_LEVEL, mtime=0))
+        resp.headers["Content-Encoding"] = "gzip"
+
+
+def _respond(etag, build, private=False):
+    # 304 if the client has this version, else build() encoded and compressed
+    if request.if_none_match.contains_weak(etag):
+        resp = Response(status=304)
+    else:
+        resp = Response(dumps(build()), mimetype="application/json")
+        _compress(resp)
+    resp.set_etag(etag, weak=True)
+    resp.vary.add("Accept-Encoding")
+    resp.cache_control.no_cache = True
+    if private:
+        resp.cache_control.private = True
+        resp.vary.add("Cookie")
+    else:
+        resp.cache_control.public = True
+    return resp
+
+
+# ------------------ REPRESENTATIONS ------------------
+def _images(key, variants):
+    # (original URL, {variant: URL}) of a listing's image
+    if not key:
+        return None, {}
+    manifest = images.parse_variants(variants)
+    return images.upload_url(key), {v: images.variant_url(key, v) for v in images.VARIANTS if v in manifest}
+
+
+def _product(row):
+    image, variants = _images(row["image_url"], row["image_variants"])
+    return {"id": row["id"], "title": row["title"], "category": row["category"], "price": _number(row["price"]),
+            "seller_id": row["user_id"], "image": image, "images": variants}
+
+
+def _product_detail(row):
+    return dict(_product(row), description=row["description"], stock=row["stock"], seller=row["seller"])
+
+
+def _order(order):
+    return {"id": order["id"], "created_at": order["timestamp"],
+            "items": [{"product_id": p["id"], "title": p["title"], "price": _number(p["price"]), "qty": p["qty"],
+                       "image": _images(p["image_url"], None)[0]} for p in order["products"]]}
+
+
+# ------------------ ENDPOINTS ------------------
+def products():
+    filters = pagination.filters_from_args(request.args)
+    token = request.args.get("cursor")
+    fields = _fields("product")
+    page = fragments.listing_page(API_COLUMNS, filters, token)
+    etag = _etag("products", filters, token, fields, [(p["id"], p["version"]) for p in page.items])
+    return _respond(etag, lambda: {"items": [_project(_product(p), fields) for p in page.items],
+                                   "next_cursor": page.next_cursor, "prev_cursor": page.prev_cursor})
+
+
+def product(product_id):
+    fields = _fields("product_detail")
+    conn = db.get_read_connection()
+    row = repository.product_detail(conn, product_id)
+    conn.close()
+    if not row:
+        raise ApiError(404, "no such product")
+    # the seller's name is not part of the row's version
+    etag = _etag("product", product_id, row["version"], row["seller"], fields)
+    return _respond(etag, lambda: _project(_product_detail(row), fields))
+
+
+def categories():
+    fields = _fields("category")
+    counts = sorted(facets.category_counts().items())
+    return _respond(_etag("categories", counts, fields),
+                    lambda: {"items": [_project({"name": c, "listings": n}, fields) for c, n in counts]})
+
+
+def purchase_history():
+    if "user_id" not in session:
+        raise ApiError(401, "login required")
+    user_id = session["user_id"]
+    token = request.args.get("cursor")
+    fields = _fields("order")
+    conn = db.get_read_connection()
+    orders, next_cursor = purchases.order_history(conn, user_id, token)
+    conn.close()
+    # orders don't change; their lines show the listings' current title and price
+    versions = [(o["id"], [(p["id"], p.get("version")) for p in o["products"]]) for o in orders]
+    etag = _etag("purchases", user_id, token, fields, versions)
+    return _respond(etag, lambda: {"items": [_project(_order(o), fields) for o in orders],
+                                   "next_cursor": next_cursor}, private=True)
+
+
+def _error(e):
+    return {"error": str(e)}, e.status
+
+
+def init_app(app):
+    app.add_url_rule(f"{PREFIX}/products", "api_products", products)
+    app.add_url_rule(f"{PREFIX}/products/<int:product_id>", "api_product", product)
+    app.add_url_rule(f"{PREFIX}/categories", "api_categories", categories)
+    app.add_url_rule(f"{PREFIX}/purchases", "api_purchases", purchase_history)
+    app.register_error_handler(ApiError, _error)
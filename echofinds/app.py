@@ -1,15 +1,56 @@
 from flask import Flask, render_template, request, redirect, session, url_for
 import db
+import search
+import pagination
+import product_ids
+import purchases
+import images
+import storage
+import assets
+import carts
+import credentials
+import fragments
+import metrics
+import bulk
+import analytics
+import recommend
+import jobs
+import repository
+import facets
+import archive
+import api
 import os
 import time
-from werkzeug.utils import secure_filename
 
 app = Flask(__name__)
 app.secret_key = "supersecretkey"  # required for session management
-
-# Directory to store uploaded product images (relative to project)
-UPLOAD_DIR = os.path.join(os.path.dirname(__file__), 'static', 'uploads')
-os.makedirs(UPLOAD_DIR, exist_ok=True)
+# hand request-scoped pooled connections back to the pool after each request
+db.init_app(app)
+# image variants and upload cleanup run on the background job queue (see jobs.py)
+jobs.init_app(app)
+# template helpers for responsive image variants
+images.init_app(app)
+# fingerprinted, long-lived caching for /static (see assets.py)
+assets.init_app(app)
+# carts live server-side; the cookie only holds a guest token (see carts.py)
+carts.init_app(app)
+# cached product cards and detail pages, invalidated on product writes (see fragments.py)
+fragments.init_app(app)
+# per-route latency, query counts, N+1 warnings and /metrics (see metrics.py)
+metrics.init_app(app)
+# CSV / JSON Lines listing import and export (see bulk.py)
+bulk.init_app(app)
+# buffered view / cart / sale counters rolled up per day for sellers (see analytics.py)
+analytics.init_app(app)
+# precomputed "similar items" per listing, kept current by a background model (see recommend.py)
+recommend.init_app(app)
+# read-only JSON API under /api/v1 with ETags and compression (see api.py)
+api.init_app(app)
+
+# Directory to store uploaded product images (see storage.py for the backends)
+UPLOAD_DIR = storage.UPLOAD_DIR
+# reject oversized request bodies before they are parsed
+app.config['MAX_CONTENT_LENGTH'] = storage.MAX_UPLOAD_BYTES + 1024 * 1024
 
 # Root route to avoid "URL not found" when visiting /
 @app.route("/")
@@ -20,30 +61,22 @@ def index():
     return redirect(url_for("login"))
 
 
-# Keep the session cart in sync with products table: remove ids that were deleted
+# Views that read the cart; only these need it validated
+CART_ENDPOINTS = {'cart', 'checkout'}
+
+
+# Keep the cart in sync with products table: remove ids that were deleted
 @app.before_request
 def sanitize_cart():
-    cart = session.get('cart', [])
+    if request.endpoint not in CART_ENDPOINTS:
+        return
+    cart = carts.get_cart()
     if not cart:
         return
-    # check which ids still exist in products
+    # check which ids still exist (in-memory bitmap, DB only for unknown ids)
     try:
-        conn = db.get_db_connection()
-        cursor = conn.cursor(dictionary=True)
-        unique_ids = sorted(set(cart))
-        placeholders = ','.join(['%s'] * len(unique_ids))
-        query = f"SELECT id FROM products WHERE id IN ({placeholders})"
-        cursor.execute(query, tuple(unique_ids))
-        rows = cursor.fetchall()
-        existing = {r['id'] for r in rows}
-        cursor.close()
-        conn.close()
-        if existing:
-            new_cart = [pid for pid in cart if pid in existing]
-        else:
-            new_cart = []
-        if len(new_cart) != len(cart):
-            session['cart'] = new_cart
+        existing = product_ids.existing(cart)
+        carts.discard_items([pid for pid in cart if pid not in existing])
     except Exception:
         # If DB check fails, silently continue (don't break requests)
         pass
@@ -61,12 +94,15 @@ def signup():
     if request.method == "POST":
         username = request.form["username"]
         email = request.form["email"]
-        password = request.form["password"]
+        try:
+            password_hash = credentials.hash_password(request.form["password"])
+        except credentials.HashPoolBusy:
+            return "Server busy, please try again", 503
 
         conn = db.get_db_connection()
         cursor = conn.cursor()
         cursor.execute("INSERT INTO users (username, email, password) VALUES (%s, %s, %s)",
-                       (username, email, password))
+                       (username, email, password_hash))
         conn.commit()
         cursor.close()
         conn.close()
@@ -79,17 +115,36 @@ def login():
     if request.method == "POST":
         email = request.form["email"]
         password = request.form["password"]
+        retry_after = credentials.login_retry_after(request.remote_addr, email)
+        if retry_after:
+            return "Too many login attempts, try again later", 429, {"Retry-After": str(retry_after)}
 
         conn = db.get_db_connection()
         cursor = conn.cursor(dictionary=True)
-        cursor.execute("SELECT * FROM users WHERE email=%s AND password=%s", (email, password))
+        cursor.execute("SELECT id, username, password FROM users WHERE email=%s", (email,))
         user = cursor.fetchone()
         cursor.close()
-        conn.close()
+        # don't hold a pooled connection while the hash workers run
+        db.release_request_connection()
+        try:
+            ok, new_hash = credentials.check_password(password, user["password"] if user else None)
+        except credentials.HashPoolBusy:
+            return "Server busy, please try again", 503
+        if ok and new_hash:
+            # plaintext or outdated hash: store the upgraded one (unless changed meanwhile)
+            conn = db.get_db_connection()
+            cursor = conn.cursor()
+            cursor.execute("UPDATE users SET password=%s WHERE id=%s AND password=%s",
+                           (new_hash, user["id"], user["password"]))
+            conn.commit()
+            cursor.close()
+            conn.close()
 
-        if user:
+        if ok:
             session["user_id"] = user["id"]
             session["username"] = user["username"]
+            # items added before logging in join the account cart
+            carts.merge_guest_cart(user["id"])
             return redirect("/dashboard")
         else:
             return "Invalid Credentials"
@@ -108,64 +163,64 @@ def dashboard():
     if "user_id" not in session:
         return redirect("/login")
 
-    conn = db.get_db_connection()
-    cursor = conn.cursor(dictionary=True)
-    cursor.execute("SELECT * FROM users WHERE id=%s", (session["user_id"],))
-    user = cursor.fetchone()
-    cursor.close()
+    conn = db.get_read_connection()
+    user = repository.user(conn, session["user_id"])
     conn.close()
 
-    # also fetch all products to show on the landing dashboard
-    conn = db.get_db_connection()
-    cursor = conn.cursor(dictionary=True)
-    cursor.execute("SELECT * FROM products ORDER BY id DESC")
-    products = cursor.fetchall()
-    cursor.close()
-    conn.close()
+    # one page of products for the landing dashboard (cached; the user row above is not)
+    page = fragments.listing_page(pagination.CARD_COLUMNS_WITH_SUMMARY, token=request.args.get('cursor'))
 
-    return render_template("dashboard.html", user=user, products=products)
+    return render_template("dashboard.html", user=user, products=page.items, page=page)
 
 
 # ------------------ PRODUCTS ------------------
 @app.route("/products")
 def products():
-    # support simple search via ?q= term
+    # support simple search via ?q= term (served from the in-process search index)
     q = request.args.get('q', '').strip()
-    category = request.args.get('category', '').strip()
-    conn = db.get_db_connection()
-    cursor = conn.cursor(dictionary=True)
-    # build base query and params
-    if q and category:
-        like = f"%{q}%"
-        cursor.execute("SELECT * FROM products WHERE (title LIKE %s OR description LIKE %s) AND category=%s", (like, like, category))
-    elif q:
-        like = f"%{q}%"
-        cursor.execute("SELECT * FROM products WHERE title LIKE %s OR description LIKE %s", (like, like))
-    elif category:
-        cursor.execute("SELECT * FROM products WHERE category=%s", (category,))
+    # category, price range and sort order
+    filters = pagination.filters_from_args(request.args)
+    category = filters.category or ''
+    category_counts = {}
+    histogram = []
+    token = request.args.get('cursor')
+    if q:
+        # relevance ordered (or sorted in the index), so search results page by offset into the ranking
+        offset = pagination.offset_window(token)
+        ranked, category_counts = search.search(q, filters.category, limit=offset + pagination.PAGE_SIZE + 1,
+                                                min_price=filters.min_price, max_price=filters.max_price,
+                                                sort=filters.sort)
+        window = ranked[offset:offset + pagination.PAGE_SIZE]
+        items = []
+        if window:
+            conn = db.get_read_connection()
+            by_id = {r.id: r for r in repository.products_by_ids(conn, window, pagination.CARD_COLUMNS)}
+            conn.close()
+            # keep the order from the index
+            items = [by_id[pid] for pid in window if pid in by_id]
+        page = pagination.offset_page(items, offset, len(ranked) > offset + pagination.PAGE_SIZE)
     else:
-        cursor.execute("SELECT * FROM products")
-    items = cursor.fetchall()
-    # fetch categories for filter dropdown
-    cursor.execute("SELECT DISTINCT category FROM products WHERE category IS NOT NULL AND category <> ''")
-    cats = cursor.fetchall()
-    categories = [c['category'] for c in cats]
-    cursor.close()
-    conn.close()
-    return render_template("products.html", products=items, q=q, categories=categories, category=category)
+        # browse pages are cached and invalidated when a product on them changes
+        page = fragments.listing_page(pagination.CARD_COLUMNS, filters, token)
+        histogram = facets.histogram(filters.category)
+    # the dropdown and the price histogram come from the facet table, not a scan of products
+    categories = facets.categories()
+    return render_template("products.html", products=page.items, page=page, q=q, categories=categories,
+                           category=category, facets=category_counts, filters=filters,
+                           filter_args=pagination.filter_args(filters), histogram=histogram)
 
 
 @app.route('/products/<int:product_id>')
 def product_detail(product_id):
-    conn = db.get_db_connection()
-    cursor = conn.cursor(dictionary=True)
-    cursor.execute('SELECT p.*, u.username as seller FROM products p LEFT JOIN users u ON p.user_id=u.id WHERE p.id=%s', (product_id,))
-    prod = cursor.fetchone()
-    cursor.close()
-    conn.close()
-    if not prod:
+    # the product body is rendered once and cached; the header is per user
+    cached = fragments.product_detail(product_id)
+    if not cached:
         return redirect(url_for('products'))
-    return render_template('product_detail.html', product=prod)
+    title, detail = cached
+    analytics.record_view(product_id)
+    # stored neighbours: one primary-key read, outside the cached body so rebuilds show up
+    similar = recommend.similar_products(product_id)
+    return render_template('product_detail.html', title=title, detail=detail, similar=similar)
 
 
 @app.route('/edit_product/<int:product_id>', methods=['GET', 'POST'])
@@ -174,17 +229,13 @@ def edit_product(product_id):
         return redirect(url_for('login'))
 
     conn = db.get_db_connection()
-    cursor = conn.cursor(dictionary=True)
-    cursor.execute('SELECT * FROM products WHERE id=%s', (product_id,))
-    prod = cursor.fetchone()
+    prod = repository.product(conn, product_id)
     if not prod:
-        cursor.close()
         conn.close()
         return redirect(url_for('dashboard'))
 
     # only owner can edit
     if prod.get('user_id') != session.get('user_id'):
-        cursor.close()
         conn.close()
         return redirect(url_for('dashboard'))
 
@@ -196,73 +247,97 @@ def edit_product(product_id):
 
         # optional new image
         image_filename = prod.get('image_url')
+        uploaded = False
         if 'image' in request.files:
             f = request.files['image']
             if f and f.filename:
-                filename = secure_filename(f.filename)
-                filename = f"{session['user_id']}_{int(time.time())}_{filename}"
-                dest = os.path.join(UPLOAD_DIR, filename)
-                f.save(dest)
-                print(f"Saved uploaded image (edit): {dest}")
-                image_filename = filename
-
+                try:
+                    image_filename = images.save_upload(f)
+                    uploaded = True
+                except (images.InvalidImage, storage.UploadTooLarge) as e:
+                    conn.close()
+                    return render_template('edit_product.html', product=prod, error=str(e))
+                print(f"Saved uploaded image (edit): {image_filename}")
+
+        image_changed = image_filename != prod.get('image_url')
+        price_changed = str(price) != str(prod.get('price'))
         upd_cursor = conn.cursor()
-        upd_cursor.execute('UPDATE products SET title=%s, description=%s, category=%s, price=%s, image_url=%s WHERE id=%s',
-                           (title, description, category, price, image_filename, product_id))
+        if image_changed:
+            # variants come from an earlier upload of the same content or are rebuilt in the background
+            upd_cursor.execute('UPDATE products SET title=%s, description=%s, category=%s, price=%s, image_url=%s, '
+                               'image_variants=%s, version = version + 1 WHERE id=%s',
+                               (title, description, category, price, image_filename,
+                                images.stored_variants(image_filename), product_id))
+        else:
+            upd_cursor.execute('UPDATE products SET title=%s, description=%s, category=%s, price=%s, '
+                               'version = version + 1 WHERE id=%s',
+                               (title, description, category, price, product_id))
+        facets.adjust(upd_cursor, removed=[(prod.get('category'), prod.get('price'))], added=[(category, price)])
         conn.commit()
+        facets.invalidate()
+        if uploaded:
+            # the upload took a reference on its image, even when it is the current one
+            storage.release(prod.get('image_url'))
+        if image_changed:
+            images.schedule_variants(image_filename)
+        search.index_product(product_id, title, description, category, price)
+        fragments.product_changed(product_id, prod.get('category'), category, price_changed)
+        recommend.product_changed(product_id)
         upd_cursor.close()
-        cursor.close()
         conn.close()
         return redirect(url_for('dashboard'))
 
-    cursor.close()
     conn.close()
     return render_template('edit_product.html', product=prod)
 
 
 @app.route('/checkout', methods=['POST'])
 def checkout():
-    # move items from cart to session orders as a simple purchase record
-    cart = session.get('cart', [])
+    # turn the cart into an order
+    cart = carts.get_cart()
     if not cart:
         return redirect(url_for('cart'))
-    # If user is logged in, persist to DB (orders + order_items). Otherwise use session orders.
+    # If user is logged in, persist to DB (orders + order_items). Otherwise keep a guest order record.
     if session.get('user_id'):
+        counts = cart
+        # lock rows in id order so concurrent checkouts can't deadlock
+        ids = sorted(counts)
         conn = db.get_db_connection()
         cursor = conn.cursor()
-        # ensure tables exist (simple schema creation; idempotent)
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS orders (
-                id INT PRIMARY KEY AUTO_INCREMENT,
-                user_id INT,
-                created_at BIGINT
-            ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
-        ''')
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS order_items (
-                id INT PRIMARY KEY AUTO_INCREMENT,
-                order_id INT,
-                product_id INT
-            ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
-        ''')
-        conn.commit()
-
-        cursor.execute('INSERT INTO orders (user_id, created_at) VALUES (%s,%s)', (session['user_id'], int(time.time())))
-        order_id = cursor.lastrowid
-        if cart:
-            for pid in cart:
-                cursor.execute('INSERT INTO order_items (order_id, product_id) VALUES (%s,%s)', (order_id, pid))
-        conn.commit()
-        cursor.close()
-        conn.close()
-        session['cart'] = []
+        try:
+            conn.begin()
+            locked = repository.lock_products(conn, ids)
+            stock = {pid: units for pid, units, _ in locked}
+            prices = {pid: price for pid, _, price in locked}
+            if any(stock.get(pid, 0) < qty for pid, qty in counts.items()):
+                # someone else bought it first (or it was removed)
+                conn.rollback()
+                return redirect(url_for('cart', error='unavailable'))
+
+            created_at = int(time.time())
+            cursor.execute('INSERT INTO orders (user_id, created_at) VALUES (%s,%s)', (session['user_id'], created_at))
+            order_id = cursor.lastrowid
+            cursor.executemany('INSERT INTO order_items (order_id, product_id, quantity, price) '
+                               'VALUES (%s,%s,%s,%s)',
+                               [(order_id, pid, counts[pid], prices[pid]) for pid in ids])
+            cursor.executemany('UPDATE products SET stock = stock - %s, version = version + 1 WHERE id=%s',
+                               [(counts[pid], pid) for pid in ids])
+            purchases.record_order(conn, session['user_id'], created_at, sum(counts.values()),
+                                   sum((prices[pid] or 0) * counts[pid] for pid in ids))
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            cursor.close()
+            conn.close()
+        analytics.record_sales(counts, prices)
+        carts.clear_cart()
         return redirect(url_for('order_success', order_id=order_id))
     else:
-        orders = session.get('orders', [])
         timestamp = int(time.time())
-        orders.append({'items': cart.copy(), 'timestamp': timestamp})
-        session['orders'] = orders
-        session['cart'] = []
+        carts.add_guest_order(cart, timestamp)
+        carts.clear_cart()
         # for guests create a temporary order id (timestamp)
         return redirect(url_for('order_success', order_id=timestamp))
 
@@ -280,33 +355,26 @@ def order_success():
         except Exception:
             return redirect(url_for('products'))
         conn = db.get_db_connection()
-        cursor = conn.cursor(dictionary=True)
-        cursor.execute('SELECT * FROM orders WHERE id=%s AND user_id=%s', (oid, session['user_id']))
-        order = cursor.fetchone()
+        order = repository.order(conn, oid, session['user_id'])
         if not order:
-            cursor.close()
             conn.close()
-            return redirect(url_for('products'))
-        cursor.execute('SELECT p.* FROM order_items oi JOIN products p ON oi.product_id=p.id WHERE oi.order_id=%s', (oid,))
-        items = cursor.fetchall()
-        cursor.close()
+            # older orders live in the archive files
+            order = archive.find_order(session['user_id'], oid)
+            if not order:
+                return redirect(url_for('products'))
+            return render_template('order_success.html', order={'id': oid, 'timestamp': order['created_at']},
+                                   items=order['products'])
+        items = repository.order_items(conn, oid)
         conn.close()
         return render_template('order_success.html', order={'id': oid, 'timestamp': order.get('created_at')}, items=items)
 
-    # guest: order_id is the timestamp; find matching session order
-    orders = session.get('orders', [])
-    for o in orders:
+    # guest: order_id is the timestamp; find matching guest order
+    for o in carts.guest_orders():
         if str(o.get('timestamp')) == str(order_id):
-            ids = o.get('items', [])
-            if not ids:
+            if not o.get('items'):
                 return render_template('order_success.html', order={'id': order_id, 'timestamp': o.get('timestamp')}, items=[])
             conn = db.get_db_connection()
-            cursor = conn.cursor(dictionary=True)
-            placeholders = ','.join(['%s'] * len(ids))
-            query = f"SELECT * FROM products WHERE id IN ({placeholders})"
-            cursor.execute(query, tuple(ids))
-            items = cursor.fetchall()
-            cursor.close()
+            items = purchases.guest_history(conn, [o])[0]['products']
             conn.close()
             return render_template('order_success.html', order={'id': order_id, 'timestamp': o.get('timestamp')}, items=items)
 
@@ -316,42 +384,26 @@ def order_success():
 @app.route('/previous_purchases')
 def previous_purchases():
     # Show previous purchases for logged-in users or session-stored orders for guests
-    detailed_orders = []
-
     if session.get('user_id'):
-        conn = db.get_db_connection()
-        cursor = conn.cursor(dictionary=True)
-        cursor.execute('SELECT * FROM orders WHERE user_id=%s ORDER BY created_at DESC', (session['user_id'],))
-        db_orders = cursor.fetchall() or []
-        for o in db_orders:
-            cursor.execute('SELECT p.* FROM order_items oi JOIN products p ON oi.product_id=p.id WHERE oi.order_id=%s', (o['id'],))
-            prods = cursor.fetchall() or []
-            # filter out any None rows (product may have been deleted)
-            prods = [p for p in prods if p]
-            detailed_orders.append({'timestamp': o.get('created_at'), 'products': prods})
-        cursor.close()
+        conn = db.get_read_connection()
+        orders, next_cursor = purchases.order_history(conn, session['user_id'], request.args.get('cursor'))
         conn.close()
-        return render_template('previous_purchases.html', orders=detailed_orders, q='', categories=[])
+        summary = None
+        if purchases.SUMMARY_ENABLED:
+            # a missing summary row is backfilled, so this one is on the primary
+            conn = db.get_db_connection()
+            summary = purchases.get_summary(conn, session['user_id'])
+            conn.close()
+        return render_template('previous_purchases.html', orders=orders, next_cursor=next_cursor,
+                               summary=summary, q='', categories=[])
 
-    # Guest orders stored in session
-    orders = session.get('orders', [])
+    # Guest orders kept in the cart store
+    orders = carts.guest_orders()
     if not orders:
         return render_template('previous_purchases.html', orders=[], q='', categories=[])
 
-    conn = db.get_db_connection()
-    cursor = conn.cursor(dictionary=True)
-    for o in orders:
-        ids = o.get('items', [])
-        if not ids:
-            detailed_orders.append({'timestamp': o.get('timestamp'), 'products': []})
-            continue
-        placeholders = ','.join(['%s'] * len(ids))
-        query = f"SELECT * FROM products WHERE id IN ({placeholders})"
-        cursor.execute(query, tuple(ids))
-        prods = cursor.fetchall() or []
-        prods = [p for p in prods if p]
-        detailed_orders.append({'timestamp': o.get('timestamp'), 'products': prods})
-    cursor.close()
+    conn = db.get_read_connection()
+    detailed_orders = purchases.guest_history(conn, orders)
     conn.close()
     return render_template('previous_purchases.html', orders=detailed_orders, q='', categories=[])
 
@@ -360,12 +412,21 @@ def previous_purchases():
 def debug_last_product():
     # small debug helper (only in dev) to inspect most recent product row
     conn = db.get_db_connection()
-    cursor = conn.cursor(dictionary=True)
-    cursor.execute('SELECT * FROM products ORDER BY id DESC LIMIT 1')
-    prod = cursor.fetchone()
-    cursor.close()
+    prod = repository.latest_product(conn)
     conn.close()
-    return prod or {}
+    return dict(prod) if prod else {}
+
+
+@app.route('/debug_pool_stats')
+def debug_pool_stats():
+    # dev helper: connection pool checkouts, wait times and in-use count (per replica too)
+    return dict(db.pool_stats(), replicas=db.replica_stats())
+
+
+@app.route('/debug_cache_stats')
+def debug_cache_stats():
+    # dev helper: fragment cache size, hit/miss and invalidation counters
+    return fragments.stats()
 
 
 @app.route('/list_uploads')
@@ -386,11 +447,26 @@ def my_listings():
 
     conn = db.get_db_connection()
     cursor = conn.cursor(dictionary=True)
-    cursor.execute("SELECT * FROM products WHERE user_id=%s", (session['user_id'],))
-    items = cursor.fetchall()
+    page = pagination.keyset_page(cursor, pagination.CARD_COLUMNS, ["user_id=%s"], [session['user_id']],
+                                  request.args.get('cursor'))
     cursor.close()
     conn.close()
-    return render_template('products.html', products=items, mine=True)
+    return render_template('products.html', products=page.items, page=page, mine=True,
+                           filters=pagination.Filters(), filter_args={})
+
+
+@app.route('/analytics')
+def seller_analytics():
+    # views, cart adds and sales of the seller's listings, from the daily rollups
+    if "user_id" not in session:
+        return redirect(url_for('login'))
+    days = request.args.get('days', type=int)
+    if days not in analytics.RANGES:
+        days = 30
+    conn = db.get_db_connection()
+    report = analytics.seller_report(conn, session['user_id'], days)
+    conn.close()
+    return render_template('analytics.html', report=report, ranges=analytics.RANGES)
 
 
 @app.route('/profile', methods=['GET', 'POST'])
@@ -399,51 +475,52 @@ def profile():
         return redirect(url_for('login'))
 
     conn = db.get_db_connection()
-    cursor = conn.cursor(dictionary=True)
-    cursor.execute('SELECT * FROM users WHERE id=%s', (session['user_id'],))
-    user = cursor.fetchone()
+    user = repository.user(conn, session['user_id'])
 
     if request.method == 'POST':
         username = request.form.get('username')
         email = request.form.get('email')
         password = request.form.get('password')
+        if password:
+            try:
+                password = credentials.hash_password(password)
+            except credentials.HashPoolBusy:
+                conn.close()
+                return render_template('profile.html', user=user, error="Server busy, please try again")
+        else:
+            # left blank: keep the current password
+            password = user['password'] if user else None
 
         old_profile_image = user.get('profile_image') if user else None
         profile_image = old_profile_image
+        uploaded = False
         if 'image' in request.files:
             f = request.files['image']
             if f and f.filename:
-                filename = secure_filename(f.filename)
-                filename = f"user_{session['user_id']}_{int(time.time())}_{filename}"
-                dest = os.path.join(UPLOAD_DIR, filename)
-                f.save(dest)
-                print(f"Saved profile image: {dest}")
-                profile_image = filename
+                try:
+                    profile_image = images.save_profile_image(f)
+                    uploaded = True
+                except (images.InvalidImage, storage.UploadTooLarge) as e:
+                    conn.close()
+                    return render_template('profile.html', user=user, error=str(e))
+                print(f"Saved profile image: {profile_image}")
 
         upd = conn.cursor()
-        # create profile_image column if missing (best-effort)
         try:
-            try:
-                upd.execute("ALTER TABLE users ADD COLUMN profile_image VARCHAR(255)")
-            except Exception:
-                # ignore if column already exists or if alter not permitted
-                pass
-
             upd.execute('UPDATE users SET username=%s, email=%s, password=%s, profile_image=%s WHERE id=%s',
                         (username, email, password, profile_image, session['user_id']))
             conn.commit()
+            # seller name shown on cached product pages
+            fragments.seller_changed(session['user_id'])
 
-            # remove old profile image file if a new one was uploaded
-            if old_profile_image and profile_image and old_profile_image != profile_image:
+            # the upload took a reference on its image, even when it is the current one
+            if uploaded:
                 try:
-                    old_path = os.path.join(UPLOAD_DIR, old_profile_image)
-                    if os.path.isfile(old_path):
-                        os.remove(old_path)
+                    storage.release(old_profile_image)
                 except Exception as e:
-                    print(f"Warning removing old profile image: {e}")
+                    print(f"Warning releasing old profile image: {e}")
 
             upd.close()
-            cursor.close()
             conn.close()
 
             # update session username
@@ -456,24 +533,23 @@ def profile():
                 conn.rollback()
             except Exception:
                 pass
+            # the upload's reference belongs to nothing now
+            if uploaded:
+                storage.release(profile_image)
             upd.close()
-            cursor.close()
             conn.close()
             # show the error on the profile page so user can see the DB error message
             return render_template('profile.html', user=user, error=str(e))
 
-    cursor.close()
     conn.close()
     return render_template('profile.html', user=user)
 
 
 @app.route('/add_to_cart/<int:product_id>', methods=['POST'])
 def add_to_cart(product_id):
-    # use session to store a simple cart as a list of product ids
-    cart = session.get('cart', [])
-    cart.append(product_id)
-    session['cart'] = cart
-    print(f"Cart updated (add): user={session.get('user_id')} size={len(cart)}")
+    qty = carts.add_item(product_id)
+    analytics.record_cart_add(product_id)
+    print(f"Cart updated (add): user={session.get('user_id')} product={product_id} qty={qty}")
     return redirect(request.referrer or url_for('products'))
 
 
@@ -488,57 +564,42 @@ def add_to_cart_form():
     except ValueError:
         return redirect(request.referrer or url_for('products'))
 
-    cart = session.get('cart', [])
-    cart.append(product_id)
-    session['cart'] = cart
-    print(f"Cart updated (add_form): user={session.get('user_id')} size={len(cart)}")
+    qty = carts.add_item(product_id)
+    analytics.record_cart_add(product_id)
+    print(f"Cart updated (add_form): user={session.get('user_id')} product={product_id} qty={qty}")
     return redirect(request.referrer or url_for('products'))
 
 
 @app.route('/remove_from_cart/<int:product_id>', methods=['POST'])
 def remove_from_cart(product_id):
-    cart = session.get('cart', [])
-    # remove first occurrence
-    try:
-        cart.remove(product_id)
-    except ValueError:
-        pass
-    session['cart'] = cart
-    print(f"Cart updated (remove): user={session.get('user_id')} size={len(cart)}")
+    # remove one unit
+    qty = carts.remove_item(product_id)
+    print(f"Cart updated (remove): user={session.get('user_id')} product={product_id} qty={qty}")
     return redirect(url_for('cart'))
 
 
 @app.route('/cart')
 def cart():
-    cart = session.get('cart', [])
+    counts = carts.get_cart()
     products_in_cart = []
     total_items = 0
-    if cart:
-        # fetch product details for unique ids in cart and attach quantities
-        from collections import Counter
-        counts = Counter(cart)
+    if counts:
+        # fetch product details for ids in cart and attach quantities
         ids = list(counts.keys())
         conn = db.get_db_connection()
-        cursor = conn.cursor(dictionary=True)
-        # build a parameter list for IN clause using unique ids
-        placeholders = ','.join(['%s'] * len(ids))
-        query = f"SELECT * FROM products WHERE id IN ({placeholders})"
-        cursor.execute(query, tuple(ids))
-        rows = cursor.fetchall()
-        # attach qty for each product row
-        for r in rows:
-            r['qty'] = counts.get(r['id'], 0)
-            total_items += r['qty']
-        products_in_cart = rows
-        cursor.close()
+        rows = repository.products_by_ids(conn, ids)
         conn.close()
-        # Remove ids from session cart that no longer exist (keep only product ids present in DB)
+        # attach qty for each product row (rows are read-only, so as copies)
+        products_in_cart = [dict(r, qty=counts.get(r.id, 0)) for r in rows]
+        total_items = sum(r['qty'] for r in products_in_cart)
+        # Remove ids from the cart that no longer exist (keep only product ids present in DB)
         existing_ids = {r['id'] for r in products_in_cart}
-        new_cart = [pid for pid in cart if pid in existing_ids]
-        if len(new_cart) != len(cart):
-            session['cart'] = new_cart
+        carts.discard_items([pid for pid in counts if pid not in existing_ids])
 
-    return render_template('cart.html', products=products_in_cart, total_items=total_items)
+    error = None
+    if request.args.get('error') == 'unavailable':
+        error = 'Some items in your cart are no longer available.'
+    return render_template('cart.html', products=products_in_cart, total_items=total_items, error=error)
 
 
 @app.route('/delete_product/<int:product_id>', methods=['POST'])
@@ -548,35 +609,32 @@ def delete_product(product_id):
         return redirect(url_for('login'))
 
     conn = db.get_db_connection()
-    cursor = conn.cursor(dictionary=True)
-    cursor.execute('SELECT * FROM products WHERE id=%s', (product_id,))
-    prod = cursor.fetchone()
+    prod = repository.product(conn, product_id)
     if not prod:
-        cursor.close()
         conn.close()
         return redirect(url_for('dashboard'))
 
     if prod.get('user_id') != session.get('user_id'):
         # not the owner; do not delete
-        cursor.close()
         conn.close()
         return redirect(url_for('dashboard'))
 
-    # proceed to delete; first remove uploaded image file if present
+    # proceed to delete; the image file is removed by a cleanup job once unreferenced
     image_filename = prod.get('image_url')
-    try:
-        if image_filename:
-            image_path = os.path.join(UPLOAD_DIR, image_filename)
-            if os.path.isfile(image_path):
-                os.remove(image_path)
-    except Exception as e:
-        # log but continue with DB deletion
-        print(f"Warning: could not remove image file {image_filename}: {e}")
-
-    cursor.close()
     cursor = conn.cursor()
     cursor.execute('DELETE FROM products WHERE id=%s', (product_id,))
+    facets.adjust(cursor, removed=[(prod.get('category'), prod.get('price'))])
     conn.commit()
+    facets.invalidate()
+    search.remove_product(product_id)
+    product_ids.product_deleted(product_id)
+    fragments.product_deleted(product_id, prod.get('category'))
+    recommend.product_deleted(product_id)
+    try:
+        storage.release(image_filename)
+    except Exception as e:
+        # log but keep the deletion
+        print(f"Warning: could not release image file {image_filename}: {e}")
     cursor.close()
     conn.close()
     return redirect(url_for('dashboard'))
@@ -592,27 +650,36 @@ def add_product():
         description = request.form["description"]
         category = request.form["category"]
         price = request.form["price"]
-        # handle optional image upload
+        # handle optional image upload (stored by content hash, see storage.py)
         image_filename = None
         if 'image' in request.files:
             f = request.files['image']
             if f and f.filename:
-                filename = secure_filename(f.filename)
-                # prefix with user id and timestamp to avoid collisions
-                filename = f"{session['user_id']}_{int(time.time())}_{filename}"
-                dest = os.path.join(UPLOAD_DIR, filename)
-                f.save(dest)
-                print(f"Saved uploaded image: {dest}")
-                image_filename = filename
+                try:
+                    image_filename = images.save_upload(f)
+                except (images.InvalidImage, storage.UploadTooLarge) as e:
+                    return render_template("add_product.html", error=str(e))
+                print(f"Saved uploaded image: {image_filename}")
 
         conn = db.get_db_connection()
         cursor = conn.cursor()
         cursor.execute(
-            "INSERT INTO products (user_id, title, description, category, price, image_url) VALUES (%s,%s,%s,%s,%s,%s)",
-            (session["user_id"], title, description, category, price, image_filename))
+            "INSERT INTO products (user_id, title, description, category, price, image_url, image_variants) "
+            "VALUES (%s,%s,%s,%s,%s,%s,%s)",
+            (session["user_id"], title, description, category, price, image_filename,
+             images.stored_variants(image_filename)))
+        product_id = cursor.lastrowid
+        facets.adjust(cursor, added=[(category, price)])
         conn.commit()
+        facets.invalidate()
+        search.index_product(product_id, title, description, category, price)
+        product_ids.product_added(product_id)
+        fragments.product_added(category)
+        recommend.product_changed(product_id)
         cursor.close()
         conn.close()
+        # resized variants are built off the request path
+        images.schedule_variants(image_filename)
         return redirect("/products")
     return render_template("add_product.html")
 
@@ -0,0 +1,376 @@
+import argparse
+import bisect
+import calendar
+import gzip
+import json
+import os
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from decimal import Decimal
+
+import db
+import jobs
+
+# Cold storage for old orders.
+# Orders are only ever read per user, newest first (previous_purchases,
+# order_success), so orders older than ARCHIVE_AFTER_DAYS move out of the
+# database into one gzip'd JSON Lines file per calendar month (UTC) under
+# ARCHIVE_DIR, and are deleted from orders / order_items:
+# - Each line is one order with its lines (title, price and images as they
+#   were when archived). A file is sorted by (user_id, created_at DESC, id
+#   DESC) and written as independent gzip members of BLOCK_ORDERS orders, so
+#   one user's history in a month is a seek and a decompress of one or two
+#   blocks, found by bisecting the blocks' user ranges. The last
+#   USER_CACHE (month, user) reads are kept, so paging back through a month
+#   decompresses it once.
+# - manifest.json lists the files and their blocks, and the boundary: every
+#   order created before it is in the archive, every order from it on in the
+#   database. History queries add "created_at >= boundary", so an order is
+#   never shown twice, even while the rows of a month just archived are
+#   still being deleted (or on a replica that has not seen the deletes yet).
+# - A month is archived once it is entirely older than ARCHIVE_AFTER_DAYS;
+#   files are written to a temporary name and renamed, then the manifest,
+#   then the rows are deleted in PURGE_CHUNK batches, so a run that dies
+#   part way is finished by the next one. Checkout writes orders with the
+#   current time, so nothing new ever lands below the boundary.
+# - On MySQL orders is RANGE partitioned by created_at, a partition per month
+#   (migration 8): the job keeps PARTITIONS_AHEAD empty months ready and
+#   drops a month's partition once it is archived, which also gives the
+#   space back. SQLite has no partitions; deleted pages are reused.
+# The job runs every ARCHIVE_INTERVAL seconds ("python archive.py run" does it
+# on demand). With several hosts ARCHIVE_DIR must be shared storage.
+ARCHIVE_DIR = os.environ.get("ECOFINDS_ARCHIVE_DIR", os.path.join(os.path.dirname(__file__), "archive"))
+# 0 turns archiving off
+ARCHIVE_AFTER_DAYS = int(os.environ.get("ECOFINDS_ARCHIVE_AFTER_DAYS", "365"))
+ARCHIVE_INTERVAL = int(os.environ.get("ECOFINDS_ARCHIVE_INTERVAL", "86400"))
+PARTITIONS_AHEAD = int(os.environ.get("ECOFINDS_ORDER_PARTITIONS_AHEAD", "3"))
+BLOCK_ORDERS = 128
+USER_CACHE = 1024
+COMPRESS_LEVEL = 9
+PURGE_CHUNK = 1000
+MANIFEST = "manifest.json"
+
+# the columns previous_purchases.html shows for an order line
+LINES_SQL = ("SELECT oi.order_id, oi.quantity, p.id, p.title, p.price, p.image_url, p.image_variants "
+             "FROM order_items oi JOIN products p ON oi.product_id=p.id WHERE oi.order_id IN ({}) ORDER BY oi.id")
+
+_lock = threading.Lock()
+# ((mtime_ns, size), manifest) of the last manifest read
+_manifest = None
+# (file, user_id) -> that user's orders in the file, most recently used last
+_user_orders = OrderedDict()
+
+
+# ------------------ MONTHS ------------------
+def month_start(ts):
+    t = time.gmtime(ts)
+    return calendar.timegm((t.tm_year, t.tm_mon, 1, 0, 0, 0))
+
+
+def next_month(start):
+    t = time.gmtime(start)
+    return calendar.timegm((t.tm_year + t.tm_mon // 12, t.tm_mon % 12 + 1, 1, 0, 0, 0))
+
+
+def month_name(start):
+    return time.strftime("%Y-%m", time.gmtime(start))
+
+
+# ------------------ MYSQL PARTITIONS ------------------
+def partition_bounds(cursor):
+    # [(name, upper bound or None for MAXVALUE)] of the orders partitions in
+    # order; [] when orders is not partitioned
+    cursor.execute("SELECT partition_name, partition_description FROM information_schema.partitions "
+                   "WHERE table_schema = DATABASE() AND table_name = 'orders' AND partition_name IS NOT NULL "
+                   "ORDER BY partition_ordinal_position")
+    return [(name, None if bound == "MAXVALUE" else int(bound)) for name, bound in cursor.fetchall()]
+
+
+def _month_partitions(first, stop):
+    # one partition per month from first up to stop (month starts)
+    parts = []
+    while first < stop:
+        upper = next_month(first)
+        parts.append(f"PARTITION p{month_name(first).replace('-', '')} VALUES LESS THAN ({upper})")
+        first = upper
+    return parts
+
+
+def _partition_stop():
+    # upper bound of the last partition to keep ready: PARTITIONS_AHEAD months after this one
+    stop = month_start(int(time.time()))
+    for _ in range(PARTITIONS_AHEAD + 1):
+        stop = next_month(stop)
+    return stop
+
+
+def partition_ddl(oldest=None):
+    # ALTER TABLE partitioning orders by month from the month of the oldest order
+    first = month_start(oldest if oldest is not None else int(time.time()))
+    parts = ([f"PARTITION p_old VALUES LESS THAN ({first})"] + _month_partitions(first, _partition_stop())
+             + ["PARTITION p_future VALUES LESS THAN MAXVALUE"])
+    return "ALTER TABLE orders PARTITION BY RANGE (created_at) (" + ", ".join(parts) + ")"
+
+
+def ensure_partitions(cursor):
+    # split the coming months off p_future before any order lands in it
+    bounds = partition_bounds(cursor)
+    if not bounds:
+        return
+    highest = max(upper for _, upper in bounds if upper is not None)
+    parts = _month_partitions(highest, _partition_stop())
+    if parts:
+        cursor.execute("ALTER TABLE orders REORGANIZE PARTITION p_future INTO ("
+                       + ", ".join(parts + ["PARTITION p_future VALUES LESS THAN MAXVALUE"]) + ")")
+
+
+# ------------------ MANIFEST ------------------
+def manifest():
+    # {"boundary": created_at, "partitions": [...oldest first]}, re-read when the file changes
+    global _manifest
+    path = os.path.join(ARCHIVE_DIR, MANIFEST)
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return {"boundary": 0, "partitions": []}
+    key = (st.st_mtime_ns, st.st_size)
+    with _lock:
+        if _manifest is None or _manifest[0] != key:
+            with open(path) as f:
+                data = json.load(f)
+            for part in data["partitions"]:
+                part["last_users"] = [block[1] for block in part["blocks"]]
+            _manifest = (key, data)
+        return _manifest[1]
+
+
+def boundary():
+    # orders created before this are archived (0: none are)
+    return manifest()["boundary"]
+
+
+def _save_manifest(data):
+    out = {"boundary": data["boundary"],
+           "partitions": [{k: v for k, v in part.items() if k != "last_users"} for part in data["partitions"]]}
+    tmp = os.path.join(ARCHIVE_DIR, MANIFEST + ".tmp")
+    with open(tmp, "w") as f:
+        json.dump(out, f)
+    os.replace(tmp, os.path.join(ARCHIVE_DIR, MANIFEST))
+
+
+# ------------------ ARCHIVING ------------------
+def _lines(cursor, order_ids):
+    # {order_id: [line, ...]} in the shape of the history page's products
+    lines = {}
+    for start in range(0, len(order_ids), PURGE_CHUNK):
+        chunk = order_ids[start:start + PURGE_CHUNK]
+        cursor.execute(LINES_SQL.format(','.join(['%s'] * len(chunk))), tuple(chunk))
+        for order_id, qty, pid, title, price, image_url, image_variants in cursor.fetchall():
+            lines.setdefault(order_id, []).append({"id": pid, "title": title, "price": price, "image_url": image_url,
+                                                  "image_variants": image_variants, "qty": qty})
+    return lines
+
+
+def _write_month(cursor, start, end):
+    # the orders of [start, end) into one file; returns its manifest entry
+    cursor.execute("SELECT id, user_id, created_at FROM orders WHERE created_at >= %s AND created_at < %s "
+                   "ORDER BY user_id, created_at DESC, id DESC", (start, end))
+    # orders of deleted users are kept under user 0
+    rows = [(oid, uid or 0, created_at) for oid, uid, created_at in cursor.fetchall()]
+    name = month_name(start)
+    os.makedirs(ARCHIVE_DIR, exist_ok=True)
+    path = os.path.join(ARCHIVE_DIR, f"orders-{name}.jsonl.gz")
+    blocks, items = [], 0
+    with open(path + ".tmp", "wb") as f:
+        for i in range(0, len(rows), BLOCK_ORDERS):
+            chunk = rows[i:i + BLOCK_ORDERS]
+            lines = _lines(cursor, [oid for oid, _, _ in chunk])
+            # user_id first: readers pick a user's lines by prefix before parsing
+            body = b"".join(json.dumps({"user_id": uid, "id": oid, "created_at": created_at,
+                                        "products": lines.get(oid, [])},
+                                       separators=(",", ":"), default=str).encode() + b"\n"
+                            for oid, uid, created_at in chunk)
+            data = gzip.compress(body, COMPRESS_LEVEL)
+            blocks.append([chunk[0][1], chunk[-1][1], f.tell(), len(data), len(chunk)])
+            f.write(data)
+            items += sum(len(v) for v in lines.values())
+    os.replace(path + ".tmp", path)
+    return {"name": name, "start": start, "end": end, "file": os.path.basename(path), "orders": len(rows),
+            "items": items, "bytes": os.path.getsize(path), "first_id": min(r[0] for r in rows),
+            "last_id": max(r[0] for r in rows), "blocks": blocks}
+
+
+def _delete_below(conn, cursor, before, orders=True):
+    # order lines (and with orders=True the orders) of orders created before `before`
+    deleted, last = 0, 0
+    while True:
+        cursor.execute("SELECT id FROM orders WHERE created_at < %s AND id > %s ORDER BY id LIMIT %s",
+                       (before, last, PURGE_CHUNK))
+        ids = [r[0] for r in cursor.fetchall()]
+        if not ids:
+            return deleted
+        last = ids[-1]
+        placeholders = ','.join(['%s'] * len(ids))
+        cursor.execute(f"DELETE FROM order_items WHERE order_id IN ({placeholders})", tuple(ids))
+        if orders:
+            cursor.execute(f"DELETE FROM orders WHERE id IN ({placeholders})", tuple(ids))
+        conn.commit()
+        deleted += len(ids)
+
+
+def _purge(conn, cursor, before, log):
+    # drop what the archive now holds: on MySQL the order lines row by row and
+    # the months' partitions whole, elsewhere (and whatever those partitions
+    # missed) row by row
+    bounds = partition_bounds(cursor) if db.DB_BACKEND != "sqlite" else []
+    archived = [name for name, upper in bounds if upper is not None and upper <= before]
+    deleted = _delete_below(conn, cursor, before, orders=not archived)
+    for name in archived:
+        # p_old stays as the catch-all for anything older than the first month
+        cursor.execute(f"ALTER TABLE orders {'TRUNCATE' if name == 'p_old' else 'DROP'} PARTITION {name}")
+    if archived:
+        deleted = _delete_below(conn, cursor, before)
+        log(f"Dropped partitions {', '.join(archived)}")
+    if deleted:
+        log(f"Deleted {deleted} archived orders from the database")
+
+
+def run(after_days=None, log=print):
+    # archive every month entirely older than after_days; returns the months written
+    after_days = ARCHIVE_AFTER_DAYS if after_days is None else after_days
+    if after_days <= 0:
+        return []
+    cutoff = month_start(int(time.time()) - after_days * 86400)
+    data = dict(manifest())
+    data["partitions"] = list(data["partitions"])
+    written = []
+    conn = db.get_db_connection()
+    cursor = conn.cursor()
+    try:
+        while True:
+            # the month of the oldest order not archived yet
+            cursor.execute("SELECT MIN(created_at) FROM orders WHERE created_at >= %s", (data["boundary"],))
+            oldest = cursor.fetchone()[0]
+            conn.commit()
+            if oldest is None or month_start(oldest) >= cutoff:
+                break
+            start = month_start(oldest)
+            started = time.perf_counter()
+            part = _write_month(cursor, start, next_month(start))
+            conn.commit()
+            data["partitions"] = [p for p in data["partitions"] if p["name"] != part["name"]] + [part]
+            data["boundary"] = part["end"]
+            _save_manifest(data)
+            written.append(part["name"])
+            log(f"Archived {part['name']}: {part['orders']} orders, {part['items']} items, "
+                f"{part['bytes'] / 2 ** 20:.1f} MB in {time.perf_counter() - started:.1f}s")
+        if data["boundary"]:
+            _purge(conn, cursor, data["boundary"], log)
+        if db.DB_BACKEND != "sqlite":
+            ensure_partitions(cursor)
+    finally:
+        cursor.close()
+        conn.close()
+    return written
+
+
+jobs.register("archive_orders", run)
+if ARCHIVE_AFTER_DAYS > 0:
+    jobs.every("archive_orders", ARCHIVE_INTERVAL)
+
+
+# ------------------ READS ------------------
+def _read_user(part, user_id):
+    # a user's orders in one archived month, newest first
+    key = (part["file"], user_id)
+    with _lock:
+        if key in _user_orders:
+            _user_orders.move_to_end(key)
+            return _user_orders[key]
+    blocks = part["blocks"]
+    i = bisect.bisect_left(part["last_users"], user_id)
+    prefix = f'{{"user_id":{user_id},'.encode()
+    found = []
+    with open(os.path.join(ARCHIVE_DIR, part["file"]), "rb") as f:
+        while i < len(blocks) and blocks[i][0] <= user_id:
+            f.seek(blocks[i][2])
+            # one gzip member (wbits 31); the user's lines are consecutive
+            data = zlib.decompress(f.read(blocks[i][3]), 31)
+            start = 0 if data.startswith(prefix) else data.find(b"\n" + prefix) + 1
+            if start or data.startswith(prefix):
+                end = start
+                while data.startswith(prefix, end):
+                    end = data.index(b"\n", end) + 1
+                found += [json.loads(line) for line in data[start:end].splitlines()]
+            i += 1
+    with _lock:
+        _user_orders[key] = found
+        while len(_user_orders) > USER_CACHE:
+            _user_orders.popitem(last=False)
+    return found
+
+
+def user_orders(user_id, before=None, limit=10):
+    # up to limit archived orders of a user, newest first, older than the
+    # (created_at, id) boundary `before`; months newer than it are not opened
+    found = []
+    for part in reversed(manifest()["partitions"]):
+        if before is not None and part["start"] > before[0]:
+            continue
+        for order in _read_user(part, user_id):
+            if before is None or (order["created_at"], order["id"]) < tuple(before):
+                found.append(order)
+                if len(found) >= limit:
+                    return found
+    return found
+
+
+def find_order(user_id, order_id):
+    # one archived order of a user, or None
+    for part in manifest()["partitions"]:
+        if part["first_id"] <= order_id <= part["last_id"]:
+            for order in _read_user(part, user_id):
+                if order["id"] == order_id:
+                    return order
+    return None
+
+
+def totals(user_id):
+    # (orders, items, spent, last created_at) over a user's archived orders
+    orders = items = 0
+    spent = Decimal(0)
+    last = None
+    for part in manifest()["partitions"]:
+        for order in _read_user(part, user_id):
+            orders += 1
+            last = max(last or 0, order["created_at"])
+            for line in order["products"]:
+                items += line["qty"]
+                spent += Decimal(str(line["price"] or 0)) * line["qty"]
+    return orders, items, spent, last
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Move old orders into compressed monthly archive files.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    archive = sub.add_parser("run", help="archive the months older than --after-days")
+    archive.add_argument("--after-days", type=int, default=ARCHIVE_AFTER_DAYS)
+    sub.add_parser("status", help="list the archived months")
+    args = parser.parse_args()
+
+    if args.command == "run":
+        if not run(args.after_days):
+            print("Nothing to archive")
+        return
+    data = manifest()
+    for part in data["partitions"]:
+        print(f"{part['name']}  {part['orders']:>9} orders {part['items']:>9} items "
+              f"{part['bytes'] / 2 ** 20:>8.1f} MB  {len(part['blocks'])} blocks")
+    if data["boundary"]:
+        print(f"orders before {time.strftime('%Y-%m-%d', time.gmtime(data['boundary']))} UTC are archived")
+
+
+if __name__ == "__main__":
+    main()
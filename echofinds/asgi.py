@@ -0,0 +1,391 @@
+import asyncio
+import io
+import sys
+import time
+
+from flask import redirect, render_template, request, session, url_for
+from werkzeug.exceptions import HTTPException
+
+import adb
+import analytics
+import carts
+import credentials
+import facets
+import fragments
+import pagination
+import purchases
+import repository
+import search
+from app import app as flask_app
+
+# ASGI entry point, served next to (not instead of) the WSGI app:
+#   uvicorn asgi:application --port 8000
+# The busiest pages (login, dashboard, products, cart, checkout, purchases)
+# have async versions here that query through the async pool in adb.py, so a
+# slow database holds a connection rather than a worker thread. Every other
+# route, and static files, run through the regular Flask app on a thread.
+# Both modes share the templates, session cookie, cart store and database, so
+# one deployment can run both side by side.
+
+
+# ------------------ ASGI <-> WSGI ------------------
+def _wsgi_environ(scope, body):
+    server = scope.get("server") or ("localhost", 80)
+    client = scope.get("client") or ("", 0)
+    environ = {
+        "REQUEST_METHOD": scope["method"],
+        "SCRIPT_NAME": scope.get("root_path", "").encode("utf8").decode("latin1"),
+        "PATH_INFO": scope["path"].encode("utf8").decode("latin1"),
+        "QUERY_STRING": scope.get("query_string", b"").decode("latin1"),
+        "SERVER_NAME": server[0],
+        "SERVER_PORT": str(server[1]),
+        "SERVER_PROTOCOL": f"HTTP/{scope.get('http_version', '1.1')}",
+        "REMOTE_ADDR": client[0],
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": scope.get("scheme", "http"),
+        "wsgi.input": io.BytesIO(body),
+        "wsgi.errors": sys.stderr,
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": True,
+        "wsgi.run_once": False,
+    }
+    for raw_name, raw_value in scope.get("headers", []):
+        name = raw_name.decode("latin1").upper().replace("-", "_")
+        value = raw_value.decode("latin1")
+        if name == "CONTENT_TYPE" or name == "CONTENT_LENGTH":
+            key = name
+        else:
+            key = "HTTP_" + name
+        environ[key] = f"{environ[key]},{value}" if key in environ else value
+    # the body is already buffered, so its length is known even for chunked uploads
+    environ["CONTENT_LENGTH"] = str(len(body))
+    return environ
+
+
+def _encode_headers(headers):
+    return [(name.lower().encode("latin1"), value.encode("latin1")) for name, value in headers]
+
+
+def _call_wsgi(environ):
+    # run the Flask WSGI app for one request; returns (status, headers, body)
+    started = []
+
+    def start_response(status, headers, exc_info=None):
+        started[:] = [status, headers]
+
+    result = flask_app(environ, start_response)
+    try:
+        body = b"".join(result)
+    finally:
+        if hasattr(result, "close"):
+            result.close()
+    status, headers = started
+    return int(status.split(" ", 1)[0]), _encode_headers(headers), body
+
+
+async def _read_body(receive):
+    chunks = []
+    while True:
+        message = await receive()
+        chunks.append(message.get("body", b""))
+        if not message.get("more_body"):
+            return b"".join(chunks)
+
+
+async def _dispatch(view, environ, view_args):
+    # the Flask request lifecycle (before/after request hooks, session, teardown)
+    # around an async view; mirrors Flask.wsgi_app
+    # tells metrics.py not to sample this request's (borrowed) thread
+    environ["ecofinds.async_view"] = True
+    ctx = flask_app.request_context(environ)
+    error = None
+    try:
+        ctx.push()
+        try:
+            try:
+                # before_request hooks may touch the sync pool, keep them off the loop
+                rv = await asyncio.to_thread(flask_app.preprocess_request)
+                if rv is None:
+                    rv = await view(**view_args)
+            except Exception as e:
+                rv = flask_app.handle_user_exception(e)
+            response = flask_app.finalize_request(rv)
+        except Exception as e:
+            error = e
+            response = flask_app.handle_exception(e)
+        headers = response.get_wsgi_headers(environ).to_wsgi_list()
+        return response.status_code, _encode_headers(headers), response.get_data()
+    finally:
+        ctx.pop(error)
+
+
+async def _lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            await adb.get_pool()
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            await adb.close_pool()
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+async def application(scope, receive, send):
+    if scope["type"] == "lifespan":
+        await _lifespan(receive, send)
+        return
+    if scope["type"] != "http":
+        return
+    environ = _wsgi_environ(scope, await _read_body(receive))
+    try:
+        endpoint, view_args = flask_app.url_map.bind_to_environ(environ).match()
+    except HTTPException:
+        # 404s, 405s and slash redirects are answered by Flask
+        endpoint, view_args = None, {}
+    view = ASYNC_VIEWS.get(endpoint)
+    if view is None:
+        status, headers, body = await asyncio.to_thread(_call_wsgi, environ)
+    else:
+        status, headers, body = await _dispatch(view, environ, view_args)
+    await send({"type": "http.response.start", "status": status, "headers": headers})
+    await send({"type": "http.response.body", "body": body})
+
+
+# ------------------ HELPERS ------------------
+async def _cart_badge():
+    # the nav cart count, fetched off the loop and handed to the template
+    count = await asyncio.to_thread(carts.cart_count)
+    return lambda: count
+
+
+async def _listing_page(pool, columns, filters=pagination.Filters(), token=None):
+    page = fragments.cached_listing(columns, filters, token)
+    if page is None:
+        # off the loop: price ranges may read the facet counts
+        query, args, kind = await asyncio.to_thread(fragments.listing_query, columns, filters, token)
+        async with pool.acquire() as conn:
+            rows = await conn.fetchall(query, args)
+        page = pagination.keyset_result(rows, kind, sort=filters.sort)
+        fragments.store_listing(columns, filters, token, page)
+    return page
+
+
+async def _record_order(conn, user_id, created_at, item_count, total):
+    # purchases.record_order on the async pool
+    if not purchases.SUMMARY_ENABLED:
+        return
+    _, updated = await conn.execute(purchases.SUMMARY_INCREMENT_SQL, (item_count, total, created_at, user_id))
+    if updated == 0:
+        row = await conn.fetchone(purchases.SUMMARY_BACKFILL_SQL, (user_id,), dictionary=False)
+        await conn.execute(purchases.SUMMARY_INSERT_SQL, await asyncio.to_thread(purchases.with_archived, user_id, row))
+
+
+async def _get_summary(conn, user_id):
+    # purchases.get_summary on the async pool
+    if not purchases.SUMMARY_ENABLED:
+        return None
+    summary = await conn.fetchone(purchases.SUMMARY_SELECT_SQL, (user_id,))
+    if summary is None:
+        try:
+            row = await conn.fetchone(purchases.SUMMARY_BACKFILL_SQL, (user_id,), dictionary=False)
+            await conn.execute(purchases.SUMMARY_INSERT_SQL,
+                               await asyncio.to_thread(purchases.with_archived, user_id, row))
+            await conn.commit()
+        except Exception:
+            # another request backfilled it first
+            await conn.rollback()
+        summary = await conn.fetchone(purchases.SUMMARY_SELECT_SQL, (user_id,))
+    return summary
+
+
+# ------------------ VIEWS ------------------
+async def login():
+    if request.method == "POST":
+        email = request.form["email"]
+        password = request.form["password"]
+        retry_after = credentials.login_retry_after(request.remote_addr, email)
+        if retry_after:
+            return "Too many login attempts, try again later", 429, {"Retry-After": str(retry_after)}
+
+        pool = await adb.get_pool()
+        async with pool.acquire() as conn:
+            user = await conn.fetchone("SELECT id, username, password FROM users WHERE email=%s", (email,))
+        # hashing happens in the worker processes; no connection is held meanwhile
+        try:
+            ok, new_hash = await credentials.check_password_async(password, user["password"] if user else None)
+        except credentials.HashPoolBusy:
+            return "Server busy, please try again", 503
+        if ok and new_hash:
+            async with pool.acquire() as conn:
+                await conn.execute("UPDATE users SET password=%s WHERE id=%s AND password=%s",
+                                   (new_hash, user["id"], user["password"]))
+                await conn.commit()
+
+        if ok:
+            session["user_id"] = user["id"]
+            session["username"] = user["username"]
+            # items added before logging in join the account cart
+            await asyncio.to_thread(carts.merge_guest_cart, user["id"])
+            return redirect("/dashboard")
+        else:
+            return "Invalid Credentials"
+    return render_template("login.html")
+
+
+async def dashboard():
+    if "user_id" not in session:
+        return redirect("/login")
+
+    pool = await adb.get_pool()
+
+    async def fetch_user():
+        async with pool.acquire() as conn:
+            return await repository.user_async(conn, session["user_id"])
+
+    # the user row, the product page and the cart badge are independent; fetch them concurrently
+    user, page, cart_count = await asyncio.gather(
+        fetch_user(),
+        _listing_page(pool, pagination.CARD_COLUMNS_WITH_SUMMARY, token=request.args.get('cursor')),
+        _cart_badge())
+    return render_template("dashboard.html", user=user, products=page.items, page=page, cart_count=cart_count)
+
+
+async def products():
+    q = request.args.get('q', '').strip()
+    filters = pagination.filters_from_args(request.args)
+    category = filters.category or ''
+    category_counts = {}
+    histogram = []
+    token = request.args.get('cursor')
+    pool = await adb.get_pool()
+    if q:
+        # relevance ordered (or sorted in the index), so search results page by offset into the ranking
+        offset = pagination.offset_window(token)
+        ranked, category_counts = await asyncio.to_thread(search.search, q, filters.category,
+                                                          limit=offset + pagination.PAGE_SIZE + 1,
+                                                          min_price=filters.min_price, max_price=filters.max_price,
+                                                          sort=filters.sort)
+        window = ranked[offset:offset + pagination.PAGE_SIZE]
+        items = []
+        if window:
+            async with pool.acquire() as conn:
+                rows = await repository.products_by_ids_async(conn, window, pagination.CARD_COLUMNS)
+            by_id = {r['id']: r for r in rows}
+            # keep the order from the index
+            items = [by_id[pid] for pid in window if pid in by_id]
+        page = pagination.offset_page(items, offset, len(ranked) > offset + pagination.PAGE_SIZE)
+    else:
+        page, histogram = await asyncio.gather(_listing_page(pool, pagination.CARD_COLUMNS, filters, token),
+                                               asyncio.to_thread(facets.histogram, filters.category))
+    categories, cart_count = await asyncio.gather(asyncio.to_thread(facets.categories), _cart_badge())
+    return render_template("products.html", products=page.items, page=page, q=q, categories=categories,
+                           category=category, facets=category_counts, filters=filters,
+                           filter_args=pagination.filter_args(filters), histogram=histogram, cart_count=cart_count)
+
+
+async def cart():
+    counts = await asyncio.to_thread(carts.get_cart)
+    products_in_cart = []
+    total_items = 0
+    if counts:
+        pool = await adb.get_pool()
+        async with pool.acquire() as conn:
+            products_in_cart = await repository.products_by_ids_async(conn, counts)
+        for r in products_in_cart:
+            r['qty'] = counts.get(r['id'], 0)
+            total_items += r['qty']
+        existing_ids = {r['id'] for r in products_in_cart}
+        missing = [pid for pid in counts if pid not in existing_ids]
+        if missing:
+            await asyncio.to_thread(carts.discard_items, missing)
+
+    error = None
+    if request.args.get('error') == 'unavailable':
+        error = 'Some items in your cart are no longer available.'
+    return render_template('cart.html', products=products_in_cart, total_items=total_items, error=error)
+
+
+async def checkout():
+    cart = await asyncio.to_thread(carts.get_cart)
+    if not cart:
+        return redirect(url_for('cart'))
+    if session.get('user_id'):
+        counts = cart
+        # lock rows in id order so concurrent checkouts can't deadlock
+        ids = sorted(counts)
+        pool = await adb.get_pool()
+        async with pool.acquire() as conn:
+            await conn.begin()
+            locked = await repository.lock_products_async(conn, ids)
+            stock = {pid: units for pid, units, _ in locked}
+            prices = {pid: price for pid, _, price in locked}
+            if any(stock.get(pid, 0) < qty for pid, qty in counts.items()):
+                # someone else bought it first (or it was removed)
+                await conn.rollback()
+                return redirect(url_for('cart', error='unavailable'))
+
+            created_at = int(time.time())
+            order_id, _ = await conn.execute('INSERT INTO orders (user_id, created_at) VALUES (%s,%s)',
+                                             (session['user_id'], created_at))
+            await conn.executemany('INSERT INTO order_items (order_id, product_id, quantity, price) '
+                                   'VALUES (%s,%s,%s,%s)',
+                                   [(order_id, pid, counts[pid], prices[pid]) for pid in ids])
+            await conn.executemany('UPDATE products SET stock = stock - %s, version = version + 1 WHERE id=%s',
+                                   [(counts[pid], pid) for pid in ids])
+            await _record_order(conn, session['user_id'], created_at, sum(counts.values()),
+                                sum((prices[pid] or 0) * counts[pid] for pid in ids))
+            await conn.commit()
+        analytics.record_sales(counts, prices)
+        await asyncio.to_thread(carts.clear_cart)
+        return redirect(url_for('order_success', order_id=order_id))
+
+    timestamp = int(time.time())
+    await asyncio.to_thread(carts.add_guest_order, cart, timestamp)
+    await asyncio.to_thread(carts.clear_cart)
+    return redirect(url_for('order_success', order_id=timestamp))
+
+
+async def previous_purchases():
+    pool = await adb.get_pool()
+    if session.get('user_id'):
+        user_id = session['user_id']
+        token = request.args.get('cursor')
+        async with pool.acquire() as conn:
+            rows = await conn.fetchall(*purchases.orders_query(user_id, token))
+            items = []
+            if rows:
+                items = await conn.fetchall(*purchases.items_query([o['id'] for o in rows[:purchases.ORDERS_PAGE_SIZE]]))
+            summary = await _get_summary(conn, user_id)
+        archived = []
+        if len(rows) <= purchases.ORDERS_PAGE_SIZE:
+            # off the loop: past the database's rows the page continues in the archive files
+            archived = await asyncio.to_thread(purchases.archived_orders, user_id, rows, token)
+        orders, next_cursor = purchases.history_page(rows, items, archived=archived)
+        return render_template('previous_purchases.html', orders=orders, next_cursor=next_cursor,
+                               summary=summary, q='', categories=[], cart_count=await _cart_badge())
+
+    orders = await asyncio.to_thread(carts.guest_orders)
+    rows = []
+    query = purchases.guest_products_query(orders)
+    if query:
+        async with pool.acquire() as conn:
+            rows = await conn.fetchall(*query)
+    return render_template('previous_purchases.html', orders=purchases.guest_detail(orders, rows),
+                           q='', categories=[], cart_count=await _cart_badge())
+
+
+# Flask endpoint -> async view; other endpoints fall through to the WSGI app
+ASYNC_VIEWS = {
+    "login": login,
+    "dashboard": dashboard,
+    "products": products,
+    "cart": cart,
+    "checkout": checkout,
+    "previous_purchases": previous_purchases,
+}
+
+
+if __name__ == "__main__":
+    import uvicorn
+    uvicorn.run(application, host="127.0.0.1", port=8000)
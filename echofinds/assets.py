@@ -0,0 +1,144 @@
+import gzip
+import hashlib
+import mimetypes
+import os
+import re
+import threading
+
+from flask import Response, abort, current_app, request, send_file
+from werkzeug.security import safe_join
+
+try:
+    import brotli
+except ImportError:
+    # brotli is optional; gzip is always available
+    brotli = None
+
+# Cache-friendly serving for /static (CSS, logos and the uploads folder).
+# url_for('static', ...) gets a ?v=<content hash> fingerprint, and requests
+# carrying the current fingerprint (or for content-addressed uploads, whose
+# names already change with their bytes) are cacheable for a year and marked
+# immutable. Everything else gets a strong ETag and must revalidate, which
+# costs a 304 with no body. Text assets are pre-compressed once per file
+# version and served with Content-Encoding when the client accepts it.
+ONE_YEAR = 365 * 24 * 3600
+# "" (Flask streams the file), "x-sendfile" (Apache/lighttpd) or "x-accel" (nginx)
+SENDFILE_MODE = os.environ.get("ECOFINDS_SENDFILE", "")
+# nginx internal location that maps onto the static folder
+ACCEL_PREFIX = os.environ.get("ECOFINDS_ACCEL_PREFIX", "/_static/")
+COMPRESSIBLE = (".css", ".js", ".svg", ".txt")
+MIN_COMPRESS_SIZE = 512
+
+_CONTENT_ADDRESSED = re.compile(r"^[0-9a-f]{40}")
+_lock = threading.Lock()
+# path -> ((mtime_ns, size), sha256 hex)
+_digests = {}
+# (path, encoding) -> ((mtime_ns, size), compressed bytes)
+_compressed = {}
+
+
+def file_digest(path):
+    st = os.stat(path)
+    stamp = (st.st_mtime_ns, st.st_size)
+    cached = _digests.get(path)
+    if cached and cached[0] == stamp:
+        return cached[1]
+    h = hashlib.sha256()
+    with open(path, "rb") as fh:
+        for chunk in iter(lambda: fh.read(64 * 1024), b""):
+            h.update(chunk)
+    digest = h.hexdigest()
+    with _lock:
+        _digests[path] = (stamp, digest)
+    return digest
+
+
+def is_content_addressed(filename):
+    return bool(_CONTENT_ADDRESSED.match(os.path.basename(filename)))
+
+
+def _precompressed(path, encoding):
+    st = os.stat(path)
+    stamp = (st.st_mtime_ns, st.st_size)
+    cached = _compressed.get((path, encoding))
+    if cached and cached[0] == stamp:
+        return cached[1]
+    with open(path, "rb") as fh:
+        raw = fh.read()
+    if encoding == "br":
+        body = brotli.compress(raw, quality=11)
+    else:
+        body = gzip.compress(raw, compresslevel=9, mtime=0)
+    with _lock:
+        _compressed[(path, encoding)] = (stamp, body)
+    return body
+
+
+def _pick_encoding(path):
+    if not path.endswith(COMPRESSIBLE) or os.path.getsize(path) < MIN_COMPRESS_SIZE:
+        return None
+    accepted = request.accept_encodings
+    if brotli is not None and accepted["br"]:
+        return "br"
+    if accepted["gzip"]:
+        return "gzip"
+    return None
+
+
+def fingerprint_url_defaults(endpoint, values):
+    # adds ?v=<hash> to url_for('static', filename=...)
+    if endpoint != "static" or "v" in values or not values.get("filename"):
+        return
+    filename = values["filename"]
+    if is_content_addressed(filename):
+        return
+    path = safe_join(current_app.static_folder, filename)
+    if path and os.path.isfile(path):
+        values["v"] = file_digest(path)[:12]
+
+
+def serve_static(filename):
+    path = safe_join(current_app.static_folder, filename)
+    if not path or not os.path.isfile(path):
+        abort(404)
+    digest = file_digest(path)
+    immutable = is_content_addressed(filename) or request.args.get("v") == digest[:12]
+    mimetype = mimetypes.guess_type(path)[0] or "application/octet-stream"
+    encoding = _pick_encoding(path)
+    # strong ETag per representation
+    etag = digest[:32] + (f"-{encoding}" if encoding else "")
+
+    if encoding:
+        resp = Response(_precompressed(path, encoding), mimetype=mimetype)
+        resp.headers["Content-Encoding"] = encoding
+        resp.set_etag(etag)
+        resp.make_conditional(request)
+    elif SENDFILE_MODE == "x-accel":
+        # nginx serves the bytes from an internal location
+        resp = Response(mimetype=mimetype)
+        resp.headers["X-Accel-Redirect"] = ACCEL_PREFIX + filename
+        resp.set_etag(etag)
+        resp.make_conditional(request)
+    else:
+        # honours USE_X_SENDFILE for the x-sendfile mode
+        resp = send_file(path, mimetype=mimetype, etag=etag, conditional=True, max_age=None)
+
+    if path.endswith(COMPRESSIBLE):
+        resp.vary.add("Accept-Encoding")
+    if immutable:
+        resp.cache_control.no_cache = None
+        resp.cache_control.public = True
+        resp.cache_control.max_age = ONE_YEAR
+        resp.cache_control.immutable = True
+    else:
+        resp.cache_control.public = True
+        resp.cache_control.no_cache = True
+    return resp
+
+
+def init_app(app):
+    app.url_defaults(fingerprint_url_defaults)
+    # replace Flask's default static view with the cache-aware one
+    app.view_functions["static"] = serve_static
+    if SENDFILE_MODE == "x-sendfile":
+        app.config["USE_X_SENDFILE"] = True
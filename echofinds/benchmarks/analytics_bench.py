@@ -0,0 +1,79 @@
+"""Seller dashboard latency from the rollups vs. aggregating the orders.
+
+Seeds a temporary sqlite database (seed.py) with --orders orders, rebuilds
+the sales rollups from them, and buffers --views random listing views spread
+over the last 90 days, timing the flush. Then times analytics.seller_report
+for the seller with the most listings against the same per-category sales
+totals computed straight from orders/order_items/products, for each
+dashboard range. Run with different --orders to see that only the naive
+query grows with order volume.
+
+Usage: python benchmarks/analytics_bench.py [--products 50000] [--orders 100000] [--views 500000]
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+_tmp = tempfile.mkdtemp()
+os.environ.setdefault("ECOFINDS_DB_BACKEND", "sqlite")
+os.environ.setdefault("ECOFINDS_SQLITE_PATH", os.path.join(_tmp, "analytics.sqlite3"))
+os.environ.setdefault("ECOFINDS_CART_KV_PATH", os.path.join(_tmp, "carts.sqlite3"))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import analytics  # noqa: E402
+import db  # noqa: E402
+import seed  # noqa: E402
+
+NAIVE_SQL = ("SELECT p.category, SUM(oi.quantity), SUM(oi.quantity * p.price) FROM orders o "
+             "JOIN order_items oi ON oi.order_id = o.id JOIN products p ON p.id = oi.product_id "
+             "WHERE p.user_id = %s AND o.created_at >= %s GROUP BY p.category")
+
+
+def timed(fn, repeat):
+    fn()
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - start) / repeat * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--users", type=int, default=2000)
+    parser.add_argument("--products", type=int, default=50000)
+    parser.add_argument("--orders", type=int, default=100000)
+    parser.add_argument("--views", type=int, default=500000)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    seed.seed(args.users, args.products, args.orders, days=90, log=lambda line: print("  seed: " + line))
+    analytics.backfill(90, log=lambda line: print("  " + line))
+
+    rng = random.Random(3)
+    today = analytics.day_number()
+    for _ in range(args.views):
+        analytics._buffer.add(rng.randint(1, args.products), today - rng.randint(0, 89), views=1)
+    start = time.perf_counter()
+    rows = analytics.flush()
+    print(f"flushed {args.views} buffered views as {rows} listing-day rows in {time.perf_counter() - start:.2f}s")
+
+    conn = db.get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute("SELECT user_id, COUNT(*) FROM products GROUP BY user_id ORDER BY COUNT(*) DESC LIMIT 1")
+    seller, listings = cursor.fetchone()
+    print(f"seller {seller}: {listings} listings, {args.orders} orders in the database (ms per dashboard)")
+    print(f"{'range':>8}{'rollups':>12}{'from orders':>14}")
+    for days in analytics.RANGES:
+        since = (today - days + 1) * 86400
+        rollup_ms = timed(lambda: analytics.seller_report(conn, seller, days), args.repeat)
+        naive_ms = timed(lambda: cursor.execute(NAIVE_SQL, (seller, since)).fetchall(), args.repeat)
+        print(f"{days:>6}d {rollup_ms:>11.2f} {naive_ms:>13.2f}")
+    cursor.close()
+    conn.close()
+
+
+if __name__ == "__main__":
+    main()
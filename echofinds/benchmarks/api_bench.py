@@ -0,0 +1,136 @@
+"""Bytes and CPU per request: the JSON API (api.py) against the HTML pages.
+
+Seeds a temporary sqlite database (seed.py), logs a buyer in through the
+test client and requests each pair of pages --requests times:
+
+  listing    /products?cursor=...        /api/v1/products?cursor=...
+  detail     /products/<id>              /api/v1/products/<id>
+  purchases  /previous_purchases         /api/v1/purchases
+
+plus the listing with fields=id,title,price, and a revalidation of it
+(If-None-Match, answered 304). For each it prints process CPU per request and
+the body size raw, gzip'd and, when brotli is installed, brotli'd (the app
+compresses API responses itself; HTML sizes are what a compressing proxy in
+front would send). Finally it times encoding one listing page with orjson (if
+installed) and the json module.
+
+Usage: python benchmarks/api_bench.py [--products 20000] [--requests 300]
+"""
+import argparse
+import gzip
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+_tmp = tempfile.mkdtemp()
+os.environ.setdefault("ECOFINDS_DB_BACKEND", "sqlite")
+os.environ.setdefault("ECOFINDS_SQLITE_PATH", os.path.join(_tmp, "api.sqlite3"))
+os.environ.setdefault("ECOFINDS_CART_KV_PATH", os.path.join(_tmp, "carts.sqlite3"))
+os.environ.setdefault("ECOFINDS_UPLOAD_DIR", _tmp)
+os.environ.setdefault("ECOFINDS_ARCHIVE_DIR", os.path.join(_tmp, "archive"))
+# no background model builds or jobs competing for the CPU being measured
+os.environ.setdefault("ECOFINDS_RECOMMEND", "0")
+os.environ.setdefault("ECOFINDS_JOB_WORKERS", "0")
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import api  # noqa: E402
+import seed  # noqa: E402
+
+
+def cursors(client, path, pages):
+    # the cursor of each of the first `pages` listing pages (None for the first)
+    tokens, token = [None], None
+    for _ in range(pages - 1):
+        token = client.get(path + (f"?cursor={token}" if token else "")).get_json()["next_cursor"]
+        if not token:
+            break
+        tokens.append(token)
+    return tokens
+
+
+def sizes(body):
+    out = [len(body), len(gzip.compress(body, compresslevel=api.GZIP_LEVEL))]
+    if api.brotli is not None:
+        out.append(len(api.brotli.compress(body, quality=api.BROTLI_QUALITY)))
+    return out
+
+
+def measure(client, urls, requests, headers=None):
+    # (CPU ms per request, body sizes of the first response, status)
+    for url in urls:
+        client.get(url, headers=headers)
+    start = time.process_time()
+    for i in range(requests):
+        resp = client.get(urls[i % len(urls)], headers=headers)
+    cpu = (time.process_time() - start) / requests * 1000
+    first = client.get(urls[0], headers=headers)
+    return cpu, sizes(first.get_data()), resp.status_code
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--users", type=int, default=500)
+    parser.add_argument("--products", type=int, default=20000)
+    parser.add_argument("--orders", type=int, default=20000)
+    parser.add_argument("--images", type=int, default=8)
+    parser.add_argument("--requests", type=int, default=300)
+    args = parser.parse_args()
+
+    ids = seed.seed(args.users, args.products, args.orders, n_images=args.images, days=180,
+                    log=lambda line: print("  seed: " + line))
+    import app as ecofinds
+    client = ecofinds.app.test_client()
+    buyer = random.Random(7).randint(*ids["users"])
+    client.post("/login", data={"email": f"user{buyer}@example.com", "password": seed.PASSWORD})
+    rng = random.Random(3)
+    detail_ids = [rng.randint(*ids["products"]) for _ in range(50)]
+    html_tokens = cursors(client, "/api/v1/products", 10)
+
+    fields = "fields=id,title,price"
+    cases = [
+        ("listing", "html", [f"/products?cursor={t}" if t else "/products" for t in html_tokens]),
+        ("listing", "json", [f"/api/v1/products?cursor={t}" if t else "/api/v1/products" for t in html_tokens]),
+        ("listing", "json fields", [f"/api/v1/products?{fields}&cursor={t}" if t else f"/api/v1/products?{fields}"
+                                    for t in html_tokens]),
+        ("detail", "html", [f"/products/{pid}" for pid in detail_ids]),
+        ("detail", "json", [f"/api/v1/products/{pid}" for pid in detail_ids]),
+        ("purchases", "html", ["/previous_purchases"]),
+        ("purchases", "json", ["/api/v1/purchases"]),
+    ]
+    print(f"{args.products} products, {args.requests} requests per case, orjson "
+          f"{'on' if api.orjson is not None else 'not installed'}, brotli "
+          f"{'on' if api.brotli is not None else 'not installed'}")
+    encodings = "raw / gzip" + (" / br" if api.brotli is not None else "")
+    print(f"  {'page':<10} {'as':<12} {'CPU/request':>12}   bytes ({encodings})")
+    for name, label, urls in cases:
+        cpu, body, _ = measure(client, urls, args.requests)
+        print(f"  {name:<10} {label:<12} {cpu:>9.2f} ms   {' / '.join(str(n) for n in body)}")
+
+    etag = client.get("/api/v1/products").headers["ETag"]
+    cpu, body, status = measure(client, ["/api/v1/products"], args.requests, {"If-None-Match": etag})
+    print(f"  {'listing':<10} {'json 304':<12} {cpu:>9.2f} ms   {body[0]} (status {status})")
+    accept = "br, gzip" if api.brotli is not None else "gzip"
+    cpu, _, _ = measure(client, [f"/api/v1/products?cursor={t}" if t else "/api/v1/products" for t in html_tokens],
+                        args.requests, {"Accept-Encoding": accept})
+    print(f"  {'listing':<10} {'json ' + accept.split(',')[0]:<12} {cpu:>9.2f} ms   (compressed by the app)")
+
+    # encoding one page of listings
+    with ecofinds.app.test_request_context():
+        page = ecofinds.fragments.listing_page(api.API_COLUMNS)
+        payload = {"items": [api._product(p) for p in page.items], "next_cursor": page.next_cursor,
+                   "prev_cursor": page.prev_cursor}
+    encoders = [("json module", lambda: json.dumps(payload, ensure_ascii=False, separators=(",", ":")).encode())]
+    if api.orjson is not None:
+        encoders.append(("orjson", lambda: api.orjson.dumps(payload)))
+    for label, encode in encoders:
+        start = time.perf_counter()
+        for _ in range(2000):
+            encode()
+        print(f"  encode a page with {label:<12} {(time.perf_counter() - start) / 2000 * 1e6:8.1f} us")
+
+
+if __name__ == "__main__":
+    main()
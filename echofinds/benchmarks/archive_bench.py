@@ -0,0 +1,122 @@
+"""Order history size and latency before and after archiving (archive.py).
+
+Seeds a temporary sqlite database (seed.py) with --orders orders spread over
+--days days, then measures, before and after archiving every month older
+than --after-days:
+
+  - the space orders and order_items take, their indexes included (dbstat),
+    and the size of the archive files;
+  - purchase history latency for --sample users: the first page, and every
+    page of a walk back to their oldest order (the pages past the archive
+    boundary are the ones that read the files).
+
+Usage: python benchmarks/archive_bench.py [--orders 2000000] [--days 730] [--after-days 180]
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+_tmp = tempfile.mkdtemp()
+os.environ.setdefault("ECOFINDS_DB_BACKEND", "sqlite")
+os.environ.setdefault("ECOFINDS_SQLITE_PATH", os.path.join(_tmp, "archive.sqlite3"))
+os.environ.setdefault("ECOFINDS_CART_KV_PATH", os.path.join(_tmp, "carts.sqlite3"))
+os.environ.setdefault("ECOFINDS_ARCHIVE_DIR", os.path.join(_tmp, "archive"))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import archive  # noqa: E402
+import db  # noqa: E402
+import purchases  # noqa: E402
+import seed  # noqa: E402
+
+
+def table_sizes():
+    # {table: (rows, bytes including its indexes)} for the order tables
+    conn = db.get_db_connection()
+    cursor = conn.cursor()
+    sizes = {}
+    for table in ("orders", "order_items"):
+        cursor.execute(f"SELECT COUNT(*) FROM {table}")
+        rows = cursor.fetchone()[0]
+        cursor.execute("SELECT SUM(s.pgsize) FROM dbstat s JOIN sqlite_master m ON m.name = s.name "
+                       "WHERE m.tbl_name = %s", (table,))
+        sizes[table] = (rows, cursor.fetchone()[0] or 0)
+    conn.commit()
+    cursor.close()
+    conn.close()
+    return sizes
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))] if values else 0.0
+
+
+def history_latency(user_ids):
+    # ([first page ms], [later page ms], [archived page ms]) walking each user's whole history
+    first, later, archived = [], [], []
+    conn = db.get_db_connection()
+    boundary = archive.boundary()
+    for uid in user_ids:
+        token, page = None, 0
+        while True:
+            start = time.perf_counter()
+            orders, token = purchases.order_history(conn, uid, token)
+            elapsed = (time.perf_counter() - start) * 1000
+            if page == 0:
+                first.append(elapsed)
+            elif boundary and orders and orders[-1]["timestamp"] < boundary:
+                archived.append(elapsed)
+            else:
+                later.append(elapsed)
+            page += 1
+            if not token:
+                break
+    conn.close()
+    return first, later, archived
+
+
+def report(label, sizes, latency):
+    print(label)
+    for table, (rows, size) in sizes.items():
+        print(f"  {table:<12} {rows:>10} rows {size / 2 ** 20:>9.1f} MB")
+    for name, values in zip(("first page", "older pages", "archive pages"), latency):
+        if values:
+            print(f"  {name:<14} {len(values):>6} pages  p50 {percentile(values, 0.5):6.2f} ms  "
+                  f"p95 {percentile(values, 0.95):6.2f} ms  p99 {percentile(values, 0.99):6.2f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--users", type=int, default=20000)
+    parser.add_argument("--products", type=int, default=50000)
+    parser.add_argument("--orders", type=int, default=2000000)
+    parser.add_argument("--days", type=int, default=730)
+    parser.add_argument("--after-days", type=int, default=180)
+    parser.add_argument("--sample", type=int, default=200, help="users whose history is walked")
+    args = parser.parse_args()
+
+    ids = seed.seed(args.users, args.products, args.orders, days=args.days, batch=10000,
+                    log=lambda line: print("  seed: " + line))
+    users = random.Random(7).sample(range(ids["users"][0], ids["users"][1] + 1), args.sample)
+    print(f"{args.orders} orders over {args.days} days, pages of {purchases.ORDERS_PAGE_SIZE}, "
+          f"{args.sample} users walked back to their first order")
+    report("before archiving", table_sizes(), history_latency(users))
+
+    start = time.perf_counter()
+    months = archive.run(args.after_days, log=lambda line: None)
+    elapsed = time.perf_counter() - start
+    parts = archive.manifest()["partitions"]
+    archived_bytes = sum(p["bytes"] for p in parts)
+    print(f"archived {len(months)} months ({sum(p['orders'] for p in parts)} orders, "
+          f"{sum(p['items'] for p in parts)} items) in {elapsed:.1f}s: "
+          f"{archived_bytes / 2 ** 20:.1f} MB of files, {sum(len(p['blocks']) for p in parts)} blocks")
+    report("after archiving", table_sizes(), history_latency(users))
+    print(f"database file {os.path.getsize(db.SQLITE_PATH) / 2 ** 20:.1f} MB "
+          "(freed pages are reused by new rows; VACUUM returns them)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,180 @@
+"""WSGI vs ASGI latency and throughput at high concurrency against a slow database.
+
+Every SQL statement is delayed by --delay seconds to stand in for a database
+on the other side of a network. The same request mix (dashboard, products,
+cart, purchase history as a logged-in user) is driven closed-loop by
+--concurrency clients against:
+
+  wsgi  the Flask app on a pool of --threads worker threads (like gunicorn gthread)
+  asgi  asgi.application on one event loop with the async pool
+
+Both modes use a database pool of --pool-size connections. The fragment cache
+is disabled so every page reaches the database.
+
+Usage: python benchmarks/asgi_bench.py [--concurrency 200] [--threads 16] [--delay 0.02]
+"""
+import argparse
+import asyncio
+import os
+import queue
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+_tmp = tempfile.mkdtemp()
+os.environ.setdefault("ECOFINDS_DB_BACKEND", "sqlite")
+os.environ.setdefault("ECOFINDS_SQLITE_PATH", os.path.join(_tmp, "asgi.sqlite3"))
+os.environ.setdefault("ECOFINDS_CART_KV_PATH", os.path.join(_tmp, "carts.sqlite3"))
+os.environ["ECOFINDS_FRAGMENT_CACHE"] = "0"
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import adb  # noqa: E402
+import asgi  # noqa: E402
+import db  # noqa: E402
+
+PATHS = ["/dashboard", "/products", "/cart", "/previous_purchases"]
+
+
+def seed(n_products):
+    conn = db.get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute("INSERT INTO users (username, email, password) VALUES (%s,%s,%s)", ("bench", "bench@x", "pw"))
+    cursor.executemany(
+        "INSERT INTO products (user_id, title, description, category, price, image_url) VALUES (%s,%s,%s,%s,%s,%s)",
+        [(1, f"item {i}", "bench item", "Bench", 10, None) for i in range(n_products)])
+    conn.commit()
+    cursor.close()
+    conn.close()
+
+
+def slow_database(delay):
+    # every statement waits `delay` seconds first, holding its connection like a network round trip
+    original_execute = db._SqliteCursor.execute
+    original_executemany = db._SqliteCursor.executemany
+
+    def execute(self, *args, **kwargs):
+        time.sleep(delay)
+        return original_execute(self, *args, **kwargs)
+
+    def executemany(self, *args, **kwargs):
+        time.sleep(delay)
+        return original_executemany(self, *args, **kwargs)
+
+    db._SqliteCursor.execute = execute
+    db._SqliteCursor.executemany = executemany
+
+
+def scope(path, cookie):
+    return {"type": "http", "method": "GET", "path": path, "query_string": b"", "http_version": "1.1",
+            "scheme": "http", "server": ("localhost", 80), "client": ("127.0.0.1", 0),
+            "headers": [(b"host", b"localhost"), (b"cookie", cookie.encode())]}
+
+
+def login_cookie():
+    client = asgi.flask_app.test_client()
+    client.post("/login", data={"email": "bench@x", "password": "pw"})
+    client.post("/add_to_cart/1")
+    return "session=" + client.get_cookie("session").value
+
+
+def report(label, latencies, elapsed, statuses):
+    latencies.sort()
+    p50 = statistics.median(latencies) * 1000
+    p99 = latencies[int(len(latencies) * 0.99) - 1] * 1000
+    bad = sum(1 for s in statuses if s != 200)
+    print(f"{label:<5} {len(latencies) / elapsed:8.1f} req/s   p50 {p50:8.1f} ms   p99 {p99:8.1f} ms   non-200 {bad}")
+
+
+def run_wsgi(cookie, args):
+    # closed loop: `concurrency` requests are always waiting for one of `threads` workers
+    jobs = queue.Queue()
+    latencies, statuses = [], []
+    lock = threading.Lock()
+    remaining = [args.requests]
+
+    def submit(i):
+        jobs.put((PATHS[i % len(PATHS)], time.perf_counter()))
+
+    def worker():
+        while True:
+            path, queued_at = jobs.get()
+            if path is None:
+                return
+            status, _, _ = asgi._call_wsgi(asgi._wsgi_environ(scope(path, cookie), b""))
+            with lock:
+                latencies.append(time.perf_counter() - queued_at)
+                statuses.append(status)
+                remaining[0] -= 1
+                issued = args.requests - remaining[0]
+                if issued + args.concurrency <= args.requests:
+                    submit(issued + args.concurrency)
+                if remaining[0] == 0:
+                    for _ in range(args.threads):
+                        jobs.put((None, None))
+
+    db._pool = db.ConnectionPool(db._connect_sqlite, size=args.pool_size)
+    threads = [threading.Thread(target=worker) for _ in range(args.threads)]
+    start = time.perf_counter()
+    for i in range(min(args.concurrency, args.requests)):
+        submit(i)
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    report("wsgi", latencies, time.perf_counter() - start, statuses)
+
+
+async def run_asgi(cookie, args):
+    latencies, statuses = [], []
+    counter = iter(range(args.requests))
+    adb._pool = adb.AsyncPool(size=args.pool_size)
+
+    async def call(path):
+        sent = {}
+
+        async def receive():
+            return {"type": "http.request", "body": b"", "more_body": False}
+
+        async def send(message):
+            if message["type"] == "http.response.start":
+                sent["status"] = message["status"]
+
+        await asgi.application(scope(path, cookie), receive, send)
+        return sent["status"]
+
+    async def client():
+        for i in counter:
+            started = time.perf_counter()
+            statuses.append(await call(PATHS[i % len(PATHS)]))
+            latencies.append(time.perf_counter() - started)
+
+    start = time.perf_counter()
+    await asyncio.gather(*[client() for _ in range(args.concurrency)])
+    report("asgi", latencies, time.perf_counter() - start, statuses)
+    await adb.close_pool()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--products", type=int, default=2000)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=200)
+    parser.add_argument("--threads", type=int, default=16)
+    parser.add_argument("--pool-size", type=int, default=32)
+    parser.add_argument("--delay", type=float, default=0.02)
+    args = parser.parse_args()
+
+    with asgi.flask_app.app_context():
+        seed(args.products)
+    cookie = login_cookie()
+    slow_database(args.delay)
+    print(f"{args.requests} requests, concurrency {args.concurrency}, {args.delay * 1000:.0f} ms per statement, "
+          f"pool {args.pool_size}")
+    run_wsgi(cookie, args)
+    asyncio.run(run_asgi(cookie, args))
+
+
+if __name__ == "__main__":
+    main()
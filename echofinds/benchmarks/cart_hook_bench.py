@@ -0,0 +1,94 @@
+"""Requests per second with the legacy sanitize_cart hook, the cached hook and no hook.
+
+Runs the app in-process (Flask test client) against a temporary sqlite database,
+with a cart of --cart-size items (seeded as a legacy cookie cart, which the
+first request moves into the cart store).
+
+Usage: python benchmarks/cart_hook_bench.py [--products 10000] [--requests 2000]
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+_tmp = tempfile.mkdtemp()
+os.environ.setdefault("ECOFINDS_DB_BACKEND", "sqlite")
+os.environ.setdefault("ECOFINDS_SQLITE_PATH", os.path.join(_tmp, "bench.sqlite3"))
+os.environ.setdefault("ECOFINDS_CART_KV_PATH", os.path.join(_tmp, "carts.sqlite3"))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import app as ecofinds  # noqa: E402
+import carts  # noqa: E402
+import db  # noqa: E402
+
+
+def legacy_sanitize_cart():
+    # the pre-cache hook: one connection and one query on every request
+    cart = carts.get_cart()
+    if not cart:
+        return
+    conn = db.get_db_connection()
+    cursor = conn.cursor(dictionary=True)
+    unique_ids = sorted(cart)
+    placeholders = ','.join(['%s'] * len(unique_ids))
+    cursor.execute(f"SELECT id FROM products WHERE id IN ({placeholders})", tuple(unique_ids))
+    existing = {r['id'] for r in cursor.fetchall()}
+    cursor.close()
+    conn.close()
+    carts.discard_items([pid for pid in cart if pid not in existing])
+
+
+def seed(n_products):
+    conn = db.get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute("INSERT INTO users (username, email, password) VALUES (%s,%s,%s)", ("seller", "seller@x", "pw"))
+    seller = cursor.lastrowid
+    cursor.executemany(
+        "INSERT INTO products (user_id, title, description, category, price, image_url) VALUES (%s,%s,%s,%s,%s,%s)",
+        [(seller, f"item {i}", "bench item", "Bench", 10, None) for i in range(n_products)])
+    conn.commit()
+    cursor.close()
+    conn.close()
+
+
+def measure(client, paths, n_requests):
+    start = time.perf_counter()
+    for i in range(n_requests):
+        client.get(paths[i % len(paths)])
+    return n_requests / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--products", type=int, default=10000)
+    parser.add_argument("--cart-size", type=int, default=20)
+    parser.add_argument("--requests", type=int, default=2000)
+    args = parser.parse_args()
+
+    app = ecofinds.app
+    with app.app_context():
+        seed(args.products)
+    client = app.test_client()
+    with client.session_transaction() as sess:
+        sess['cart'] = list(range(1, args.cart_size + 1))
+
+    # routes that never read the cart, plus the cart page itself
+    paths = ["/login", "/static/css/styles.css", "/products", "/cart"]
+    hooks = app.before_request_funcs.setdefault(None, [])
+    current = list(hooks)
+    modes = [
+        ("legacy hook (DB per request)", [legacy_sanitize_cart]),
+        ("cached hook (cart routes only)", current),
+        ("no hook", []),
+    ]
+    for label, funcs in modes:
+        hooks[:] = funcs
+        measure(client, paths, 50)  # warm up pool, caches and templates
+        rps = measure(client, paths, args.requests)
+        print(f"{label:<32} {rps:8.1f} req/s")
+    hooks[:] = current
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+"""Concurrent checkout load test: throughput and oversell rate.
+
+Many logged-in buyers race to check out from a small pool of single-item
+listings. Every listing has stock 1, so any listing with more than one unit
+sold is an oversell. Uses the configured backend (sqlite temp file by default).
+
+Usage: python benchmarks/checkout_load.py [--buyers 32] [--products 50] [--attempts 20]
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+
+_tmp = tempfile.mkdtemp()
+os.environ.setdefault("ECOFINDS_DB_BACKEND", "sqlite")
+os.environ.setdefault("ECOFINDS_SQLITE_PATH", os.path.join(_tmp, "checkout.sqlite3"))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import app as ecofinds  # noqa: E402
+import db  # noqa: E402
+
+
+def seed(n_buyers, n_products):
+    conn = db.get_db_connection()
+    cursor = conn.cursor()
+    cursor.executemany("INSERT INTO users (username, email, password) VALUES (%s,%s,%s)",
+                       [(f"buyer{i}", f"buyer{i}@example.com", "pw") for i in range(n_buyers)])
+    cursor.executemany(
+        "INSERT INTO products (user_id, title, description, category, price, image_url, stock) VALUES (%s,%s,%s,%s,%s,%s,%s)",
+        [(1, f"item {i}", "load test item", "Load", 10, None, 1) for i in range(n_products)])
+    conn.commit()
+    cursor.close()
+    conn.close()
+
+
+def buyer(app, user_id, n_products, attempts, results, lock):
+    client = app.test_client()
+    rng = random.Random(user_id)
+    ok = failed = 0
+    for _ in range(attempts):
+        with client.session_transaction() as sess:
+            sess['user_id'] = user_id
+            sess['cart'] = rng.sample(range(1, n_products + 1), k=2)
+        resp = client.post('/checkout')
+        if 'order_success' in resp.headers.get('Location', ''):
+            ok += 1
+        else:
+            failed += 1
+    with lock:
+        results['ok'] += ok
+        results['rejected'] += failed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--buyers", type=int, default=32)
+    parser.add_argument("--products", type=int, default=50)
+    parser.add_argument("--attempts", type=int, default=20)
+    args = parser.parse_args()
+
+    app = ecofinds.app
+    with app.app_context():
+        seed(args.buyers, args.products)
+
+    results = {'ok': 0, 'rejected': 0}
+    lock = threading.Lock()
+    threads = [threading.Thread(target=buyer, args=(app, uid, args.products, args.attempts, results, lock))
+               for uid in range(1, args.buyers + 1)]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - start
+
+    with app.app_context():
+        conn = db.get_db_connection()
+        cursor = conn.cursor()
+        cursor.execute("SELECT product_id, SUM(quantity) FROM order_items GROUP BY product_id")
+        sold = dict(cursor.fetchall())
+        cursor.close()
+        conn.close()
+    oversold = sum(1 for units in sold.values() if units > 1)
+    total = results['ok'] + results['rejected']
+    print(f"checkouts attempted {total}, succeeded {results['ok']}, rejected {results['rejected']}")
+    print(f"throughput {total / elapsed:.1f} checkouts/s over {elapsed:.2f}s")
+    print(f"oversold listings {oversold}/{len(sold)} ({100.0 * oversold / max(len(sold), 1):.1f}%)")
+    print(f"pool: {db.pool_stats()}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,161 @@
+"""Fail if any statement a route runs does a full table scan on a large dataset.
+
+Seeds a temporary sqlite database (or the configured mysql one, with
+ECOFINDS_DB_BACKEND=mysql) with --users, --products and --orders rows, walks
+every page and form through the Flask app as a guest and as a logged-in
+seller/buyer while recording each distinct statement through the db query
+listeners, then EXPLAINs every SELECT/UPDATE/DELETE with the parameters it
+ran with, including every sort, category and price range combination of the
+product listings. A table scan is only accepted when it is bounded: the
+statement has a LIMIT, filters on nothing but the primary key and needs no
+sort (e.g. the newest-first listing pages), or is a newest-first walk over a
+wide price range. Exits 1 and prints the plans if anything else scans a
+table, and with them any sort of a whole table. The checks live in
+query_plans.py; tests/test_query_plans.py runs them on the product listings
+of a small database.
+
+Usage: python benchmarks/explain_check.py [--products 50000] [--orders 20000]
+"""
+import argparse
+import os
+import re
+import sys
+import tempfile
+
+_tmp = tempfile.mkdtemp()
+os.environ.setdefault("ECOFINDS_DB_BACKEND", "sqlite")
+os.environ.setdefault("ECOFINDS_SQLITE_PATH", os.path.join(_tmp, "explain.sqlite3"))
+os.environ.setdefault("ECOFINDS_CART_KV_PATH", os.path.join(_tmp, "carts.sqlite3"))
+os.environ.setdefault("ECOFINDS_UPLOAD_DIR", _tmp)
+os.environ.setdefault("ECOFINDS_ARCHIVE_DIR", os.path.join(_tmp, "archive"))
+os.environ["ECOFINDS_FRAGMENT_CACHE"] = "0"
+os.environ["ECOFINDS_HASH_WORKERS"] = "0"
+os.environ["ECOFINDS_LOGIN_IP_BURST"] = "1000000000"
+os.environ["ECOFINDS_LOGIN_EMAIL_BURST"] = "1000000000"
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import analytics  # noqa: E402
+import app as ecofinds  # noqa: E402
+import db  # noqa: E402
+import metrics  # noqa: E402
+import query_plans  # noqa: E402
+
+_recording = [True]
+
+
+def capture():
+    # normalized statement -> (query, params) of its first execution
+    seen = {}
+
+    def listener(query, params, seconds):
+        if not _recording[0]:
+            return
+        if not isinstance(params, (list, tuple)) or (params and isinstance(params[0], (list, tuple))):
+            return  # executemany
+        seen.setdefault(metrics.normalize_query(query), (query, tuple(params)))
+
+    db.add_query_listener(listener)
+    return seen
+
+
+def walk(app):
+    guest = app.test_client()
+    guest.get("/")
+    guest.get("/products")
+    guest.get("/products/10")
+    guest.post("/add_to_cart", data={"product_id": "11"})
+    guest.get("/cart")
+    guest.post("/checkout")
+    guest.get("/previous_purchases")
+
+    c = app.test_client()
+    c.post("/signup", data={"username": "check", "email": "check@example.com", "password": "pw"})
+    c.post("/login", data={"email": "user1@example.com", "password": "pw"})
+    pages = ["/dashboard", "/products", "/products?category=Books", "/products?q=item", "/products/12",
+             "/my_listings", "/profile", "/previous_purchases", "/add_product"]
+    for url in pages + query_plans.filter_urls() + query_plans.api_urls():
+        r = c.get(url)
+        older = re.search(r'href="([^"]+)">(?:Older|Next)', r.get_data(as_text=True))
+        if older:
+            c.get(older.group(1).replace("&amp;", "&"))
+    c.post("/profile", data={"username": "user1", "email": "user1@example.com", "password": ""})
+    c.post("/add_product", data={"title": "Lamp", "description": "desk lamp", "category": "Furniture", "price": "20"})
+    new_id = db_scalar("SELECT MAX(id) FROM products")
+    c.get(f"/edit_product/{new_id}")
+    c.post(f"/edit_product/{new_id}", data={"title": "Lamp", "description": "desk lamp", "category": "Garden",
+                                            "price": "25"})
+    c.post("/add_to_cart", data={"product_id": "13"})
+    c.post("/add_to_cart/14")
+    c.post("/remove_from_cart/14")
+    c.get("/cart")
+    r = c.post("/checkout")
+    location = r.headers.get("Location", "")
+    if "order_success" in location:
+        c.get(location)
+    c.post(f"/delete_product/{new_id}")
+    analytics.flush()
+    c.get("/analytics")
+    c.get("/analytics?days=90")
+    c.get("/logout")
+    # a legacy plaintext row is upgraded on login
+    c.post("/login", data={"email": "user2@example.com", "password": "pw"})
+
+
+def db_scalar(query):
+    _recording[0] = False
+    conn = db.get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute(query)
+    value = cursor.fetchone()[0]
+    cursor.close()
+    conn.close()
+    _recording[0] = True
+    return value
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--users", type=int, default=5000)
+    parser.add_argument("--products", type=int, default=50000)
+    parser.add_argument("--orders", type=int, default=20000)
+    parser.add_argument("--verbose", action="store_true", help="print every plan, not just failures")
+    args = parser.parse_args()
+
+    with ecofinds.app.app_context():
+        query_plans.seed(args.users, args.products, args.orders)
+    seen = capture()
+    walk(ecofinds.app)
+    _recording[0] = False
+
+    conn = db.get_pool().acquire()
+    cursor = conn.cursor()
+    if db.DB_BACKEND == "sqlite":
+        cursor.execute("SELECT name FROM sqlite_master WHERE type='table'")
+    else:
+        cursor.execute("SELECT table_name FROM information_schema.tables WHERE table_schema = DATABASE()")
+    tables = {r[0] for r in cursor.fetchall()}
+
+    failures = 0
+    checked = 0
+    for shape, (query, params) in sorted(seen.items()):
+        if not re.match(r"\s*(SELECT|UPDATE|DELETE)\b", query, re.IGNORECASE):
+            continue
+        checked += 1
+        plan, problems = query_plans.explain(cursor, query, params, tables)
+        if shape in query_plans.ALLOWED_SCANS:
+            problems = []
+        if problems:
+            failures += 1
+        if problems or args.verbose:
+            print(("FULL SCAN  " if problems else "ok         ") + shape)
+            for line in plan:
+                print("             " + line)
+    cursor.close()
+    conn.release()
+    print(f"{checked} statements checked on {args.products} products / {args.orders} orders: "
+          f"{failures} with full scans")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+"""Image bytes a browser downloads for one /products page, before and after the upload pipeline.
+
+Seeds listings from the sample images in static/uploads twice: once stored as
+raw originals (the old f.save path) and once through images.save_upload plus
+the resized variants. For <picture> elements the WebP candidate a browser would
+pick for a card slot of --slot-width pixels is counted; plain <img> tags count
+their src.
+
+Usage: python benchmarks/image_bytes_bench.py [--slot-width 480]
+"""
+import argparse
+import json
+import os
+import re
+import shutil
+import sys
+import tempfile
+
+_tmp = tempfile.mkdtemp()
+os.environ.setdefault("ECOFINDS_DB_BACKEND", "sqlite")
+os.environ.setdefault("ECOFINDS_SQLITE_PATH", os.path.join(_tmp, "images.sqlite3"))
+os.environ.setdefault("ECOFINDS_CART_KV_PATH", os.path.join(_tmp, "carts.sqlite3"))
+# both runs reseed the products table behind the app's back
+os.environ["ECOFINDS_FRAGMENT_CACHE"] = "0"
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import app as ecofinds  # noqa: E402
+import db  # noqa: E402
+import images  # noqa: E402
+import storage  # noqa: E402
+from werkzeug.datastructures import FileStorage  # noqa: E402
+
+SAMPLES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "static", "uploads")
+
+
+def sample_files():
+    return sorted(f for f in os.listdir(SAMPLES) if not f.startswith("user_") and "__" not in f)
+
+
+def seed(upload_dir, processed):
+    conn = db.get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute("DELETE FROM products")
+    cursor.execute("INSERT INTO users (username, email, password) VALUES (%s,%s,%s)", ("seller", "seller@x", "pw"))
+    seller = cursor.lastrowid
+    for name in sample_files():
+        if processed:
+            with open(os.path.join(SAMPLES, name), "rb") as fh:
+                stored = images.save_upload(FileStorage(fh, filename=name))
+            variants = images.build_variants(stored)
+        else:
+            shutil.copy(os.path.join(SAMPLES, name), os.path.join(upload_dir, name))
+            stored, variants = name, None
+        cursor.execute("INSERT INTO products (user_id, title, description, category, price, image_url, image_variants) "
+                       "VALUES (%s,%s,%s,%s,%s,%s,%s)",
+                       (seller, name, "sample", "Sample", 10, stored, json.dumps(variants) if variants else None))
+    conn.commit()
+    cursor.close()
+    conn.close()
+
+
+def pick(srcset, slot_width):
+    # smallest candidate at least as wide as the slot, else the largest one
+    candidates = []
+    for part in srcset.split(","):
+        url, width = part.strip().rsplit(" ", 1)
+        candidates.append((int(width.rstrip("w")), url))
+    candidates.sort()
+    for width, url in candidates:
+        if width >= slot_width:
+            return url
+    return candidates[-1][1]
+
+
+def page_bytes(html, upload_dir, slot_width):
+    urls = []
+    for picture in re.findall(r"<picture>.*?</picture>", html, re.S):
+        urls.append(pick(re.search(r'<source type="image/webp" srcset="([^"]+)"', picture).group(1), slot_width))
+    html = re.sub(r"<picture>.*?</picture>", "", html, flags=re.S)
+    urls += [u for u in re.findall(r'<img src="([^"]+)"', html) if "/uploads/" in u]
+    total = 0
+    for url in urls:
+        path = os.path.join(upload_dir, url.split("/uploads/", 1)[1].split("?")[0])
+        total += os.path.getsize(path)
+    return len(urls), total
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--slot-width", type=int, default=480)
+    args = parser.parse_args()
+
+    app = ecofinds.app
+    client = app.test_client()
+    for label, processed in (("before (raw originals)", False), ("after (pipeline variants)", True)):
+        upload_dir = tempfile.mkdtemp(dir=_tmp)
+        storage.set_backend(storage.LocalStorage(upload_dir))
+        with app.app_context():
+            seed(upload_dir, processed)
+        html = client.get("/products").data.decode()
+        count, total = page_bytes(html, upload_dir, args.slot_width)
+        print(f"{label:<27} {count} images, {total / 1024:8.1f} KiB per /products page")
+
+
+if __name__ == "__main__":
+    main()
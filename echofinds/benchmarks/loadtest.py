@@ -0,0 +1,318 @@
+"""Scripted load test over the main user journeys, with per-route latency.
+
+Virtual users (--vusers threads) repeatedly pick a journey by weight and run
+it step by step, each with its own cookie session:
+
+  browse     home, listing page, a few product pages
+  search     listing search for a catalog word, a product from the results
+  cart       product page, add to cart, view the cart
+  checkout   add to cart, view the cart, check out
+  purchases  previous purchases
+
+Most virtual users log in as a seeded user<id>@example.com first
+(--guest-share stay guests). By default the app runs in-process through the
+Flask test client against a temporary sqlite database filled by seed.py;
+--url drives a running server over HTTP instead (seed its database with
+seed.py first and pass the matching --users/--products ranges, or --no-seed
+to read them from the configured database). Reports requests/s and
+p50/p90/p95/p99/max latency per route and per journey, and writes the run to
+--out as JSON; --compare prints the change against an earlier result file.
+
+Usage: python benchmarks/loadtest.py [--vusers 16] [--duration 30] [--url http://127.0.0.1:5000]
+                                     [--compare benchmarks/results/loadtest-<ts>.json]
+"""
+import argparse
+import contextlib
+import http.cookiejar
+import json
+import os
+import random
+import re
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+
+_tmp = tempfile.mkdtemp()
+os.environ.setdefault("ECOFINDS_DB_BACKEND", "sqlite")
+os.environ.setdefault("ECOFINDS_SQLITE_PATH", os.path.join(_tmp, "loadtest.sqlite3"))
+os.environ.setdefault("ECOFINDS_CART_KV_PATH", os.path.join(_tmp, "carts.sqlite3"))
+os.environ.setdefault("ECOFINDS_UPLOAD_DIR", os.path.join(_tmp, "uploads"))
+os.environ["ECOFINDS_LOGIN_IP_BURST"] = "1000000000"
+os.environ["ECOFINDS_LOGIN_EMAIL_BURST"] = "1000000000"
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import db  # noqa: E402
+import seed  # noqa: E402
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results")
+JOURNEYS = {"browse": 35, "search": 25, "cart": 20, "checkout": 10, "purchases": 10}
+SEARCH_WORDS = sorted({w.lower() for _, adjectives, nouns, _ in seed.CATALOG.values()
+                       for w in adjectives + nouns if " " not in w})
+_PRODUCT_LINK_RE = re.compile(r'href="/products/(\d+)"')
+
+
+# ------------------ CLIENTS ------------------
+class InProcessClient:
+    # Flask test client; redirects are not followed, like a browser's first hop
+    def __init__(self, app):
+        self._client = app.test_client()
+
+    def request(self, method, path, data=None):
+        r = self._client.open(path, method=method, data=data)
+        return r.status_code, r.get_data(as_text=True)
+
+
+class _NoRedirect(urllib.request.HTTPRedirectHandler):
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+
+class HttpClient:
+    def __init__(self, base_url):
+        self.base_url = base_url.rstrip("/")
+        self._opener = urllib.request.build_opener(
+            urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()), _NoRedirect())
+
+    def request(self, method, path, data=None):
+        body = urllib.parse.urlencode(data).encode("ascii") if data is not None else None
+        req = urllib.request.Request(self.base_url + path, data=body, method=method)
+        try:
+            with self._opener.open(req, timeout=30) as r:
+                return r.status, r.read().decode("utf8", "replace")
+        except urllib.error.HTTPError as e:
+            return e.code, e.read().decode("utf8", "replace")
+
+
+# ------------------ JOURNEYS ------------------
+class VirtualUser:
+    def __init__(self, client, rng, products, record):
+        self.client = client
+        self.rng = rng
+        self.products = products
+        self.record = record
+
+    def step(self, route, method, path, data=None):
+        start = time.perf_counter()
+        try:
+            status, body = self.client.request(method, path, data)
+        except Exception:
+            status, body = 0, ""
+        self.record(route, time.perf_counter() - start, status == 0 or status >= 400)
+        return body
+
+    def product_id(self):
+        return self.rng.randint(*self.products)
+
+    def login(self, email):
+        self.step("POST /login", "POST", "/login", {"email": email, "password": seed.PASSWORD})
+
+    def browse(self):
+        self.step("GET /", "GET", "/")
+        body = self.step("GET /products", "GET", "/products")
+        found = _PRODUCT_LINK_RE.findall(body)
+        for _ in range(self.rng.randint(1, 3)):
+            pid = self.rng.choice(found) if found else self.product_id()
+            self.step("GET /products/<id>", "GET", f"/products/{pid}")
+
+    def search(self):
+        q = urllib.parse.quote(self.rng.choice(SEARCH_WORDS))
+        body = self.step("GET /products?q=", "GET", f"/products?q={q}")
+        found = _PRODUCT_LINK_RE.findall(body)
+        if found:
+            self.step("GET /products/<id>", "GET", f"/products/{self.rng.choice(found)}")
+
+    def cart(self):
+        pid = self.product_id()
+        self.step("GET /products/<id>", "GET", f"/products/{pid}")
+        self.step("POST /add_to_cart", "POST", "/add_to_cart", {"product_id": str(pid)})
+        self.step("GET /cart", "GET", "/cart")
+
+    def checkout(self):
+        self.step("POST /add_to_cart", "POST", "/add_to_cart", {"product_id": str(self.product_id())})
+        self.step("GET /cart", "GET", "/cart")
+        self.step("POST /checkout", "POST", "/checkout")
+
+    def purchases(self):
+        self.step("GET /previous_purchases", "GET", "/previous_purchases")
+
+
+# ------------------ STATS ------------------
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * p / 100))]
+
+
+def summarize(samples, errors, elapsed):
+    # {name: [seconds, ...]} -> {name: {count, rps, p50_ms, ..., errors}}
+    out = {}
+    for name in sorted(samples):
+        values = sorted(samples[name])
+        out[name] = {
+            "count": len(values),
+            "rps": round(len(values) / elapsed, 2),
+            "mean_ms": round(sum(values) / len(values) * 1000, 2),
+            **{f"p{p}_ms": round(percentile(values, p) * 1000, 2) for p in (50, 90, 95, 99)},
+            "max_ms": round(values[-1] * 1000, 2),
+            "errors": errors.get(name, 0),
+        }
+    return out
+
+
+def print_table(title, rows):
+    print(f"{title:<24}{'count':>8}{'req/s':>9}{'p50':>9}{'p90':>9}{'p95':>9}{'p99':>9}{'max':>9}{'errors':>8}")
+    for name, s in rows.items():
+        print(f"{name:<24}{s['count']:>8}{s['rps']:>9.1f}{s['p50_ms']:>9.1f}{s['p90_ms']:>9.1f}"
+              f"{s['p95_ms']:>9.1f}{s['p99_ms']:>9.1f}{s['max_ms']:>9.1f}{s['errors']:>8}")
+
+
+def compare(old, new):
+    # p50/p95 and throughput change per route against an earlier run
+    print(f"\nvs {old['timestamp']} ({old.get('commit') or 'unknown commit'}):")
+    print(f"{'route':<24}{'req/s':>18}{'p50 ms':>18}{'p95 ms':>18}")
+    for name, s in new["routes"].items():
+        before = old["routes"].get(name)
+        if not before:
+            print(f"{name:<24}  (new route)")
+            continue
+        cells = []
+        for key in ("rps", "p50_ms", "p95_ms"):
+            change = (s[key] - before[key]) / before[key] * 100 if before[key] else 0.0
+            cells.append(f"{before[key]:>7.1f}->{s[key]:<7.1f}{change:+.0f}%")
+        print(f"{name:<24}" + "".join(f"{c:>18}" for c in cells))
+
+
+def _git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def _id_range(table):
+    conn = db.get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute(f"SELECT MIN(id), MAX(id) FROM {table}")
+    low, high = cursor.fetchone()
+    cursor.close()
+    conn.close()
+    if low is None:
+        sys.exit(f"no rows in {table}; run seed.py first")
+    return [low, high]
+
+
+# ------------------ RUN ------------------
+def run(make_client, args, users, products):
+    samples, errors = {}, {}
+    journey_samples, journey_errors = {}, {}
+    lock = threading.Lock()
+    deadline = time.perf_counter() + args.duration
+    names, weights = list(JOURNEYS), list(JOURNEYS.values())
+
+    def vuser(index):
+        rng = random.Random(args.seed * 1000 + index)
+        failed = [False]
+
+        def record(route, seconds, error):
+            failed[0] = failed[0] or error
+            with lock:
+                samples.setdefault(route, []).append(seconds)
+                if error:
+                    errors[route] = errors.get(route, 0) + 1
+
+        v = VirtualUser(make_client(), rng, products, record)
+        if rng.random() >= args.guest_share:
+            v.login(f"user{rng.randint(*users)}@example.com")
+        while time.perf_counter() < deadline:
+            journey = rng.choices(names, weights)[0]
+            failed[0] = False
+            start = time.perf_counter()
+            getattr(v, journey)()
+            with lock:
+                journey_samples.setdefault(journey, []).append(time.perf_counter() - start)
+                if failed[0]:
+                    journey_errors[journey] = journey_errors.get(journey, 0) + 1
+
+    threads = [threading.Thread(target=vuser, args=(i,)) for i in range(args.vusers)]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - start
+    return (summarize(samples, errors, elapsed), summarize(journey_samples, journey_errors, elapsed),
+            sum(len(v) for v in samples.values()), elapsed)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--vusers", type=int, default=16, help="concurrent virtual users")
+    parser.add_argument("--duration", type=float, default=30, help="seconds to run")
+    parser.add_argument("--url", help="base url of a running server (default: in-process test client)")
+    parser.add_argument("--guest-share", type=float, default=0.2, help="fraction of virtual users not logged in")
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--products", type=int, default=20000)
+    parser.add_argument("--orders", type=int, default=10000)
+    parser.add_argument("--images", type=int, default=10)
+    parser.add_argument("--no-seed", action="store_true", help="use the rows already in the configured database")
+    parser.add_argument("--seed", type=int, default=1, help="random seed for data and journeys")
+    parser.add_argument("--out", help="result file (default benchmarks/results/loadtest-<timestamp>.json)")
+    parser.add_argument("--compare", help="earlier result file to compare against")
+    args = parser.parse_args()
+
+    if args.url:
+        make_client = lambda: HttpClient(args.url)  # noqa: E731
+    else:
+        import app as ecofinds
+        make_client = lambda: InProcessClient(ecofinds.app)  # noqa: E731
+
+    if args.no_seed:
+        users, products = _id_range("users"), _id_range("products")
+    else:
+        # plenty of stock so checkouts keep succeeding for the whole run
+        ranges = seed.seed(args.users, args.products, args.orders, n_images=args.images, stock=1000,
+                           seed=args.seed, log=lambda line: print("  seed: " + line))
+        users, products = ranges["users"], ranges["products"]
+
+    target = args.url or "in-process"
+    print(f"{args.vusers} virtual users for {args.duration:.0f}s against {target} ({db.DB_BACKEND})")
+    # the app logs every cart change; keep that out of the timings and the report
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        routes, journeys, total, elapsed = run(make_client, args, users, products)
+
+    print(f"{total} requests in {elapsed:.1f}s: {total / elapsed:.1f} req/s (latencies in ms)")
+    print_table("route", routes)
+    print()
+    print_table("journey", journeys)
+
+    result = {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "commit": _git_commit(),
+        "target": target,
+        "backend": db.DB_BACKEND,
+        "config": {k: v for k, v in vars(args).items() if k not in ("out", "compare")},
+        "requests": total,
+        "elapsed_s": round(elapsed, 2),
+        "rps": round(total / elapsed, 2),
+        "routes": routes,
+        "journeys": journeys,
+    }
+    out = args.out or os.path.join(RESULTS_DIR, f"loadtest-{time.strftime('%Y%m%d-%H%M%S')}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok=True)
+    with open(out, "w") as f:
+        json.dump(result, f, indent=2)
+    print(f"\nwrote {out}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f), result)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+"""Login throughput per core at the configured password hashing cost.
+
+First times a single hash in-process at each scrypt cost in --sweep (the
+number to pick ECOFINDS_SCRYPT_N from: interactive logins usually aim for
+50-250 ms). Then drives --logins POST /login requests from --threads client
+threads through the Flask app against a temporary sqlite database, with the
+hashing done by the credentials worker pool, and reports logins/s in total
+and per hash worker core. Rate limiting is switched off for the run.
+
+Usage: python benchmarks/login_bench.py [--logins 200] [--threads 8] [--sweep 14,15,16]
+"""
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+
+_tmp = tempfile.mkdtemp()
+os.environ.setdefault("ECOFINDS_DB_BACKEND", "sqlite")
+os.environ.setdefault("ECOFINDS_SQLITE_PATH", os.path.join(_tmp, "login.sqlite3"))
+os.environ.setdefault("ECOFINDS_CART_KV_PATH", os.path.join(_tmp, "carts.sqlite3"))
+os.environ["ECOFINDS_LOGIN_IP_BURST"] = "1000000000"
+os.environ["ECOFINDS_LOGIN_EMAIL_BURST"] = "1000000000"
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import app as ecofinds  # noqa: E402
+import credentials  # noqa: E402
+
+
+def sweep(exponents):
+    print(f"single hash, r={credentials.SCRYPT_R} p={credentials.SCRYPT_P}:")
+    for e in exponents:
+        params = (2 ** e, credentials.SCRYPT_R, credentials.SCRYPT_P)
+        credentials._hash("warmup", "scrypt", params)
+        start = time.perf_counter()
+        for _ in range(5):
+            credentials._hash("correct horse", "scrypt", params)
+        ms = (time.perf_counter() - start) / 5 * 1000
+        print(f"  N=2^{e:<3} {ms:8.1f} ms   {1000 / ms:6.1f} hashes/s/core")
+
+
+def run_logins(n_logins, n_threads):
+    client = ecofinds.app.test_client()
+    client.post("/signup", data={"username": "bench", "email": "bench@x", "password": "pw"})
+    remaining = iter(range(n_logins))
+    lock = threading.Lock()
+    failures = [0]
+
+    def worker():
+        c = ecofinds.app.test_client()
+        while True:
+            with lock:
+                if next(remaining, None) is None:
+                    return
+            r = c.post("/login", data={"email": "bench@x", "password": "pw"})
+            if r.status_code != 302:
+                with lock:
+                    failures[0] += 1
+
+    threads = [threading.Thread(target=worker) for _ in range(n_threads)]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - start
+    cores = min(max(credentials.HASH_WORKERS, 1), os.cpu_count() or 1)
+    print(f"{n_logins} logins, {n_threads} client threads, {credentials.HASH_WORKERS} hash workers "
+          f"({cores} cores used), N=2^{credentials.SCRYPT_N.bit_length() - 1}:")
+    print(f"  {n_logins / elapsed:8.1f} logins/s   {n_logins / elapsed / cores:8.1f} logins/s/core   "
+          f"failures {failures[0]}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--logins", type=int, default=200)
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--sweep", default="14,15,16", help="scrypt cost exponents to time")
+    args = parser.parse_args()
+
+    sweep([int(e) for e in args.sweep.split(",") if e])
+    run_logins(args.logins, args.threads)
+    credentials.shutdown()
+
+
+if __name__ == "__main__":
+    main()
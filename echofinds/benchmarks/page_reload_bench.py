@@ -0,0 +1,94 @@
+"""Bytes and status codes for a first visit and a repeat visit of one page.
+
+Loads a page plus every /static asset it references (stylesheet, logo,
+product images), then simulates the browser coming back: assets whose last
+response was cacheable as immutable are served from cache without a request,
+the rest are revalidated with If-None-Match. Run with --legacy to restore
+Flask's default static view for comparison.
+
+Usage: python benchmarks/page_reload_bench.py [--page /products] [--legacy]
+"""
+import argparse
+import os
+import re
+import sys
+import tempfile
+from collections import Counter
+
+_tmp = tempfile.mkdtemp()
+os.environ.setdefault("ECOFINDS_DB_BACKEND", "sqlite")
+os.environ.setdefault("ECOFINDS_SQLITE_PATH", os.path.join(_tmp, "reload.sqlite3"))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import app as ecofinds  # noqa: E402
+import db  # noqa: E402
+from flask import send_from_directory  # noqa: E402
+
+SAMPLES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "static", "uploads")
+
+
+def seed():
+    conn = db.get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute("DELETE FROM products")
+    cursor.execute("INSERT INTO users (username, email, password) VALUES (%s,%s,%s)", ("seller", "seller@x", "pw"))
+    seller = cursor.lastrowid
+    for name in sorted(f for f in os.listdir(SAMPLES) if not f.startswith("user_") and "__" not in f):
+        cursor.execute("INSERT INTO products (user_id, title, description, category, price, image_url) "
+                       "VALUES (%s,%s,%s,%s,%s,%s)", (seller, name, "sample", "Sample", 10, name))
+    conn.commit()
+    cursor.close()
+    conn.close()
+
+
+def asset_urls(html):
+    urls = re.findall(r'(?:href|src)="(/static/[^"]+)"', html)
+    return list(dict.fromkeys(u.replace("&amp;", "&") for u in urls))
+
+
+def visit(client, page, cache):
+    # cache: url -> (etag, immutable); returns (bytes transferred, status counter, skipped)
+    headers = {"Accept-Encoding": "gzip, br"}
+    resp = client.get(page, headers=headers)
+    total = len(resp.data)
+    statuses = Counter([resp.status_code])
+    skipped = 0
+    for url in asset_urls(resp.data.decode()):
+        etag, immutable = cache.get(url, (None, False))
+        if immutable:
+            skipped += 1
+            continue
+        req_headers = dict(headers)
+        if etag:
+            req_headers["If-None-Match"] = etag
+        r = client.get(url, headers=req_headers)
+        total += len(r.data)
+        statuses[r.status_code] += 1
+        cc = r.headers.get("Cache-Control", "")
+        cache[url] = (r.headers.get("ETag") or etag, "immutable" in cc)
+    return total, statuses, skipped
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--page", default="/products")
+    parser.add_argument("--legacy", action="store_true", help="use Flask's default static view")
+    args = parser.parse_args()
+
+    app = ecofinds.app
+    if args.legacy:
+        app.url_default_functions[None] = []
+        app.view_functions["static"] = lambda filename: send_from_directory(app.static_folder, filename)
+    with app.app_context():
+        seed()
+    client = app.test_client()
+    cache = {}
+    for label in ("first visit", "repeat visit"):
+        total, statuses, skipped = visit(client, args.page, cache)
+        codes = ", ".join(f"{code}x{n}" for code, n in sorted(statuses.items()))
+        print(f"{label:<13} {total / 1024:8.1f} KiB  requests {sum(statuses.values()):3d} ({codes})  "
+              f"served from cache {skipped}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+"""Build cost of the similar-products model and the cost of serving it.
+
+Seeds a temporary sqlite database (seed.py) with --products listings, then
+builds the model the way the background thread does, timing loading rows,
+vectorising and scoring separately and the growth of the process's peak
+resident memory. Writes the lists to product_similar, then times incremental
+edits (SimilarityModel.upsert) and the one-query lookup a detail page does,
+against scoring a listing on the fly from the in-memory model.
+
+Usage: python benchmarks/recommend_bench.py [--products 100000] [--edits 200] [--lookups 2000]
+"""
+import argparse
+import os
+import random
+import resource
+import sys
+import tempfile
+import time
+
+_tmp = tempfile.mkdtemp()
+os.environ.setdefault("ECOFINDS_DB_BACKEND", "sqlite")
+os.environ.setdefault("ECOFINDS_SQLITE_PATH", os.path.join(_tmp, "recommend.sqlite3"))
+os.environ.setdefault("ECOFINDS_CART_KV_PATH", os.path.join(_tmp, "carts.sqlite3"))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import numpy as np  # noqa: E402
+
+import db  # noqa: E402
+import recommend  # noqa: E402
+import seed  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--users", type=int, default=2000)
+    parser.add_argument("--products", type=int, default=100000)
+    parser.add_argument("--edits", type=int, default=200)
+    parser.add_argument("--lookups", type=int, default=2000)
+    args = parser.parse_args()
+
+    seed.seed(args.users, args.products, 0, days=30, log=lambda line: print("  seed: " + line))
+
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.perf_counter()
+    conn = db.get_db_connection()
+    cursor = conn.cursor()
+    rows = recommend._load_rows(cursor)
+    cursor.close()
+    conn.close()
+    loaded = time.perf_counter()
+    model = recommend.SimilarityModel()
+    model.build(rows)
+    built = time.perf_counter()
+    rss_after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    recommend._store(model, range(model.n))
+    stored = time.perf_counter()
+    print(f"{model.n} listings, {len(model._categories)} categories, k={model.k}, {model.dims} dimensions")
+    print(f"  load rows     {loaded - start:8.2f}s")
+    print(f"  build model   {built - loaded:8.2f}s")
+    print(f"  store lists   {stored - built:8.2f}s")
+    # ru_maxrss is in kilobytes on Linux; seeding may already have set the peak
+    print(f"  model arrays  {model.memory_bytes() / 2 ** 20:8.1f} MB, peak RSS {rss_before / 1024:.0f} MB before "
+          f"the build, {rss_after / 1024:.0f} MB after")
+
+    rng = random.Random(7)
+    latencies = []
+    for _ in range(args.edits):
+        row = dict(rng.choice(rows))
+        row["price"] = round(float(row["price"]) * rng.uniform(0.5, 2.0), 2)
+        edit_start = time.perf_counter()
+        changed = model.upsert(row)
+        recommend._store(model, changed)
+        latencies.append((time.perf_counter() - edit_start) * 1000)
+    latencies.sort()
+    print(f"incremental edit incl. store: p50 {latencies[len(latencies) // 2]:.1f} ms, "
+          f"p95 {latencies[int(len(latencies) * 0.95)]:.1f} ms")
+
+    ids = [r["id"] for r in rows]
+    start = time.perf_counter()
+    for _ in range(args.lookups):
+        recommend.similar_products(rng.choice(ids))
+    lookup_ms = (time.perf_counter() - start) / args.lookups * 1000
+    start = time.perf_counter()
+    for _ in range(min(args.lookups, 200)):
+        r = model.rows[rng.choice(ids)]
+        model._score(np.array([r]), model._members(model.category[r]))
+    online_ms = (time.perf_counter() - start) / min(args.lookups, 200) * 1000
+    print(f"detail page neighbours: stored lookup {lookup_ms:.3f} ms, scored on request {online_ms:.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,155 @@
+"""Read/write splitting against local sqlite files standing in for replicas.
+
+The primary is one sqlite file and every replica another file that is only
+brought up to date when this script "replicates" (sqlite backup API), so
+replicas are as stale as a lagging MySQL replica would be. With the fragment
+cache off (its fills always read the primary) the script checks that
+
+  - GET pages read a replica, not the primary;
+  - a session that just posted sees its write on the redirect target while
+    another session, still on a replica, does not, until replication;
+  - a replica that goes away is left out, reads move to the others, and it
+    is used again once the health check finds it back;
+
+then runs --requests page views from several sessions and prints how the
+reads spread over the replicas and the primary.
+
+Usage: python benchmarks/replica_check.py [--replicas 2] [--requests 2000]
+"""
+import argparse
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+
+_tmp = tempfile.mkdtemp()
+_parser = argparse.ArgumentParser(description=__doc__)
+_parser.add_argument("--replicas", type=int, default=2)
+_parser.add_argument("--requests", type=int, default=2000)
+_parser.add_argument("--products", type=int, default=5000)
+ARGS = _parser.parse_args()
+REPLICA_PATHS = [os.path.join(_tmp, f"replica{i}.sqlite3") for i in range(ARGS.replicas)]
+os.environ.setdefault("ECOFINDS_DB_BACKEND", "sqlite")
+os.environ.setdefault("ECOFINDS_SQLITE_PATH", os.path.join(_tmp, "primary.sqlite3"))
+os.environ.setdefault("ECOFINDS_CART_KV_PATH", os.path.join(_tmp, "carts.sqlite3"))
+os.environ.setdefault("ECOFINDS_UPLOAD_DIR", _tmp)
+os.environ["ECOFINDS_DB_REPLICAS"] = ",".join(REPLICA_PATHS)
+os.environ.setdefault("ECOFINDS_DB_PIN_SECONDS", "1")
+os.environ.setdefault("ECOFINDS_DB_HEALTH_INTERVAL", "0.2")
+os.environ.setdefault("ECOFINDS_FRAGMENT_CACHE", "0")
+os.environ.setdefault("ECOFINDS_RECOMMEND", "0")
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import db  # noqa: E402
+import seed  # noqa: E402
+
+from flask import g  # noqa: E402
+
+_sources = {}
+# requests that took a primary connection (background threads use it too, so the pool count won't do)
+_on_primary = [0]
+
+
+def _count_primary(exc=None):
+    # teardown_request runs before db's teardown_appcontext hands the connection back
+    if g.get("_db_conn") is not None:
+        _on_primary[0] += 1
+
+
+def replicate():
+    # copy the primary into every replica file that is "up"
+    source = sqlite3.connect(db.SQLITE_PATH)
+    for path in REPLICA_PATHS:
+        if os.path.exists(path) or path not in _sources:
+            dest = _sources.setdefault(path, sqlite3.connect(path))
+            source.backup(dest)
+    source.close()
+
+
+def reads():
+    return {r["name"]: r["reads"] for r in db.replica_stats()}, _on_primary[0]
+
+
+def check(label, condition):
+    print(f"  {'ok ' if condition else 'FAIL'} {label}")
+    if not condition:
+        raise SystemExit(1)
+
+
+def login(client, email):
+    client.post("/login", data={"email": email, "password": "password"})
+    # let the pin from the login POST run out
+    time.sleep(db.PIN_SECONDS + 0.1)
+
+
+def main():
+    seed.seed(50, ARGS.products, 200, days=30, log=lambda line: print("  seed: " + line))
+    replicate()
+    import app as appmod
+    app = appmod.app
+    app.teardown_request(_count_primary)
+    seller, browser = app.test_client(), app.test_client()
+    login(seller, "user1@example.com")
+    login(browser, "user2@example.com")
+    # the search index is built from the primary on first use
+    browser.get("/products?q=warmup")
+
+    print("routing")
+    before, primary_before = reads()
+    for path in ("/products", "/dashboard", "/previous_purchases", "/products/1"):
+        seller.get(path)
+    after, primary_after = reads()
+    check("GET pages read replicas", sum(after.values()) - sum(before.values()) == 4)
+    check("and no request touched the primary", primary_after == primary_before)
+
+    print("read your writes")
+    r = seller.post("/add_product", data={"title": "Fresh listing", "description": "just added",
+                                          "category": "Books", "price": "12"})
+    page = seller.get(r.headers["Location"]).data
+    check("the seller sees the new listing on the redirect target", b"Fresh listing" in page)
+    check("another session on a replica does not yet", b"Fresh listing" not in browser.get("/products").data)
+    time.sleep(db.PIN_SECONDS + 0.1)
+    check("the seller is back on a replica once the pin expires",
+          b"Fresh listing" not in seller.get("/products").data)
+    replicate()
+    check("everyone sees it after replication", b"Fresh listing" in browser.get("/products").data)
+
+    print("health")
+    replicas = db.get_replicas()
+    down = replicas[0]
+    os.rename(down.name, down.name + ".away")
+    # a stopped server drops its connections
+    down.pool.dispose()
+    time.sleep(db.HEALTH_INTERVAL * 3)
+    check(f"{down.name} is left out", not down.healthy)
+    before, _ = reads()
+    for _ in range(20):
+        browser.get("/products")
+    after, _ = reads()
+    check("reads move to the others" if len(replicas) > 1 else "reads fall back to the primary",
+          after[down.name] == before[down.name])
+    os.rename(down.name + ".away", down.name)
+    time.sleep(db.HEALTH_INTERVAL * 3)
+    check(f"{down.name} is back in rotation", down.healthy)
+
+    print(f"load: {ARGS.requests} page views from 8 sessions")
+    clients = [app.test_client() for _ in range(8)]
+    for i, client in enumerate(clients):
+        client.post("/login", data={"email": f"user{i + 3}@example.com", "password": "password"})
+    time.sleep(db.PIN_SECONDS + 0.1)
+    before, primary_before = reads()
+    paths = ["/products", "/products?category=Books", "/dashboard", "/previous_purchases", "/products/7"]
+    start = time.perf_counter()
+    for i in range(ARGS.requests):
+        clients[i % len(clients)].get(paths[i % len(paths)])
+    elapsed = time.perf_counter() - start
+    after, primary_after = reads()
+    print(f"  {ARGS.requests / elapsed:.0f} requests/s")
+    for name in after:
+        print(f"  {os.path.basename(name):<20} {after[name] - before[name]:>7} reads")
+    print(f"  {'primary':<20} {primary_after - primary_before:>7} requests")
+
+
+if __name__ == "__main__":
+    main()
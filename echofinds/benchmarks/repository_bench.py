@@ -0,0 +1,149 @@
+"""Repository queries (repository.py) against the dictionary cursors they replace.
+
+Seeds a temporary sqlite database (seed.py) with --products listings, then on
+one pooled connection runs three shapes of read the pages do, once the old
+way (a fresh cursor(dictionary=True) per query, a dict per row) and once
+through the repository (prepared statement reused per connection, one
+namedtuple class per statement):
+
+  - listing: walks the newest-first keyset pages of the dashboard;
+  - window: the by-id fetch of one page of search results;
+  - cart: SELECT * for a cart of --cart-size random ids.
+
+For each it prints rows/s and, measured in a separate pass under tracemalloc,
+the bytes a page's rows keep alive and the peak allocated while fetching
+them. Finally it counts the distinct IN (...) statement texts that lists of
+every length from 1 to 1000 need with and without chunking, i.e. how many
+statements a connection would have to prepare.
+
+Usage: python benchmarks/repository_bench.py [--products 50000] [--pages 2000]
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+
+_tmp = tempfile.mkdtemp()
+os.environ.setdefault("ECOFINDS_DB_BACKEND", "sqlite")
+os.environ.setdefault("ECOFINDS_SQLITE_PATH", os.path.join(_tmp, "repository.sqlite3"))
+os.environ.setdefault("ECOFINDS_CART_KV_PATH", os.path.join(_tmp, "carts.sqlite3"))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import db  # noqa: E402
+import pagination  # noqa: E402
+import repository  # noqa: E402
+import seed  # noqa: E402
+
+
+def dict_fetch(conn, query, args):
+    cursor = conn.cursor(dictionary=True)
+    cursor.execute(query, args)
+    rows = cursor.fetchall()
+    cursor.close()
+    return rows
+
+
+def listing_runner(fetch, pages):
+    # keyset walk from the newest listing, starting over at the end
+    def run(conn):
+        token, count = None, 0
+        for _ in range(pages):
+            query, args, kind = pagination.keyset_query(pagination.CARD_COLUMNS_WITH_SUMMARY, token=token)
+            page = pagination.keyset_result(fetch(conn, query, args), kind)
+            count += len(page.items)
+            token = page.next_cursor
+        return count
+    return run
+
+
+def in_runner(fetch, id_lists, columns):
+    def run(conn):
+        count = 0
+        for ids in id_lists:
+            placeholders = ','.join(['%s'] * len(ids))
+            count += len(fetch(conn, f"SELECT {columns} FROM products WHERE id IN ({placeholders})", tuple(ids)))
+        return count
+    return run
+
+
+def repo_in_runner(id_lists, columns):
+    def run(conn):
+        return sum(len(repository.products_by_ids(conn, ids, columns)) for ids in id_lists)
+    return run
+
+
+def measure(conn, run, samples):
+    # (rows per second, bytes kept per query result, peak bytes per query)
+    run(conn)
+    start = time.perf_counter()
+    rows = run(conn)
+    rate = rows / (time.perf_counter() - start)
+    tracemalloc.start()
+    kept = peak = 0
+    for query in samples:
+        tracemalloc.reset_peak()
+        before = tracemalloc.get_traced_memory()[0]
+        result = query(conn)
+        current, high = tracemalloc.get_traced_memory()
+        kept += current - before
+        peak += high - before
+        del result
+    tracemalloc.stop()
+    return rate, kept / len(samples), peak / len(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--users", type=int, default=500)
+    parser.add_argument("--products", type=int, default=50000)
+    parser.add_argument("--pages", type=int, default=2000)
+    parser.add_argument("--cart-size", type=int, default=20)
+    args = parser.parse_args()
+
+    seed.seed(args.users, args.products, 0, days=30, log=lambda line: print("  seed: " + line))
+    rng = random.Random(7)
+    windows = [rng.sample(range(1, args.products + 1), pagination.PAGE_SIZE) for _ in range(args.pages)]
+    carts = [rng.sample(range(1, args.products + 1), args.cart_size) for _ in range(args.pages)]
+
+    def listing_sample(fetch):
+        # the rows of the first page
+        query, args_, _ = pagination.keyset_query(pagination.CARD_COLUMNS_WITH_SUMMARY)
+        return lambda conn: fetch(conn, query, args_)
+
+    def in_sample(fetch, ids, columns):
+        placeholders = ','.join(['%s'] * len(ids))
+        return lambda conn: fetch(conn, f"SELECT {columns} FROM products WHERE id IN ({placeholders})", tuple(ids))
+
+    cases = [
+        ("listing", "dict cursor", listing_runner(dict_fetch, args.pages), [listing_sample(dict_fetch)] * 50),
+        ("listing", "repository", listing_runner(repository.fetch_all, args.pages),
+         [listing_sample(repository.fetch_all)] * 50),
+        ("window", "dict cursor", in_runner(dict_fetch, windows, pagination.CARD_COLUMNS),
+         [in_sample(dict_fetch, ids, pagination.CARD_COLUMNS) for ids in windows[:50]]),
+        ("window", "repository", repo_in_runner(windows, pagination.CARD_COLUMNS),
+         [lambda conn, ids=ids: repository.products_by_ids(conn, ids, pagination.CARD_COLUMNS) for ids in windows[:50]]),
+        ("cart", "dict cursor", in_runner(dict_fetch, carts, "*"),
+         [in_sample(dict_fetch, ids, "*") for ids in carts[:50]]),
+        ("cart", "repository", repo_in_runner(carts, repository.PRODUCT_COLUMNS),
+         [lambda conn, ids=ids: repository.products_by_ids(conn, ids) for ids in carts[:50]]),
+    ]
+    conn = db.get_db_connection()
+    print(f"{args.products} products, {db.DB_BACKEND}, {args.pages} queries per case")
+    print(f"  {'case':<8} {'via':<12} {'rows/s':>10} {'kept/query':>12} {'peak/query':>12}")
+    for name, label, run, samples in cases:
+        rate, kept, peak = measure(conn, run, samples)
+        print(f"  {name:<8} {label:<12} {rate:>10.0f} {kept / 1024:>10.1f}KB {peak / 1024:>10.1f}KB")
+    conn.close()
+
+    chunked = set()
+    for n in range(1, 1001):
+        chunked.update(placeholders for placeholders, _ in repository._in_chunks(range(n)))
+    print(f"IN lists of 1..1000 ids: 1000 statement texts unchunked, {len(chunked)} chunked "
+          f"(IN_CHUNK={repository.IN_CHUNK}, STATEMENT_CACHE={db.STATEMENT_CACHE})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+"""Compare /products search latency: LIKE '%q%' scan vs the in-process index.
+
+Usage: python benchmarks/search_bench.py [--sizes 10000,100000,1000000] [--queries 50]
+"""
+import argparse
+import itertools
+import os
+import random
+import sqlite3
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import search  # noqa: E402
+
+WORDS = ("wooden chair table sofa laptop keyboard mouse guitar violin piano lamp desk "
+         "shelf bicycle helmet jacket boots camera lens tripod kettle blender mixer "
+         "vintage used refurbished sturdy compact portable classic modern oak steel").split()
+CATEGORIES = ["Furniture", "Electronics", "Music", "Clothing", "Sports", "Kitchen", "Books"]
+SYLLABLES = "ka lo mi ne ru ta po se vi da fo gu ri zo be an el or is un".split()
+
+
+def make_vocabulary(rng, size=20000):
+    # real listings use a large vocabulary with a long tail; pad the common
+    # words with generated ones and draw them with Zipf-like weights
+    words = list(WORDS)
+    while len(words) < size:
+        words.append("".join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4))))
+    cum_weights = list(itertools.accumulate(1.0 / (rank + 1) for rank in range(len(words))))
+    return words, cum_weights
+
+
+def make_rows(n, rng, words, cum_weights):
+    for i in range(1, n + 1):
+        title = " ".join(rng.choices(words, cum_weights=cum_weights, k=3))
+        description = " ".join(rng.choices(words, cum_weights=cum_weights, k=20))
+        yield (i, title, description, rng.choice(CATEGORIES))
+
+
+def timed(fn, queries):
+    samples = []
+    for q in queries:
+        start = time.perf_counter()
+        fn(q)
+        samples.append((time.perf_counter() - start) * 1000)
+    samples.sort()
+    return statistics.median(samples), samples[int(len(samples) * 0.95) - 1]
+
+
+def run(n, n_queries):
+    rng = random.Random(n)
+    words, cum_weights = make_vocabulary(rng)
+    conn = sqlite3.connect(":memory:")
+    conn.execute("CREATE TABLE products (id INTEGER PRIMARY KEY, title TEXT, description TEXT, category TEXT)")
+    conn.executemany("INSERT INTO products VALUES (?,?,?,?)", make_rows(n, rng, words, cum_weights))
+    conn.commit()
+
+    start = time.perf_counter()
+    index = search.SearchIndex()
+    cur = conn.execute("SELECT id, title, description, category FROM products")
+    index.build({"id": r[0], "title": r[1], "description": r[2], "category": r[3]} for r in cur)
+    build_s = time.perf_counter() - start
+
+    # mix of full words and typed prefixes drawn the same way as listing text
+    queries = [w if rng.random() < 0.5 else w[:max(3, len(w) - 2)]
+               for w in rng.choices(words, cum_weights=cum_weights, k=n_queries)]
+
+    def like(q):
+        pattern = f"%{q}%"
+        conn.execute("SELECT id FROM products WHERE title LIKE ? OR description LIKE ?", (pattern, pattern)).fetchall()
+        conn.execute("SELECT DISTINCT category FROM products WHERE category IS NOT NULL AND category <> ''").fetchall()
+
+    def indexed(q):
+        # one page of ranked results, as the view would request
+        index.search(q, limit=50)
+        index.categories()
+
+    like_p50, like_p95 = timed(like, queries)
+    idx_p50, idx_p95 = timed(indexed, queries)
+    print(f"{n:>9} rows | build {build_s:6.2f}s | LIKE p50 {like_p50:8.2f}ms p95 {like_p95:8.2f}ms"
+          f" | index p50 {idx_p50:8.2f}ms p95 {idx_p95:8.2f}ms")
+    conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sizes", default="10000,100000,1000000")
+    parser.add_argument("--queries", type=int, default=50)
+    args = parser.parse_args()
+    for n in (int(s) for s in args.sizes.split(",")):
+        run(n, args.queries)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,402 @@
+import argparse
+import csv
+import io
+import json
+import os
+import shutil
+import sys
+import tempfile
+import urllib.parse
+from decimal import Decimal, InvalidOperation
+
+from flask import Response, request, session
+from werkzeug.datastructures import FileStorage
+
+import db
+import facets
+import fragments
+import images
+import product_ids
+import recommend
+import search
+import storage
+
+# Bulk listing import and export, as CSV or JSON Lines (one object per line).
+#   POST /products/import   file upload ("file" field) or a raw text/csv or
+#                           application/x-ndjson body; rows become listings of
+#                           the logged-in seller. Returns a JSON report.
+#   GET  /products/export   the seller's listings, streamed
+#   python bulk.py import listings.csv --user-id 7
+#   python bulk.py export [--user-id 7] [--format jsonl] > catalog.jsonl
+# Imports read the input as a stream and insert valid rows CHUNK_SIZE at a
+# time (one executemany and one transaction per chunk); a row that fails
+# validation is reported with its line number and skipped, the rest go in.
+# image_url may name an upload listings or profiles already use (its key, or
+# its /static/uploads/ URL as exported), which is shared, or any other file in
+# storage or placed under the upload directory, which is stored through the
+# normal upload pipeline; a generated variant (images.variant_name) is
+# rejected. Exports
+# read through an unbuffered (server-side on mysql) cursor CHUNK_SIZE rows at
+# a time, so the catalog is never held in memory.
+CHUNK_SIZE = int(os.environ.get("ECOFINDS_BULK_CHUNK", "500"))
+MAX_IMPORT_BYTES = int(os.environ.get("ECOFINDS_BULK_MAX_MB", "200")) * 1024 * 1024
+# per-row errors listed in a report; the failed count covers all of them
+MAX_REPORTED_ERRORS = 100
+
+FORMATS = {
+    "csv": ("text/csv", (".csv",)),
+    "jsonl": ("application/x-ndjson", (".jsonl", ".ndjson")),
+}
+EXPORT_COLUMNS = ["id", "user_id", "title", "description", "category", "price", "stock", "image_url"]
+INSERT_SQL = ("INSERT INTO products (user_id, title, description, category, price, image_url, image_variants, stock) "
+              "VALUES (%s,%s,%s,%s,%s,%s,%s,%s)")
+MAX_PRICE = Decimal("99999999.99")  # DECIMAL(10,2)
+
+
+class ImportFormatError(Exception):
+    pass
+
+
+def detect_format(fmt=None, filename=None, content_type=None):
+    if fmt:
+        if fmt not in FORMATS:
+            raise ImportFormatError(f"unknown format {fmt!r}; use one of {', '.join(FORMATS)}")
+        return fmt
+    ext = os.path.splitext(filename or "")[1].lower()
+    for name, (mimetype, extensions) in FORMATS.items():
+        if ext in extensions or content_type == mimetype:
+            return name
+    if content_type in ("application/jsonl", "application/json-lines"):
+        return "jsonl"
+    raise ImportFormatError("cannot tell the format; pass format=csv or format=jsonl")
+
+
+# ------------------ READING ------------------
+def read_records(stream, fmt):
+    # yields (line number, dict) from a binary stream without reading it all
+    text = io.TextIOWrapper(stream, encoding="utf-8-sig", newline="")
+    if fmt == "csv":
+        reader = csv.DictReader(text)
+        for record in reader:
+            yield reader.line_num, record
+        return
+    for line_no, line in enumerate(text, 1):
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError as e:
+            yield line_no, ValueError(f"invalid JSON: {e}")
+            continue
+        yield line_no, record if isinstance(record, dict) else ValueError("expected a JSON object")
+
+
+def _text(record, field, max_length, required=True):
+    value = record.get(field)
+    value = "" if value is None else str(value).strip()
+    if required and not value:
+        raise ValueError(f"{field} is required")
+    if len(value) > max_length:
+        raise ValueError(f"{field} is longer than {max_length} characters")
+    return value
+
+
+def validate(record):
+    # -> (title, description, category, price, stock) or ValueError
+    title = _text(record, "title", 255)
+    description = _text(record, "description", 65535, required=False)
+    category = _text(record, "category", 100)
+    try:
+        price = Decimal(str(record.get("price", "")).strip()).quantize(Decimal("0.01"))
+    except (InvalidOperation, ValueError):
+        raise ValueError(f"price is not a number: {record.get('price')!r}")
+    if not Decimal(0) <= price <= MAX_PRICE:
+        raise ValueError(f"price must be between 0 and {MAX_PRICE}")
+    stock = record.get("stock")
+    if stock in (None, ""):
+        stock = 1
+    try:
+        stock = int(stock)
+    except (TypeError, ValueError):
+        raise ValueError(f"stock is not a whole number: {stock!r}")
+    if stock < 0:
+        raise ValueError("stock cannot be negative")
+    return title, description, category, str(price), stock
+
+
+# ------------------ IMPORT ------------------
+class Importer:
+    def __init__(self, user_id, chunk_size=CHUNK_SIZE):
+        self.user_id = user_id
+        self.chunk_size = chunk_size
+        self.imported = 0
+        self.failed = 0
+        self.errors = []
+        self.fatal = None
+        self._pending = []    # (line, row tuple for INSERT_SQL)
+        self._images = {}     # image_url value -> (key, variants manifest)
+        self._held = []       # keys stored by this import; save_upload took a reference for each
+        self._last_id = 0
+
+    def _error(self, line, message):
+        self.failed += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({"line": line, "error": message})
+
+    def _image(self, value):
+        # image_url value -> (key, variants) of a stored upload, storing files from the upload directory
+        value = (value or "").strip()
+        if not value:
+            return None, None
+        if value in self._images:
+            return self._images[value]
+        name = urllib.parse.urlsplit(value).path
+        if "uploads/" in name:
+            name = name.rsplit("uploads/", 1)[1]
+        name = name.lstrip("/")
+        # variants belong to their original's listings and are deleted with it
+        if images.is_variant(name):
+            raise ValueError(f"image is a resized variant, not an upload: {value}")
+        backend = storage.get_backend()
+        stored = name and "/" not in name and backend.exists(name)
+        if stored and storage.referenced(name):
+            # an upload listings or profiles already use: share it
+            key = name
+        else:
+            # anything else (including a stored file nothing references, which
+            # the sweep may delete) is stored again through the upload pipeline
+            work_dir = tempfile.mkdtemp(dir=backend.temp_dir())
+            try:
+                if stored:
+                    path = os.path.join(work_dir, os.path.basename(name))
+                    backend.fetch(name, path)
+                else:
+                    root = os.path.realpath(storage.UPLOAD_DIR)
+                    path = os.path.realpath(os.path.join(root, name))
+                    if os.path.commonpath([root, path]) != root or not os.path.isfile(path):
+                        raise ValueError(f"image not found in the upload directory: {value}")
+                with open(path, "rb") as f:
+                    key = images.save_upload(FileStorage(f, filename=os.path.basename(path)))
+            except (images.InvalidImage, storage.UploadTooLarge) as e:
+                raise ValueError(str(e))
+            finally:
+                shutil.rmtree(work_dir, ignore_errors=True)
+            self._held.append(key)
+        self._images[value] = (key, images.stored_variants(key))
+        return self._images[value]
+
+    def add(self, line, record):
+        if isinstance(record, Exception):
+            self._error(line, str(record))
+            return
+        try:
+            title, description, category, price, stock = validate(record)
+            key, variants = self._image(record.get("image_url"))
+        except ValueError as e:
+            self._error(line, str(e))
+            return
+        self._pending.append((line, (self.user_id, title, description, category, price, key, variants, stock)))
+        if len(self._pending) >= self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        chunk, self._pending = self._pending, []
+        if not chunk:
+            return
+        conn = db.get_db_connection()
+        cursor = conn.cursor()
+        try:
+            conn.begin()
+            if not self._last_id:
+                cursor.execute("SELECT COALESCE(MAX(id), 0) FROM products")
+                self._last_id = cursor.fetchone()[0]
+            counts = {}
+            for _, row in chunk:
+                if row[5]:
+                    counts[row[5]] = counts.get(row[5], 0) + 1
+            deleting = storage.add_references(cursor, counts) if counts else set()
+            for line, row in chunk:
+                if row[5] in deleting:
+                    self._error(line, f"image {row[5]} is no longer stored; upload it again")
+            chunk = [(line, row) for line, row in chunk if row[5] not in deleting]
+            cursor.executemany(INSERT_SQL, [row for _, row in chunk])
+            facets.adjust(cursor, added=[(row[3], row[4]) for _, row in chunk])
+            # ids of the rows just inserted, for the in-process search index and id cache
+            cursor.execute("SELECT id, title, description, category, price FROM products "
+                           "WHERE user_id=%s AND id > %s ORDER BY id", (self.user_id, self._last_id))
+            added = cursor.fetchall()
+            conn.commit()
+        except Exception as e:
+            conn.rollback()
+            for line, _ in chunk:
+                self._error(line, f"not saved: {e}")
+            return
+        finally:
+            cursor.close()
+            conn.close()
+        self.imported += len(chunk)
+        facets.invalidate()
+        for pid, title, description, category, price in added:
+            search.index_product(pid, title, description, category, price)
+            product_ids.product_added(pid)
+            recommend.product_changed(pid)
+            self._last_id = max(self._last_id, pid)
+        for category in {row[3] for _, row in chunk}:
+            fragments.product_added(category)
+
+    def run(self, records):
+        try:
+            for line, record in records:
+                self.add(line, record)
+        except (UnicodeDecodeError, csv.Error) as e:
+            # the rest of the input can't be read; keep what was read so far
+            self.fatal = f"could not read input: {e}"
+        try:
+            self.flush()
+        finally:
+            self.finish()
+        return self.report()
+
+    def finish(self):
+        # listings now hold their own references; drop the ones save_upload took
+        for key in self._held:
+            storage.release(key)
+            images.schedule_variants(key)
+        self._held = []
+
+    def report(self):
+        report = {"imported": self.imported, "failed": self.failed, "errors": self.errors}
+        if self.fatal:
+            report["error"] = self.fatal
+        return report
+
+
+def import_stream(stream, fmt, user_id, chunk_size=CHUNK_SIZE):
+    return Importer(user_id, chunk_size).run(read_records(stream, fmt))
+
+
+# ------------------ EXPORT ------------------
+def _csv_line(values):
+    out = io.StringIO()
+    csv.writer(out).writerow(values)
+    return out.getvalue()
+
+
+def _json_value(value):
+    # mysql returns DECIMAL prices as Decimal
+    return float(value) if isinstance(value, Decimal) else str(value)
+
+
+def export_rows(fmt, user_id=None, chunk_size=CHUNK_SIZE):
+    # yields the export as text, one chunk of rows at a time. Uses its own
+    # connection, not the request's: a streamed response outlives the request.
+    conn = db.get_pool().acquire()
+    cursor = conn.cursor()
+    try:
+        query = f"SELECT {', '.join(EXPORT_COLUMNS)} FROM products"
+        params = ()
+        if user_id is not None:
+            query += " WHERE user_id=%s"
+            params = (user_id,)
+        cursor.execute(query + " ORDER BY id", params)
+        if fmt == "csv":
+            yield _csv_line(EXPORT_COLUMNS)
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                break
+            if fmt == "csv":
+                out = io.StringIO()
+                csv.writer(out).writerows(rows)
+                yield out.getvalue()
+            else:
+                yield "".join(json.dumps(dict(zip(EXPORT_COLUMNS, row)), default=_json_value) + "\n"
+                              for row in rows)
+    finally:
+        cursor.close()
+        conn.release()
+
+
+# ------------------ HTTP ------------------
+def import_endpoint():
+    if "user_id" not in session:
+        return {"error": "login required"}, 401
+    # listings files are allowed to be larger than image uploads
+    request.max_content_length = MAX_IMPORT_BYTES
+    upload = request.files.get("file")
+    if upload is not None:
+        stream, filename, content_type = upload.stream, upload.filename, upload.mimetype
+    else:
+        stream, filename, content_type = request.stream, None, request.mimetype
+    try:
+        fmt = detect_format(request.values.get("format"), filename, content_type)
+    except ImportFormatError as e:
+        return {"error": str(e)}, 400
+    report = import_stream(stream, fmt, session["user_id"])
+    print(f"Bulk import: user={session['user_id']} imported={report['imported']} failed={report['failed']}")
+    return report, 400 if "error" in report and not report["imported"] else 200
+
+
+def export_endpoint():
+    if "user_id" not in session:
+        return {"error": "login required"}, 401
+    try:
+        fmt = detect_format(request.args.get("format", "csv"))
+    except ImportFormatError as e:
+        return {"error": str(e)}, 400
+    mimetype = FORMATS[fmt][0]
+    return Response(export_rows(fmt, session["user_id"]), mimetype=mimetype,
+                    headers={"Content-Disposition": f'attachment; filename="listings.{fmt}"'})
+
+
+def init_app(app):
+    app.add_url_rule("/products/import", "import_products", import_endpoint, methods=["POST"])
+    app.add_url_rule("/products/export", "export_products", export_endpoint)
+
+
+# ------------------ CLI ------------------
+def main():
+    parser = argparse.ArgumentParser(description="Import or export product listings as CSV or JSON Lines.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    imp = sub.add_parser("import", help="create listings from a file ('-' reads stdin)")
+    imp.add_argument("path")
+    imp.add_argument("--user-id", type=int, required=True, help="seller the listings belong to")
+    imp.add_argument("--format", choices=list(FORMATS), help="default: from the file extension")
+    imp.add_argument("--chunk", type=int, default=CHUNK_SIZE, help="rows per INSERT batch")
+    exp = sub.add_parser("export", help="write listings to stdout or --out")
+    exp.add_argument("--user-id", type=int, help="only this seller's listings")
+    exp.add_argument("--format", choices=list(FORMATS), default="csv")
+    exp.add_argument("--out", help="output file (default: stdout)")
+    exp.add_argument("--chunk", type=int, default=CHUNK_SIZE, help="rows fetched at a time")
+    args = parser.parse_args()
+
+    if args.command == "import":
+        try:
+            fmt = detect_format(args.format, args.path)
+        except ImportFormatError as e:
+            parser.error(str(e))
+        if args.path == "-":
+            report = import_stream(sys.stdin.buffer, fmt, args.user_id, args.chunk)
+        else:
+            with open(args.path, "rb") as f:
+                report = import_stream(f, fmt, args.user_id, args.chunk)
+        for error in report["errors"]:
+            print(f"line {error['line']}: {error['error']}", file=sys.stderr)
+        if report["failed"] > len(report["errors"]):
+            print(f"... and {report['failed'] - len(report['errors'])} more", file=sys.stderr)
+        if "error" in report:
+            print(report["error"], file=sys.stderr)
+        print(f"imported {report['imported']} listings, {report['failed']} rows failed")
+        sys.exit(1 if report["failed"] or "error" in report else 0)
+
+    out = open(args.out, "w", newline="", encoding="utf8") if args.out else sys.stdout
+    try:
+        for text in export_rows(args.format, args.user_id, args.chunk):
+            out.write(text)
+    finally:
+        if args.out:
+            out.close()
+
+
+if __name__ == "__main__":
+    main()
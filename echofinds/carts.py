@@ -0,0 +1,378 @@
+import json
+import os
+import secrets
+import sqlite3
+import threading
+import time
+
+from flask import session
+
+# Server-side carts and guest orders.
+# The session cookie only carries user_id/username and, for guests, an opaque
+# token, so it stays the same size however full the cart is. A cart is a hash
+# of product id -> quantity under "cart:u:<user id>" or "cart:g:<token>"; guest
+# orders are a list of JSON records under "orders:g:<token>". The store speaks
+# the subset of the redis-py API used below, so a Redis server can be plugged
+# in directly; the default is an embedded SQLite file shared by every worker
+# process, and LocalRedis is an in-process stand-in for tests and benchmarks.
+STORE = os.environ.get("ECOFINDS_CART_STORE", "sqlite")  # sqlite | redis | memory
+KV_PATH = os.environ.get("ECOFINDS_CART_KV_PATH",
+                         os.path.join(os.path.dirname(__file__), "carts.sqlite3"))
+REDIS_URL = os.environ.get("ECOFINDS_REDIS_URL", "redis://localhost:6379/0")
+# idle guest carts and guest orders are dropped after this many seconds
+GUEST_TTL = int(os.environ.get("ECOFINDS_GUEST_CART_TTL", str(30 * 24 * 3600)))
+PURGE_INTERVAL = 3600
+
+KV_SCHEMA = """
+CREATE TABLE IF NOT EXISTS kv_hash (
+    name TEXT NOT NULL,
+    field TEXT NOT NULL,
+    value TEXT NOT NULL,
+    PRIMARY KEY (name, field)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS kv_list (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    name TEXT NOT NULL,
+    value TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS kv_list_name ON kv_list (name, id);
+CREATE TABLE IF NOT EXISTS kv_expiry (
+    name TEXT PRIMARY KEY,
+    expires_at REAL NOT NULL
+) WITHOUT ROWID;
+"""
+
+
+# ------------------ STORES ------------------
+class SqliteKV:
+    # embedded key-value store with redis-py style hash/list commands;
+    # one connection per thread, WAL so readers don't block the writer
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self._last_purge = 0
+        self._conn().executescript(KV_SCHEMA)
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _expired(self, conn, name):
+        row = conn.execute("SELECT expires_at FROM kv_expiry WHERE name=?", (name,)).fetchone()
+        if row and row[0] <= time.time():
+            self._drop(conn, name)
+            return True
+        return False
+
+    def _drop(self, conn, name):
+        conn.execute("DELETE FROM kv_hash WHERE name=?", (name,))
+        conn.execute("DELETE FROM kv_list WHERE name=?", (name,))
+        conn.execute("DELETE FROM kv_expiry WHERE name=?", (name,))
+
+    def purge_expired(self):
+        conn = self._conn()
+        now = time.time()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            names = [r[0] for r in conn.execute("SELECT name FROM kv_expiry WHERE expires_at <= ?", (now,))]
+            for name in names:
+                self._drop(conn, name)
+        self._last_purge = now
+        return len(names)
+
+    def hgetall(self, name):
+        conn = self._conn()
+        if self._expired(conn, name):
+            return {}
+        return dict(conn.execute("SELECT field, value FROM kv_hash WHERE name=?", (name,)).fetchall())
+
+    def hlen(self, name):
+        conn = self._conn()
+        if self._expired(conn, name):
+            return 0
+        return conn.execute("SELECT COUNT(*) FROM kv_hash WHERE name=?", (name,)).fetchone()[0]
+
+    def hincrby(self, name, key, amount=1):
+        conn = self._conn()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            self._expired(conn, name)
+            conn.execute("INSERT INTO kv_hash (name, field, value) VALUES (?,?,?) "
+                         "ON CONFLICT (name, field) DO UPDATE SET value = CAST(value AS INTEGER) + excluded.value",
+                         (name, str(key), amount))
+            return int(conn.execute("SELECT value FROM kv_hash WHERE name=? AND field=?",
+                                    (name, str(key))).fetchone()[0])
+
+    def hset(self, name, key, value):
+        conn = self._conn()
+        with conn:
+            conn.execute("INSERT INTO kv_hash (name, field, value) VALUES (?,?,?) "
+                         "ON CONFLICT (name, field) DO UPDATE SET value = excluded.value",
+                         (name, str(key), str(value)))
+        return 1
+
+    def hdel(self, name, *keys):
+        conn = self._conn()
+        with conn:
+            cur = conn.executemany("DELETE FROM kv_hash WHERE name=? AND field=?", [(name, str(k)) for k in keys])
+        return cur.rowcount
+
+    def rpush(self, name, *values):
+        conn = self._conn()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            self._expired(conn, name)
+            conn.executemany("INSERT INTO kv_list (name, value) VALUES (?,?)", [(name, v) for v in values])
+            return conn.execute("SELECT COUNT(*) FROM kv_list WHERE name=?", (name,)).fetchone()[0]
+
+    def lrange(self, name, start, end):
+        conn = self._conn()
+        if self._expired(conn, name):
+            return []
+        values = [r[0] for r in conn.execute("SELECT value FROM kv_list WHERE name=? ORDER BY id", (name,))]
+        return values[start:] if end == -1 else values[start:end + 1]
+
+    def delete(self, *names):
+        conn = self._conn()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            for name in names:
+                self._drop(conn, name)
+        return len(names)
+
+    def expire(self, name, seconds):
+        conn = self._conn()
+        with conn:
+            conn.execute("INSERT INTO kv_expiry (name, expires_at) VALUES (?,?) "
+                         "ON CONFLICT (name) DO UPDATE SET expires_at = excluded.expires_at",
+                         (name, time.time() + seconds))
+        if time.time() - self._last_purge > PURGE_INTERVAL:
+            self.purge_expired()
+        return True
+
+
+class LocalRedis:
+    # in-process stand-in for a Redis client (single process only)
+    def __init__(self):
+        self._data = {}
+        self._expiry = {}
+        self._lock = threading.Lock()
+
+    def _get(self, name, kind):
+        expires_at = self._expiry.get(name)
+        if expires_at is not None and expires_at <= time.time():
+            self._data.pop(name, None)
+            self._expiry.pop(name, None)
+        return self._data.setdefault(name, kind())
+
+    def hgetall(self, name):
+        with self._lock:
+            return dict(self._get(name, dict))
+
+    def hlen(self, name):
+        with self._lock:
+            return len(self._get(name, dict))
+
+    def hincrby(self, name, key, amount=1):
+        with self._lock:
+            h = self._get(name, dict)
+            h[str(key)] = str(int(h.get(str(key), 0)) + amount)
+            return int(h[str(key)])
+
+    def hset(self, name, key, value):
+        with self._lock:
+            self._get(name, dict)[str(key)] = str(value)
+            return 1
+
+    def hdel(self, name, *keys):
+        with self._lock:
+            h = self._get(name, dict)
+            return sum(h.pop(str(k), None) is not None for k in keys)
+
+    def rpush(self, name, *values):
+        with self._lock:
+            items = self._get(name, list)
+            items.extend(values)
+            return len(items)
+
+    def lrange(self, name, start, end):
+        with self._lock:
+            items = self._get(name, list)
+            return list(items[start:] if end == -1 else items[start:end + 1])
+
+    def delete(self, *names):
+        with self._lock:
+            for name in names:
+                self._data.pop(name, None)
+                self._expiry.pop(name, None)
+            return len(names)
+
+    def expire(self, name, seconds):
+        with self._lock:
+            self._expiry[name] = time.time() + seconds
+            return True
+
+
+def _make_store():
+    if STORE == "redis":
+        import redis
+        return redis.Redis.from_url(REDIS_URL, decode_responses=True)
+    if STORE == "memory":
+        return LocalRedis()
+    return SqliteKV(KV_PATH)
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_store():
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = _make_store()
+    return _store
+
+
+def set_store(store):
+    global _store
+    _store = store
+
+
+# ------------------ CARTS ------------------
+def _guest_token(create=False):
+    token = session.get('guest')
+    if token is None and create:
+        token = secrets.token_urlsafe(16)
+        session['guest'] = token
+    return token
+
+
+def _cart_key(create=False):
+    if session.get('user_id'):
+        return f"cart:u:{session['user_id']}"
+    token = _guest_token(create)
+    return f"cart:g:{token}" if token else None
+
+
+def _touch(key):
+    # guest data expires after GUEST_TTL of inactivity
+    if key.startswith("cart:g:") or key.startswith("orders:g:"):
+        get_store().expire(key, GUEST_TTL)
+
+
+def _adopt_session_cart():
+    # carts and orders kept in the cookie by older versions move to the store once
+    legacy_cart = session.pop('cart', None)
+    legacy_orders = session.pop('orders', None)
+    if legacy_cart:
+        key = _cart_key(create=True)
+        for pid in legacy_cart:
+            get_store().hincrby(key, pid, 1)
+        _touch(key)
+    if legacy_orders:
+        key = f"orders:g:{_guest_token(create=True)}"
+        get_store().rpush(key, *[json.dumps(o) for o in legacy_orders])
+        _touch(key)
+
+
+def get_cart():
+    # {product_id: quantity}
+    if 'cart' in session or 'orders' in session:
+        _adopt_session_cart()
+    key = _cart_key()
+    if key is None:
+        return {}
+    return {int(pid): int(qty) for pid, qty in get_store().hgetall(key).items() if int(qty) > 0}
+
+
+def cart_count():
+    return sum(get_cart().values())
+
+
+def add_item(product_id, quantity=1):
+    key = _cart_key(create=True)
+    qty = get_store().hincrby(key, product_id, quantity)
+    _touch(key)
+    return qty
+
+
+def remove_item(product_id, quantity=1):
+    # drop one unit (or the line when it reaches zero); returns the remaining quantity
+    key = _cart_key()
+    if key is None:
+        return 0
+    store = get_store()
+    qty = store.hincrby(key, product_id, -quantity)
+    if qty <= 0:
+        store.hdel(key, product_id)
+        return 0
+    return qty
+
+
+def discard_items(product_ids):
+    # remove lines for products that no longer exist
+    key = _cart_key()
+    if key and product_ids:
+        get_store().hdel(key, *product_ids)
+
+
+def clear_cart():
+    key = _cart_key()
+    if key:
+        get_store().delete(key)
+
+
+def merge_guest_cart(user_id):
+    # called at login: fold the guest cart into the account cart, adding quantities
+    if 'cart' in session or 'orders' in session:
+        _adopt_session_cart()
+    token = _guest_token()
+    if token is None:
+        return
+    store = get_store()
+    guest_key = f"cart:g:{token}"
+    for pid, qty in store.hgetall(guest_key).items():
+        store.hincrby(f"cart:u:{user_id}", pid, int(qty))
+    store.delete(guest_key)
+
+
+# ------------------ GUEST ORDERS ------------------
+def add_guest_order(items, timestamp):
+    # items: {product_id: quantity}
+    key = f"orders:g:{_guest_token(create=True)}"
+    get_store().rpush(key, json.dumps({'items': {str(pid): qty for pid, qty in items.items()},
+                                       'timestamp': timestamp}))
+    _touch(key)
+
+
+def guest_orders():
+    # [{'items': {product_id: quantity}, 'timestamp': ...}] oldest first
+    if 'orders' in session:
+        _adopt_session_cart()
+    token = _guest_token()
+    if token is None:
+        return []
+    orders = []
+    for raw in get_store().lrange(f"orders:g:{token}", 0, -1):
+        o = json.loads(raw)
+        items = o.get('items', {})
+        if isinstance(items, list):
+            # records adopted from cookie sessions list one id per unit
+            counted = {}
+            for pid in items:
+                counted[pid] = counted.get(pid, 0) + 1
+            items = counted
+        o['items'] = {int(pid): int(qty) for pid, qty in items.items()}
+        orders.append(o)
+    return orders
+
+
+def init_app(app):
+    app.jinja_env.globals.update(cart_count=cart_count)
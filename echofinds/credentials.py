@@ -0,0 +1,273 @@
+import asyncio
+import base64
+import hashlib
+import hmac
+import math
+import os
+import threading
+import time
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeout
+from concurrent.futures.process import BrokenProcessPool
+
+try:
+    import argon2
+except ImportError:
+    # argon2-cffi is only needed for ECOFINDS_PASSWORD_SCHEME=argon2
+    argon2 = None
+
+# Password hashing and login throttling.
+# Hashes are computed in a bounded pool of worker processes so a burst of
+# logins costs CPU on the hash workers, not request threads (which only wait
+# on a future) or the event loop in asgi.py. At most HASH_QUEUE hashes may be
+# pending at once; beyond that callers wait up to HASH_TIMEOUT and then get
+# HashPoolBusy, as they do when a hash takes longer than HASH_TIMEOUT or the
+# pool's workers died (the pool is then replaced). Stored formats:
+#   scrypt$<n>$<r>$<p>$<salt b64>$<hash b64>
+#   $argon2id$...                       (argon2-cffi's own encoding)
+#   anything else                       legacy plaintext
+# A successful login against a plaintext row, or a hash made with other cost
+# settings, returns a fresh hash for the caller to store.
+SCHEME = os.environ.get("ECOFINDS_PASSWORD_SCHEME", "scrypt")
+SCRYPT_N = int(os.environ.get("ECOFINDS_SCRYPT_N", str(2 ** 14)))
+SCRYPT_R = int(os.environ.get("ECOFINDS_SCRYPT_R", "8"))
+SCRYPT_P = int(os.environ.get("ECOFINDS_SCRYPT_P", "1"))
+ARGON2_TIME_COST = int(os.environ.get("ECOFINDS_ARGON2_TIME_COST", "2"))
+ARGON2_MEMORY_KIB = int(os.environ.get("ECOFINDS_ARGON2_MEMORY_KIB", str(64 * 1024)))
+# 0 hashes in the calling thread (no worker processes)
+HASH_WORKERS = int(os.environ.get("ECOFINDS_HASH_WORKERS", str(os.cpu_count() or 1)))
+HASH_QUEUE = int(os.environ.get("ECOFINDS_HASH_QUEUE", str(max(HASH_WORKERS, 1) * 8)))
+HASH_TIMEOUT = float(os.environ.get("ECOFINDS_HASH_TIMEOUT", "10"))
+
+# token buckets: BURST attempts at once, refilled at PER_MINUTE
+LOGIN_IP_BURST = int(os.environ.get("ECOFINDS_LOGIN_IP_BURST", "20"))
+LOGIN_IP_PER_MINUTE = float(os.environ.get("ECOFINDS_LOGIN_IP_PER_MINUTE", "10"))
+LOGIN_EMAIL_BURST = int(os.environ.get("ECOFINDS_LOGIN_EMAIL_BURST", "5"))
+LOGIN_EMAIL_PER_MINUTE = float(os.environ.get("ECOFINDS_LOGIN_EMAIL_PER_MINUTE", "5"))
+
+SALT_BYTES = 16
+KEY_BYTES = 32
+
+
+class HashPoolBusy(Exception):
+    pass
+
+
+# ------------------ HASHING (runs in the worker processes) ------------------
+def _b64(raw):
+    return base64.b64encode(raw).decode("ascii").rstrip("=")
+
+
+def _unb64(text):
+    return base64.b64decode(text + "=" * (-len(text) % 4))
+
+
+def _scrypt(password, salt, n, r, p):
+    # scrypt needs 128 * r * n bytes; hashlib's default cap is 32 MiB
+    return hashlib.scrypt(password.encode("utf8"), salt=salt, n=n, r=r, p=p,
+                          maxmem=256 * r * n + 1024 * 1024, dklen=KEY_BYTES)
+
+
+def _hash(password, scheme, params):
+    if scheme == "argon2":
+        time_cost, memory_kib = params
+        return argon2.PasswordHasher(time_cost=time_cost, memory_cost=memory_kib).hash(password)
+    n, r, p = params
+    salt = os.urandom(SALT_BYTES)
+    return f"scrypt${n}${r}${p}${_b64(salt)}${_b64(_scrypt(password, salt, n, r, p))}"
+
+
+def _verify(password, stored, scheme, params):
+    # returns (matches, made with the given scheme and cost settings)
+    if stored.startswith("scrypt$"):
+        _, n, r, p, salt, expected = stored.split("$")
+        n, r, p = int(n), int(r), int(p)
+        key = _scrypt(password, _unb64(salt), n, r, p)
+        return hmac.compare_digest(key, _unb64(expected)), scheme == "scrypt" and (n, r, p) == tuple(params)
+    if stored.startswith("$argon2"):
+        if argon2 is None:
+            raise RuntimeError("argon2-cffi is not installed; it is required to check argon2 password hashes")
+        try:
+            argon2.PasswordHasher().verify(stored, password)
+        except argon2.exceptions.VerificationError:
+            return False, True
+        if scheme != "argon2":
+            return True, False
+        time_cost, memory_kib = params
+        hasher = argon2.PasswordHasher(time_cost=time_cost, memory_cost=memory_kib)
+        return True, not hasher.check_needs_rehash(stored)
+    # legacy plaintext row
+    return hmac.compare_digest(password.encode("utf8"), stored.encode("utf8")), False
+
+
+def _check(password, stored, scheme, params):
+    # verify and, when the stored value is outdated, rehash in the same task
+    ok, current = _verify(password, stored, scheme, params)
+    if ok and not current:
+        return True, _hash(password, scheme, params)
+    return ok, None
+
+
+def _params():
+    if SCHEME == "argon2":
+        if argon2 is None:
+            raise RuntimeError("argon2-cffi is not installed; set ECOFINDS_PASSWORD_SCHEME=scrypt")
+        return ARGON2_TIME_COST, ARGON2_MEMORY_KIB
+    return SCRYPT_N, SCRYPT_R, SCRYPT_P
+
+
+# ------------------ WORKER POOL ------------------
+_executor = None
+_executor_lock = threading.Lock()
+_pending = threading.BoundedSemaphore(HASH_QUEUE)
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ProcessPoolExecutor(max_workers=HASH_WORKERS)
+    return _executor
+
+
+def _submit(fn, *args):
+    if not _pending.acquire(timeout=HASH_TIMEOUT):
+        raise HashPoolBusy(f"more than {HASH_QUEUE} password hashes pending")
+    if HASH_WORKERS <= 0:
+        future = Future()
+        try:
+            future.set_result(fn(*args))
+        except Exception as e:
+            future.set_exception(e)
+        finally:
+            _pending.release()
+        return future
+    executor = _get_executor()
+    try:
+        future = executor.submit(fn, *args)
+    except BrokenProcessPool:
+        _pending.release()
+        _discard(executor)
+        raise HashPoolBusy("password hash workers died")
+    except BaseException:
+        _pending.release()
+        raise
+    future.add_done_callback(lambda _: _pending.release())
+    return future
+
+
+def _discard(executor):
+    # drop a broken pool so the next hash starts a fresh one
+    global _executor
+    with _executor_lock:
+        if _executor is executor:
+            _executor = None
+    executor.shutdown(wait=False)
+
+
+def _result(future):
+    try:
+        return future.result(HASH_TIMEOUT)
+    except FutureTimeout:
+        future.cancel()
+        raise HashPoolBusy(f"password hash took longer than {HASH_TIMEOUT}s")
+    except BrokenProcessPool:
+        # the next _submit replaces the pool
+        raise HashPoolBusy("password hash workers died")
+
+
+async def _result_async(future):
+    # like _result, without blocking the event loop
+    try:
+        return await asyncio.wait_for(asyncio.wrap_future(future), HASH_TIMEOUT)
+    except asyncio.TimeoutError:
+        raise HashPoolBusy(f"password hash took longer than {HASH_TIMEOUT}s")
+    except BrokenProcessPool:
+        # the next _submit replaces the pool
+        raise HashPoolBusy("password hash workers died")
+
+
+def shutdown():
+    global _executor
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown()
+            _executor = None
+
+
+# A stored hash to check unknown emails against, so a missing account takes
+# as long to reject as a wrong password.
+_dummy_hash = None
+
+
+def _stored_or_dummy(stored):
+    global _dummy_hash
+    if stored:
+        return stored
+    if _dummy_hash is None:
+        _dummy_hash = _hash(os.urandom(8).hex(), SCHEME, _params())
+    return _dummy_hash
+
+
+def hash_password(password):
+    return _result(_submit(_hash, password, SCHEME, _params()))
+
+
+def check_password(password, stored):
+    # returns (ok, new hash to store or None); stored may be None for unknown users
+    return _result(_submit(_check, password, _stored_or_dummy(stored), SCHEME, _params()))
+
+
+async def hash_password_async(password):
+    future = await asyncio.to_thread(_submit, _hash, password, SCHEME, _params())
+    return await _result_async(future)
+
+
+async def check_password_async(password, stored):
+    stored = await asyncio.to_thread(_stored_or_dummy, stored)
+    future = await asyncio.to_thread(_submit, _check, password, stored, SCHEME, _params())
+    return await _result_async(future)
+
+
+# ------------------ RATE LIMITING ------------------
+class TokenBucketLimiter:
+    # per-key buckets holding up to `burst` tokens, refilled at `rate` per second
+    def __init__(self, burst, rate, max_keys=100000):
+        self.burst = burst
+        self.rate = rate
+        self.max_keys = max_keys
+        # key -> (tokens, last refill time)
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def take(self, key):
+        # returns 0 if allowed, otherwise seconds until a token is available
+        now = time.monotonic()
+        with self._lock:
+            tokens, last = self._buckets.get(key, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - last) * self.rate)
+            if tokens >= 1:
+                self._buckets[key] = (tokens - 1, now)
+                if len(self._buckets) > self.max_keys:
+                    self._prune(now)
+                return 0
+            self._buckets[key] = (tokens, now)
+            return (1 - tokens) / self.rate
+
+    def _prune(self, now):
+        # buckets that have refilled completely carry no state
+        full = [k for k, (tokens, last) in self._buckets.items()
+                if tokens + (now - last) * self.rate >= self.burst]
+        for k in full:
+            del self._buckets[k]
+
+
+_ip_limiter = TokenBucketLimiter(LOGIN_IP_BURST, LOGIN_IP_PER_MINUTE / 60)
+_email_limiter = TokenBucketLimiter(LOGIN_EMAIL_BURST, LOGIN_EMAIL_PER_MINUTE / 60)
+
+
+def login_retry_after(ip, email):
+    # 0 when this attempt may proceed, otherwise whole seconds to put in Retry-After
+    wait = max(_ip_limiter.take(ip or ""), _email_limiter.take((email or "").strip().lower()))
+    return math.ceil(wait) if wait else 0
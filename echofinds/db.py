@@ -1,10 +1,634 @@
-import mysql.connector
+import os
+import queue
+import random
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from flask import g, has_app_context, has_request_context, request, session
+
+try:
+    import mysql.connector
+except ImportError:
+    # mysql-connector is only needed for the mysql backend
+    mysql = None
+
+
+# Backend selection: "mysql" (default) or "sqlite" for running locally without a server
+DB_BACKEND = os.environ.get("ECOFINDS_DB_BACKEND", "mysql")
+SQLITE_PATH = os.environ.get("ECOFINDS_SQLITE_PATH",
+                             os.path.join(os.path.dirname(__file__), "ecofinds.sqlite3"))
+
+MYSQL_CONFIG = {
+    "host": os.environ.get("ECOFINDS_DB_HOST", "localhost"),
+    "user": os.environ.get("ECOFINDS_DB_USER", "Your username"),
+    "password": os.environ.get("ECOFINDS_DB_PASSWORD", "Your password"),
+    "database": os.environ.get("ECOFINDS_DB_NAME", "ecofinds"),
+}
+
+# Pool tuning (per process)
+POOL_SIZE = int(os.environ.get("ECOFINDS_DB_POOL_SIZE", "5"))
+POOL_TIMEOUT = float(os.environ.get("ECOFINDS_DB_POOL_TIMEOUT", "10"))
+# connections older than this many seconds are closed and replaced
+POOL_RECYCLE = float(os.environ.get("ECOFINDS_DB_POOL_RECYCLE", "1800"))
+# connections idle longer than this are pinged before being handed out
+POOL_PING_AFTER = float(os.environ.get("ECOFINDS_DB_POOL_PING_AFTER", "30"))
+# prepared statements kept per connection (see PooledConnection.prepared_cursor)
+STATEMENT_CACHE = int(os.environ.get("ECOFINDS_STATEMENT_CACHE", "64"))
+
+# Pending schema migrations (migrations.py) are applied when a process first
+# uses the pool, never from request handlers; set to 0 to run them only via
+# "python migrations.py upgrade".
+AUTO_MIGRATE = os.environ.get("ECOFINDS_AUTO_MIGRATE", "1") == "1"
+
+# row lock suffix for SELECTs inside checkout; sqlite locks the whole
+# database with BEGIN IMMEDIATE instead
+FOR_UPDATE = "" if DB_BACKEND == "sqlite" else " FOR UPDATE"
+
+
+def index_hint(index):
+    # table suffix making a SELECT read through index (None: the primary key)
+    if DB_BACKEND == "sqlite":
+        return f" INDEXED BY {index}" if index else " NOT INDEXED"
+    return f" FORCE INDEX ({index or 'PRIMARY'})"
+
+# Read replicas (see REPLICAS below): host[:port] entries for mysql (same
+# user, password and database as the primary) or database file paths for
+# sqlite, comma separated. Empty means every query goes to the primary.
+REPLICAS = [r.strip() for r in os.environ.get("ECOFINDS_DB_REPLICAS", "").split(",") if r.strip()]
+REPLICA_POOL_SIZE = int(os.environ.get("ECOFINDS_DB_REPLICA_POOL_SIZE", str(POOL_SIZE)))
+# a replica that can't hand out a connection this fast is skipped for this read
+REPLICA_TIMEOUT = float(os.environ.get("ECOFINDS_DB_REPLICA_TIMEOUT", "0.5"))
+# a session reads from the primary for this long after a request that may have written
+PIN_SECONDS = float(os.environ.get("ECOFINDS_DB_PIN_SECONDS", "5"))
+# replicas further behind the primary than this are left out (mysql only)
+MAX_REPLICA_LAG = float(os.environ.get("ECOFINDS_DB_MAX_REPLICA_LAG", "5"))
+HEALTH_INTERVAL = float(os.environ.get("ECOFINDS_DB_HEALTH_INTERVAL", "5"))
+
+
+class PoolTimeout(Exception):
+    pass
+
+
+# ------------------ SQLITE ADAPTER ------------------
+# The views are written against mysql.connector (%s placeholders and
+# cursor(dictionary=True)); these small wrappers give sqlite3 the same surface.
+
+def _dict_row(cursor, row):
+    return {col[0]: row[i] for i, col in enumerate(cursor.description)}
+
+
+class _SqliteCursor:
+    def __init__(self, raw_conn, dictionary=False):
+        self._cur = raw_conn.cursor()
+        if dictionary:
+            self._cur.row_factory = _dict_row
+
+    def execute(self, query, params=()):
+        self._cur.execute(query.replace("%s", "?"), tuple(params or ()))
+        return self
+
+    def executemany(self, query, seq_of_params):
+        self._cur.executemany(query.replace("%s", "?"), seq_of_params)
+        return self
+
+    def fetchone(self):
+        return self._cur.fetchone()
+
+    def fetchmany(self, size=None):
+        return self._cur.fetchmany(size or self._cur.arraysize)
+
+    def fetchall(self):
+        return self._cur.fetchall()
+
+    def __iter__(self):
+        return iter(self._cur)
+
+    @property
+    def lastrowid(self):
+        return self._cur.lastrowid
+
+    @property
+    def rowcount(self):
+        return self._cur.rowcount
+
+    @property
+    def description(self):
+        return self._cur.description
+
+    def close(self):
+        self._cur.close()
+
+
+class _SqliteConnection:
+    def __init__(self, path, read_only=False):
+        if read_only:
+            # replicas: writes fail instead of silently diverging from the primary
+            self._conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True, timeout=POOL_TIMEOUT,
+                                         check_same_thread=False, cached_statements=max(128, STATEMENT_CACHE * 2))
+            return
+        self._conn = sqlite3.connect(path, timeout=POOL_TIMEOUT, check_same_thread=False,
+                                     cached_statements=max(128, STATEMENT_CACHE * 2))
+        self._conn.execute("PRAGMA foreign_keys=ON")
+        if path != ":memory:":
+            self._conn.execute("PRAGMA journal_mode=WAL")
+
+    def cursor(self, dictionary=False, prepared=False):
+        # sqlite3 already compiles each distinct SQL text once per connection
+        # (cached_statements), so prepared cursors are plain cursors
+        return _SqliteCursor(self._conn, dictionary=dictionary)
+
+    def commit(self):
+        self._conn.commit()
+
+    def rollback(self):
+        self._conn.rollback()
+
+    def start_transaction(self):
+        # take the write lock up front so concurrent checkouts serialize
+        self._conn.execute("BEGIN IMMEDIATE")
+
+    def ping(self):
+        self._conn.execute("SELECT 1")
+
+    def close(self):
+        self._conn.close()
+
+
+def _connect_sqlite():
+    return _SqliteConnection(SQLITE_PATH)
+
+
+def _connect_mysql():
+    if mysql is None:
+        raise RuntimeError("mysql-connector-python is not installed; set ECOFINDS_DB_BACKEND=sqlite")
+    return mysql.connector.connect(**MYSQL_CONFIG)
+
+
+def _ping(raw):
+    if isinstance(raw, _SqliteConnection):
+        raw.ping()
+    else:
+        raw.ping(reconnect=False)
+
+
+# ------------------ QUERY LISTENERS ------------------
+# Callables run as listener(query, params, seconds) after every statement executed
+# through a pooled connection (and the async pool in adb.py); metrics.py uses
+# them for per-request query counts and DB time. With no listeners registered
+# cursors are handed out unwrapped.
+_query_listeners = []
+
+
+def add_query_listener(listener):
+    _query_listeners.append(listener)
+
+
+def remove_query_listener(listener):
+    _query_listeners.remove(listener)
+
+
+def notify_query(query, params, seconds):
+    for listener in _query_listeners:
+        listener(query, params, seconds)
+
+
+class _TimedCursor:
+    def __init__(self, cursor):
+        self._cursor = cursor
+
+    def execute(self, query, params=()):
+        started = time.perf_counter()
+        try:
+            self._cursor.execute(query, params)
+        finally:
+            notify_query(query, params, time.perf_counter() - started)
+        return self
+
+    def executemany(self, query, seq_of_params):
+        started = time.perf_counter()
+        try:
+            self._cursor.executemany(query, seq_of_params)
+        finally:
+            notify_query(query, seq_of_params, time.perf_counter() - started)
+        return self
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+
+# ------------------ POOL ------------------
+class PooledConnection:
+    # Thin proxy around a raw connection; close() hands it back to the pool
+    def __init__(self, pool, raw, created_at):
+        self._pool = pool
+        self._raw = raw
+        self.created_at = created_at
+        self.checked_out_at = time.monotonic()
+        # request-scoped connections are released at teardown, not by close()
+        self.request_scoped = False
+        self.closed = False
+
+    def cursor(self, *args, **kwargs):
+        cursor = self._raw.cursor(*args, **kwargs)
+        return _TimedCursor(cursor) if _query_listeners else cursor
+
+    def prepared_cursor(self, sql):
+        # A cursor with sql prepared on this connection, kept for the life of
+        # the underlying connection (not just this checkout) in an LRU of
+        # STATEMENT_CACHE statements. Only execute sql on it and fetch every
+        # row before the next call.
+        statements = getattr(self._raw, "_ecofinds_statements", None)
+        if statements is None:
+            statements = self._raw._ecofinds_statements = OrderedDict()
+        cursor = statements.get(sql)
+        if cursor is None:
+            cursor = statements[sql] = self._raw.cursor(prepared=True)
+            if len(statements) > STATEMENT_CACHE:
+                statements.popitem(last=False)[1].close()
+        else:
+            statements.move_to_end(sql)
+        return _TimedCursor(cursor) if _query_listeners else cursor
+
+    def commit(self):
+        self._raw.commit()
+
+    def rollback(self):
+        self._raw.rollback()
+
+    def begin(self):
+        # explicit transaction; ends any implicit one left open by earlier reads
+        self._raw.rollback()
+        self._raw.start_transaction()
+
+    def close(self):
+        if self.request_scoped:
+            return
+        self.release()
+
+    def release(self):
+        if self.closed:
+            return
+        self.closed = True
+        self._pool.release(self)
+
+    def __getattr__(self, name):
+        # fall through to driver specific attributes (e.g. is_connected)
+        return getattr(self._raw, name)
+
+
+class ConnectionPool:
+    def __init__(self, connect, size=POOL_SIZE, timeout=POOL_TIMEOUT,
+                 recycle=POOL_RECYCLE, ping_after=POOL_PING_AFTER):
+        self._connect = connect
+        self.size = size
+        self.timeout = timeout
+        self.recycle = recycle
+        self.ping_after = ping_after
+        # LIFO keeps the hottest connections in use and lets idle ones age out
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(size)
+        self._lock = threading.Lock()
+        self._stats = {
+            "checkouts": 0,
+            "created": 0,
+            "recycled": 0,
+            "failed_pings": 0,
+            "timeouts": 0,
+            "in_use": 0,
+            "wait_total": 0.0,
+            "wait_max": 0.0,
+        }
+
+    def _bump(self, key, amount=1):
+        with self._lock:
+            self._stats[key] += amount
+
+    def _new_raw(self):
+        raw = self._connect()
+        self._bump("created")
+        return raw, time.monotonic(), time.monotonic()
+
+    def acquire(self):
+        start = time.perf_counter()
+        if not self._slots.acquire(timeout=self.timeout):
+            self._bump("timeouts")
+            raise PoolTimeout(f"no database connection available after {self.timeout}s")
+        waited = time.perf_counter() - start
+        try:
+            raw, created_at = self._checkout_raw()
+        except Exception:
+            self._slots.release()
+            raise
+        with self._lock:
+            self._stats["checkouts"] += 1
+            self._stats["in_use"] += 1
+            self._stats["wait_total"] += waited
+            self._stats["wait_max"] = max(self._stats["wait_max"], waited)
+        return PooledConnection(self, raw, created_at)
+
+    def _checkout_raw(self):
+        while True:
+            try:
+                raw, created_at, idle_since = self._idle.get_nowait()
+            except queue.Empty:
+                raw, created_at, _ = self._new_raw()
+                return raw, created_at
+            now = time.monotonic()
+            if now - created_at > self.recycle:
+                self._bump("recycled")
+                _close_quietly(raw)
+                continue
+            if now - idle_since > self.ping_after:
+                try:
+                    _ping(raw)
+                except Exception:
+                    self._bump("failed_pings")
+                    _close_quietly(raw)
+                    continue
+            return raw, created_at
+
+    def release(self, pooled):
+        raw = pooled._raw
+        try:
+            # end any open transaction so the next user gets a fresh snapshot
+            raw.rollback()
+            self._idle.put((raw, pooled.created_at, time.monotonic()))
+        except Exception:
+            _close_quietly(raw)
+        finally:
+            with self._lock:
+                self._stats["in_use"] -= 1
+            self._slots.release()
+
+    def stats(self):
+        with self._lock:
+            data = dict(self._stats)
+        data["size"] = self.size
+        data["idle"] = self._idle.qsize()
+        data["wait_avg"] = data["wait_total"] / data["checkouts"] if data["checkouts"] else 0.0
+        return data
+
+    def dispose(self):
+        while True:
+            try:
+                raw, _, _ = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            _close_quietly(raw)
+
+
+def _close_quietly(raw):
+    try:
+        raw.close()
+    except Exception:
+        pass
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                connect = _connect_sqlite if DB_BACKEND == "sqlite" else _connect_mysql
+                pool = ConnectionPool(connect)
+                init_schema(pool)
+                _pool = pool
+    return _pool
+
+
+def init_schema(pool):
+    # imported here: migrations.py builds on this module
+    import migrations
+    conn = pool.acquire()
+    try:
+        if AUTO_MIGRATE:
+            migrations.upgrade(conn)
+        else:
+            behind = migrations.pending(conn)
+            if behind:
+                print(f"Warning: {len(behind)} pending schema migrations; run python migrations.py upgrade")
+    finally:
+        conn.release()
+
 
 def get_db_connection():
-    conn = mysql.connector.connect(
-        host="localhost",
-        user="Your username",
-        password="Your password",
-        database="ecofinds"
-    )
-    return conn
+    # Inside a request every caller (before_request hooks and the view) shares
+    # one pooled connection; it goes back to the pool at teardown.
+    if has_app_context():
+        conn = g.get("_db_conn")
+        if conn is None or conn.closed:
+            conn = get_pool().acquire()
+            conn.request_scoped = True
+            g._db_conn = conn
+        return conn
+    return get_pool().acquire()
+
+
+def release_request_connection(exc=None):
+    for name in ("_db_conn", "_db_read_conn"):
+        conn = g.pop(name, None)
+        if conn is not None:
+            conn.release()
+
+
+# ------------------ REPLICAS ------------------
+# Read-only work asks for get_read_connection() instead of get_db_connection().
+# That is a connection to a replica unless
+#   - no replica is configured or none is healthy,
+#   - the request itself may write (not GET/HEAD), or
+#   - the session wrote within the last PIN_SECONDS: every non-GET/HEAD
+#     request pins its session to the primary (a timestamp in the signed
+#     session cookie, so it holds across processes), so a seller sees their
+#     new listing on the page the add_product redirect lands on,
+# in which case it is the primary connection. Writes and transactions always
+# use get_db_connection(). Each replica has its own pool; reads go to the
+# healthy replica with the fewest connections in use. A replica that fails
+# to hand out a connection, or (mysql) reports more than MAX_REPLICA_LAG
+# seconds of lag, is left out until the health check thread, every
+# HEALTH_INTERVAL seconds, finds it answering again.
+SAFE_METHODS = ("GET", "HEAD")
+_PIN_KEY = "_db_primary_until"
+
+
+def _sqlite_replica(path):
+    return lambda: _SqliteConnection(path, read_only=True)
+
+
+def _mysql_replica(address):
+    host, _, port = address.partition(":")
+    config = dict(MYSQL_CONFIG, host=host, port=int(port or 3306))
+
+    def connect():
+        if mysql is None:
+            raise RuntimeError("mysql-connector-python is not installed; set ECOFINDS_DB_BACKEND=sqlite")
+        return mysql.connector.connect(**config)
+    return connect
+
+
+def _mysql_lag(raw):
+    # seconds behind the source; None for a server that isn't replicating (a local stand-in)
+    cursor = raw.cursor(dictionary=True)
+    try:
+        cursor.execute("SHOW REPLICA STATUS")
+        row = cursor.fetchone()
+    finally:
+        cursor.close()
+    if not row:
+        return None
+    lag = row.get("Seconds_Behind_Source")
+    # NULL while the replication threads are stopped: it is not catching up
+    return float("inf") if lag is None else float(lag)
+
+
+class Replica:
+    def __init__(self, name, connect, lag_check=None):
+        self.name = name
+        self.pool = ConnectionPool(connect, size=REPLICA_POOL_SIZE, timeout=REPLICA_TIMEOUT)
+        self._lag_check = lag_check
+        self.healthy = True
+        self.lag = None
+        self.latency = None
+        self.failures = 0
+        self.reads = 0
+        self.last_error = None
+
+    def load(self):
+        stats = self.pool.stats()
+        return stats["in_use"] / stats["size"]
+
+    def mark_down(self, error):
+        if self.healthy:
+            print(f"Warning: read replica {self.name} left out: {error}")
+        self.healthy = False
+        self.failures += 1
+        self.last_error = str(error)
+        # connections to a failed server are not worth pinging one by one
+        self.pool.dispose()
+
+    def check(self):
+        started = time.perf_counter()
+        try:
+            conn = self.pool.acquire()
+            try:
+                cursor = conn.cursor()
+                cursor.execute("SELECT 1")
+                cursor.fetchall()
+                cursor.close()
+                lag = self._lag_check(conn._raw) if self._lag_check else None
+            finally:
+                conn.release()
+        except Exception as e:
+            self.mark_down(e)
+            return
+        elapsed = time.perf_counter() - started
+        self.latency = elapsed if self.latency is None else 0.8 * self.latency + 0.2 * elapsed
+        self.lag = lag
+        if lag is not None and lag > MAX_REPLICA_LAG:
+            self.mark_down(f"{lag}s behind the primary")
+            return
+        if not self.healthy:
+            print(f"Read replica {self.name} is back")
+        self.healthy = True
+
+    def stats(self):
+        return {"name": self.name, "healthy": self.healthy, "lag": self.lag, "reads": self.reads,
+                "failures": self.failures, "latency_ms": round(self.latency * 1000, 2) if self.latency else None,
+                "last_error": self.last_error, "pool": self.pool.stats()}
+
+
+_replicas = None
+_replicas_lock = threading.Lock()
+
+
+def get_replicas():
+    global _replicas
+    if _replicas is None:
+        with _replicas_lock:
+            if _replicas is None:
+                # the primary runs migrations before anything reads a replica
+                get_pool()
+                if DB_BACKEND == "sqlite":
+                    replicas = [Replica(path, _sqlite_replica(path)) for path in REPLICAS]
+                else:
+                    replicas = [Replica(address, _mysql_replica(address), _mysql_lag) for address in REPLICAS]
+                if replicas:
+                    threading.Thread(target=_health_loop, args=(replicas,), name="replica-health",
+                                     daemon=True).start()
+                _replicas = replicas
+    return _replicas
+
+
+def _health_loop(replicas):
+    while True:
+        time.sleep(HEALTH_INTERVAL)
+        for replica in replicas:
+            replica.check()
+
+
+def _acquire_replica():
+    # a connection to the least loaded healthy replica, or None
+    healthy = [r for r in get_replicas() if r.healthy]
+    # random tie-break spreads an idle cluster evenly
+    for replica in sorted(healthy, key=lambda r: (r.load(), random.random())):
+        try:
+            conn = replica.pool.acquire()
+        except PoolTimeout:
+            # busy, not broken
+            continue
+        except Exception as e:
+            replica.mark_down(e)
+            continue
+        replica.reads += 1
+        return conn
+    return None
+
+
+def _primary_pinned():
+    if not has_request_context():
+        return False
+    return request.method not in SAFE_METHODS or session.get(_PIN_KEY, 0) > time.time()
+
+
+def get_read_connection():
+    # connection for read-only statements; see REPLICAS above for when it is the primary
+    if not REPLICAS or _primary_pinned():
+        return get_db_connection()
+    if has_app_context():
+        conn = g.get("_db_read_conn")
+        if conn is None or conn.closed:
+            conn = _acquire_replica()
+            if conn is None:
+                return get_db_connection()
+            conn.request_scoped = True
+            g._db_read_conn = conn
+        return conn
+    return _acquire_replica() or get_pool().acquire()
+
+
+def pin_primary(response):
+    # after_request: a request that may have written keeps its session on the primary for a while
+    if REPLICAS and request.method not in SAFE_METHODS:
+        session[_PIN_KEY] = time.time() + PIN_SECONDS
+    return response
+
+
+def pool_stats():
+    return get_pool().stats()
+
+
+def replica_stats():
+    return [r.stats() for r in get_replicas()] if REPLICAS else []
+
+
+def init_app(app):
+    app.teardown_appcontext(release_request_connection)
+    app.after_request(pin_primary)
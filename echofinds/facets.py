@@ -0,0 +1,185 @@
+import argparse
+import bisect
+import os
+import time
+from collections import Counter
+
+import db
+import jobs
+
+# Listing counts per category and price bucket for the /products filters:
+# the category dropdown and the price histogram. They live in product_facets
+# (migration 7), one row per (category, bucket), so reading them is one scan
+# of a table of categories x buckets rows however many listings there are,
+# instead of a DISTINCT or GROUP BY over products.
+# - Product writes adjust the counts inside their own transaction (adjust())
+#   and call invalidate() once committed.
+# - Each process keeps the table in memory for CACHE_TTL seconds. It is read
+#   from the primary, so a lagging replica can't bring back the counts a
+#   write just replaced.
+# - Two concurrent edits of the same listing can leave a count off by one; a
+#   background job recounts everything every REFILL_INTERVAL seconds
+#   ("python facets.py refill" does it on demand).
+# Bucket -1 counts listings without a price; listings without a category are
+# counted under "".
+CACHE_TTL = float(os.environ.get("ECOFINDS_FACET_CACHE_TTL", "30"))
+REFILL_INTERVAL = int(os.environ.get("ECOFINDS_FACET_REFILL_INTERVAL", "3600"))
+# lower bound of each price bucket (rupees); the last one is open ended
+PRICE_EDGES = [0, 250, 500, 1000, 2500, 5000, 10000, 25000, 50000]
+NO_PRICE = -1
+
+if db.DB_BACKEND == "sqlite":
+    _UPSERT = " ON CONFLICT (category, bucket) DO UPDATE SET products = products + excluded.products"
+else:
+    _UPSERT = " ON DUPLICATE KEY UPDATE products = products + VALUES(products)"
+ADJUST_SQL = "INSERT INTO product_facets (category, bucket, products) VALUES (%s,%s,%s)" + _UPSERT
+# bucket() in SQL
+BUCKET_SQL = ("CASE WHEN price IS NULL THEN -1 "
+              + " ".join(f"WHEN price < {edge} THEN {i}" for i, edge in enumerate(PRICE_EDGES[1:]))
+              + f" ELSE {len(PRICE_EDGES) - 1} END")
+REFILL_SQL = ("INSERT INTO product_facets (category, bucket, products) "
+              f"SELECT COALESCE(category, ''), {BUCKET_SQL}, COUNT(*) FROM products GROUP BY 1, 2")
+
+# {category: {bucket: listings}} and when it goes stale
+_counts = None
+_expires = 0.0
+
+
+def bucket(price):
+    try:
+        price = float(price)
+    except (TypeError, ValueError):
+        return NO_PRICE
+    return max(0, bisect.bisect_right(PRICE_EDGES, price) - 1)
+
+
+# ------------------ WRITES ------------------
+def adjust(cursor, removed=(), added=()):
+    # count listings out of / into their buckets, as (category, price) pairs;
+    # runs in the caller's transaction
+    deltas = Counter()
+    for category, price in removed:
+        deltas[(category or "", bucket(price))] -= 1
+    for category, price in added:
+        deltas[(category or "", bucket(price))] += 1
+    rows = [(category, b, n) for (category, b), n in sorted(deltas.items()) if n]
+    if rows:
+        cursor.executemany(ADJUST_SQL, rows)
+
+
+def invalidate():
+    global _expires
+    _expires = 0.0
+
+
+def refill(cursor):
+    # recount every listing
+    cursor.execute("DELETE FROM product_facets")
+    cursor.execute(REFILL_SQL)
+
+
+def rebuild():
+    conn = db.get_db_connection()
+    cursor = conn.cursor()
+    try:
+        conn.begin()
+        refill(cursor)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+        conn.close()
+    invalidate()
+
+
+jobs.register("refill_facets", rebuild)
+jobs.every("refill_facets", REFILL_INTERVAL)
+
+
+# ------------------ READS ------------------
+def _load():
+    global _counts, _expires
+    if _counts is not None and time.monotonic() < _expires:
+        return _counts
+    conn = db.get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute("SELECT category, bucket, products FROM product_facets")
+    rows = cursor.fetchall()
+    cursor.close()
+    conn.close()
+    counts = {}
+    for category, b, n in rows:
+        if n > 0:
+            counts.setdefault(category, {})[b] = n
+    _counts, _expires = counts, time.monotonic() + CACHE_TTL
+    return counts
+
+
+def categories():
+    # names of the categories that have listings, for the dropdown
+    return sorted(c for c in _load() if c)
+
+
+def category_counts():
+    # {category: listings} for the categories that have listings
+    return {c: sum(buckets.values()) for c, buckets in _load().items() if c}
+
+
+def share(category=None, min_price=None, max_price=None):
+    # fraction of the listings (of one category or all) in buckets that
+    # overlap [min_price, max_price]: an upper bound on the share in the range
+    total = matching = 0
+    for c, buckets in _load().items():
+        if category is not None and c != category:
+            continue
+        for b, n in buckets.items():
+            total += n
+            if b == NO_PRICE:
+                continue
+            high = PRICE_EDGES[b + 1] if b + 1 < len(PRICE_EDGES) else None
+            above_min = min_price is None or high is None or high > min_price
+            if above_min and (max_price is None or PRICE_EDGES[b] <= max_price):
+                matching += n
+    return matching / total if total else 0.0
+
+
+def histogram(category=None):
+    # listings per price bucket, of one category or all of them, as {"min",
+    # "upper" (next bucket's min), "max" (inclusive filter bound), "count"} for
+    # buckets that have any; upper and max are None for the last bucket
+    counts = Counter()
+    for c, buckets in _load().items():
+        if category is None or c == category:
+            counts.update(buckets)
+    out = []
+    for b, low in enumerate(PRICE_EDGES):
+        if counts[b]:
+            upper = PRICE_EDGES[b + 1] if b + 1 < len(PRICE_EDGES) else None
+            # max_price is inclusive and prices have paise
+            high = round(upper - 0.01, 2) if upper is not None else None
+            out.append({"min": low, "upper": upper, "max": high, "count": counts[b]})
+    return out
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Listing counts per category and price bucket.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("refill", help="recount every listing")
+    show = sub.add_parser("show", help="print the histogram")
+    show.add_argument("--category")
+    args = parser.parse_args()
+
+    if args.command == "refill":
+        rebuild()
+        print(f"Counted {sum(sum(b.values()) for b in _load().values())} listings "
+              f"in {len(categories())} categories")
+    elif args.command == "show":
+        for row in histogram(args.category):
+            upper = f"{row['max']:.2f}" if row["max"] is not None else "+"
+            print(f"{row['min']:>8} - {upper:<8} {row['count']:>8}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,262 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from flask import current_app
+
+import db
+import facets
+import pagination
+import repository
+
+# Cache for rendered listing fragments and the product pages built from them.
+# Entries are held in an LRU bounded by both entry count and approximate size,
+# expire after a TTL, and carry tags so a write can drop exactly the entries
+# that show a product:
+#   product:<id>      card fragments, detail pages and listing pages showing it
+#   listing:all       unfiltered listing pages (dashboard, /products)
+#   listing:cat:<c>   /products?category=<c> pages (with or without price filters)
+#   seller:<user id>  detail pages naming that seller
+#   image:<key>       fragments rendered before the image variants were built
+#   categories        the category dropdown
+# Anything per user (cart badge, username, owner-only buttons) is rendered by
+# the page templates around the cached fragments. The cache is per process;
+# writes made by other workers are picked up when entries expire.
+# Entries are filled from the primary: filled from a lagging replica right
+# after an invalidation, an entry would hide the write until it expires, also
+# from the session that made it. With the cache off, pages read replicas.
+ENABLED = os.environ.get("ECOFINDS_FRAGMENT_CACHE", "1") == "1"
+MAX_ENTRIES = int(os.environ.get("ECOFINDS_FRAGMENT_CACHE_ENTRIES", "10000"))
+MAX_BYTES = int(os.environ.get("ECOFINDS_FRAGMENT_CACHE_MB", "32")) * 1024 * 1024
+TTL = float(os.environ.get("ECOFINDS_FRAGMENT_CACHE_TTL", "60"))
+# Newest-first pages with a price range can't be read in order from a price
+# index. When the facet counts say at most this share of the listings is in
+# the range, the page reads the range from the price index and sorts it;
+# otherwise it walks the listings newest first and skips the others, reading
+# about page size / share rows.
+NARROW_PRICE_RANGE = 0.1
+
+FRAGMENTS_TEMPLATE = "_fragments.html"
+
+
+class FragmentCache:
+    def __init__(self, max_entries=MAX_ENTRIES, max_bytes=MAX_BYTES, ttl=TTL):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        # key -> (value, size, expires_at, tags); most recently used last
+        self._entries = OrderedDict()
+        self._tags = {}
+        self._lock = threading.Lock()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def _drop(self, key):
+        value, size, _, tags = self._entries.pop(key)
+        self.bytes -= size
+        for tag in tags:
+            keys = self._tags.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._tags[tag]
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[2] <= time.monotonic():
+                if entry is not None:
+                    self._drop(key)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def set(self, key, value, tags=(), size=None, ttl=None):
+        size = len(value) if size is None else size
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+            self._entries[key] = (value, size, time.monotonic() + (self.ttl if ttl is None else ttl), tuple(tags))
+            self.bytes += size
+            for tag in tags:
+                self._tags.setdefault(tag, set()).add(key)
+            while len(self._entries) > self.max_entries or self.bytes > self.max_bytes:
+                self._drop(next(iter(self._entries)))
+                self.evictions += 1
+
+    def invalidate(self, *tags):
+        with self._lock:
+            removed = 0
+            for tag in tags:
+                for key in list(self._tags.get(tag, ())):
+                    self._drop(key)
+                    removed += 1
+            self.invalidations += removed
+            return removed
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._tags.clear()
+            self.bytes = 0
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self.bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+            }
+
+
+_cache = FragmentCache()
+
+
+def get_cache():
+    return _cache
+
+
+def stats():
+    return _cache.stats()
+
+
+def _macro(name):
+    return getattr(current_app.jinja_env.get_template(FRAGMENTS_TEMPLATE).module, name)
+
+
+def _cached(key, tags, render):
+    if not ENABLED:
+        return render()
+    html = _cache.get(key)
+    if html is None:
+        html = render()
+        _cache.set(key, html, tags)
+    return html
+
+
+# ------------------ FRAGMENTS (template globals) ------------------
+def product_card(p, style="card"):
+    # media and text of a product card; style is a macro in _fragments.html
+    tags = [f"product:{p['id']}"]
+    if p.get('image_url'):
+        tags.append(f"image:{p['image_url']}")
+    return _cached(("card", style, p['id']), tags, lambda: _macro(style)(p))
+
+
+def category_options(categories, selected="", facets=None):
+    # search facets change per query, so only the plain dropdown is cached
+    if facets or not categories:
+        return _macro("category_options")(categories, selected, facets)
+    return _cached(("categories", selected), ["categories"],
+                   lambda: _macro("category_options")(categories, selected, None))
+
+
+# ------------------ PAGES ------------------
+def cached_listing(columns, filters=pagination.Filters(), token=None):
+    return _cache.get(("page", columns, filters, token)) if ENABLED else None
+
+
+def store_listing(columns, filters, token, page):
+    if not ENABLED:
+        return
+    tags = [f"product:{p['id']}" for p in page.items]
+    tags.append(f"listing:cat:{filters.category}" if filters.category else "listing:all")
+    size = 256 + sum(len(str(v)) for p in page.items for v in p.values())
+    _cache.set(("page", columns, filters, token), page, tags, size=size)
+
+
+def _fill_connection():
+    return db.get_db_connection() if ENABLED else db.get_read_connection()
+
+
+def listing_query(columns, filters=pagination.Filters(), token=None):
+    # (query, args, cursor kind) for one keyset page of the listings filters selects
+    where, params = pagination.filter_clauses(filters)
+    hint = ""
+    priced = filters.min_price is not None or filters.max_price is not None
+    if priced and filters.sort not in pagination.PRICE_SORTS:
+        if facets.share(filters.category, filters.min_price, filters.max_price) <= NARROW_PRICE_RANGE:
+            hint = db.index_hint("idx_products_category_price" if filters.category else "idx_products_price")
+        else:
+            hint = db.index_hint("idx_products_category" if filters.category else None)
+    return pagination.keyset_query(columns, where, params, token, sort=filters.sort, hint=hint)
+
+
+def listing_page(columns, filters=pagination.Filters(), token=None):
+    # one keyset page of products, newest first unless filters say otherwise
+    page = cached_listing(columns, filters, token)
+    if page is None:
+        query, args, kind = listing_query(columns, filters, token)
+        conn = _fill_connection()
+        page = pagination.keyset_result(repository.fetch_all(conn, query, args), kind, sort=filters.sort)
+        conn.close()
+        store_listing(columns, filters, token, page)
+    return page
+
+
+def product_detail(product_id):
+    # (title, rendered body) for /products/<id>, or None if it doesn't exist
+    key = ("detail", product_id)
+    entry = _cache.get(key) if ENABLED else None
+    if entry is None:
+        conn = _fill_connection()
+        prod = repository.product_detail(conn, product_id)
+        conn.close()
+        if not prod:
+            return None
+        entry = (prod['title'], _macro("detail")(prod))
+        if ENABLED:
+            tags = [f"product:{product_id}", f"seller:{prod['user_id']}"]
+            if prod.get('image_url'):
+                tags.append(f"image:{prod['image_url']}")
+            _cache.set(key, entry, tags, size=len(entry[0]) + len(entry[1]))
+    return entry
+
+
+# ------------------ INVALIDATION ------------------
+def _listing_tags(*categories):
+    return ["listing:all", "categories"] + [f"listing:cat:{c}" for c in categories if c]
+
+
+def product_added(category):
+    # a new product lands on the first page of its listings
+    _cache.invalidate(*_listing_tags(category))
+
+
+def product_changed(product_id, old_category=None, new_category=None, price_changed=False):
+    # a new category or price can move the product onto other listing pages
+    tags = [f"product:{product_id}"]
+    if old_category != new_category or price_changed:
+        tags += _listing_tags(old_category, new_category)
+    _cache.invalidate(*tags)
+
+
+def product_deleted(product_id, category):
+    _cache.invalidate(f"product:{product_id}", *_listing_tags(category))
+
+
+def seller_changed(user_id):
+    _cache.invalidate(f"seller:{user_id}")
+
+
+def image_ready(key):
+    # variants were built in the background; re-render fragments using the original
+    _cache.invalidate(f"image:{key}")
+
+
+def init_app(app):
+    app.jinja_env.globals.update(product_card=product_card, category_options=category_options)
@@ -0,0 +1,222 @@
+import json
+import os
+import shutil
+import tempfile
+
+import db
+import fragments
+import jobs
+import storage
+
+try:
+    from PIL import Image, ImageOps, UnidentifiedImageError
+except ImportError:
+    # Pillow is optional; without it uploads are stored as-is with no variants
+    Image = None
+
+# Upload pipeline for product and profile images.
+# In the request: the upload is streamed to a temp file and hashed, validated
+# as an image, re-encoded without metadata (EXIF/GPS) and capped to
+# MAX_ORIGINAL pixels, then stored under its content key (see storage.py).
+# Resized variants for the templates are generated afterwards by an
+# "image_variants" background job (jobs.py) and recorded in
+# products.image_variants so the templates can emit srcset. Re-uploading
+# identical bytes reuses the stored file and variants.
+MAX_ORIGINAL = 1600
+PROFILE_SIZE = 512
+# variant name -> longest side in pixels
+VARIANTS = {"thumb": 160, "card": 480, "detail": 1200}
+FORMATS = {"webp": "WEBP", "jpg": "JPEG"}
+QUALITY = 82
+
+# variant jobs running at once across all job workers
+WORKERS = int(os.environ.get("ECOFINDS_IMAGE_WORKERS", "2"))
+
+
+class InvalidImage(Exception):
+    pass
+
+
+def variant_name(key, variant, fmt):
+    stem = os.path.splitext(key)[0]
+    return f"{stem}__{variant}.{fmt}"
+
+
+def is_variant(name):
+    # whether name is a file variant_name() generated rather than an upload
+    stem, ext = os.path.splitext(name)
+    return ext[1:] in FORMATS and any(stem.endswith(f"__{variant}") for variant in VARIANTS)
+
+
+def _open_verified(path):
+    try:
+        with Image.open(path) as img:
+            img.verify()
+        # verify() leaves the image unusable; reopen for decoding
+        return Image.open(path)
+    except (UnidentifiedImageError, OSError, SyntaxError, Image.DecompressionBombError) as e:
+        raise InvalidImage(f"not a valid image: {e}")
+
+
+def _prepare(img, max_side):
+    # decode at reduced size when the format allows it (JPEG DCT scaling)
+    img.draft("RGB", (max_side, max_side))
+    img = ImageOps.exif_transpose(img)
+    if img.mode not in ("RGB", "L"):
+        img = img.convert("RGB")
+    img.thumbnail((max_side, max_side))
+    return img
+
+
+def save_upload(file_storage, max_side=MAX_ORIGINAL):
+    # store an upload under its content key and take a reference on it;
+    # returns the key (used as products.image_url / users.profile_image)
+    backend = storage.get_backend()
+    raw_path, digest, size = storage.stream_to_temp(file_storage.stream, backend.temp_dir())
+    try:
+        if Image is None:
+            ext = os.path.splitext(file_storage.filename or "")[1].lower() or ".bin"
+            key = f"{digest[:40]}{ext}"
+        else:
+            # the output depends on max_side, so it is part of the key
+            key = f"{digest[:40]}-{max_side}.jpg"
+        if storage.acquire(key, size):
+            return key
+        try:
+            if Image is None:
+                backend.put_file(key, raw_path)
+                return key
+            with _open_verified(raw_path) as img:
+                img = _prepare(img, max_side)
+                fd, out_path = tempfile.mkstemp(dir=backend.temp_dir(), suffix=".jpg")
+                os.close(fd)
+                # saving without an exif/icc argument drops the original metadata
+                img.save(out_path, "JPEG", quality=QUALITY, optimize=True)
+            backend.put_file(key, out_path)
+        except Exception:
+            storage.release(key)
+            raise
+        return key
+    finally:
+        if os.path.exists(raw_path):
+            os.remove(raw_path)
+
+
+def save_profile_image(file_storage):
+    return save_upload(file_storage, max_side=PROFILE_SIZE)
+
+
+def build_variants(key):
+    # write every variant of a stored original; returns the manifest stored in the DB
+    backend = storage.get_backend()
+    manifest = {}
+    work_dir = tempfile.mkdtemp(dir=backend.temp_dir())
+    try:
+        source = os.path.join(work_dir, "source")
+        backend.fetch(key, source)
+        with Image.open(source) as original:
+            original.load()
+            for variant, side in VARIANTS.items():
+                img = original.copy()
+                img.thumbnail((side, side))
+                for fmt, pil_format in FORMATS.items():
+                    out_path = os.path.join(work_dir, f"{variant}.{fmt}")
+                    img.save(out_path, pil_format, quality=QUALITY, optimize=True)
+                    backend.put_file(variant_name(key, variant, fmt), out_path)
+                manifest[variant] = [img.width, img.height]
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    return manifest
+
+
+def stored_variants(key):
+    # manifest recorded for a key by an earlier upload of the same bytes, if any
+    if not key:
+        return None
+    conn = db.get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute('SELECT variants FROM uploads WHERE file_key=%s', (key,))
+    row = cursor.fetchone()
+    cursor.close()
+    conn.close()
+    return row[0] if row else None
+
+
+def _process_product_image(key):
+    # failures propagate so the job is retried
+    manifest = json.dumps(build_variants(key))
+    conn = db.get_db_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute('UPDATE uploads SET variants=%s WHERE file_key=%s', (manifest, key))
+        cursor.execute('UPDATE products SET image_variants=%s, version = version + 1 WHERE image_url=%s',
+                       (manifest, key))
+        conn.commit()
+        cursor.close()
+    finally:
+        conn.close()
+    fragments.image_ready(key)
+    print(f"Built image variants: {key}")
+
+
+def schedule_variants(key):
+    # queue variant generation unless this content already has variants;
+    # returns False if nothing was queued. Keyed by the uploads row's creation
+    # time, so bytes uploaded again after the sweep removed them get a new job.
+    if Image is None or not key:
+        return False
+    conn = db.get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute('SELECT variants, created_at FROM uploads WHERE file_key=%s', (key,))
+    row = cursor.fetchone()
+    cursor.close()
+    conn.close()
+    variants, created_at = row if row else (None, None)
+    if variants:
+        return False
+    return jobs.enqueue("image_variants", {"key": key}, key=f"image_variants:{key}:{created_at}")
+
+
+def remove_files(key):
+    # delete a stored upload together with any variants generated for it
+    backend = storage.get_backend()
+    backend.delete(key)
+    for variant in VARIANTS:
+        for fmt in FORMATS:
+            backend.delete(variant_name(key, variant, fmt))
+
+
+jobs.register("image_variants", _process_product_image, concurrency=WORKERS)
+# uploads no longer referenced by any product or profile are removed in the background
+storage.register_cleanup(remove_files)
+
+
+def parse_variants(raw):
+    if not raw:
+        return {}
+    if isinstance(raw, dict):
+        return raw
+    try:
+        return json.loads(raw)
+    except ValueError:
+        return {}
+
+
+# ------------------ TEMPLATE HELPERS ------------------
+def upload_url(key):
+    return storage.get_backend().url(key)
+
+
+def variant_url(key, variant, fmt="jpg"):
+    return upload_url(variant_name(key, variant, fmt))
+
+
+def image_srcset(key, variants, fmt):
+    # "url 160w, url 480w, ..." from the stored manifest
+    manifest = parse_variants(variants)
+    return ", ".join(f"{variant_url(key, v, fmt)} {manifest[v][0]}w" for v in VARIANTS if v in manifest)
+
+
+def init_app(app):
+    app.jinja_env.globals.update(image_variants=parse_variants, image_srcset=image_srcset,
+                                 variant_url=variant_url, upload_url=upload_url)
@@ -0,0 +1,332 @@
+import argparse
+import importlib
+import json
+import os
+import random
+import socket
+import threading
+import time
+
+import db
+
+# Background jobs stored in the jobs table (migration 6).
+# Side work that used to run inline or on ad-hoc threads (image variants,
+# removing unreferenced upload files) is queued with enqueue() and run by
+# worker threads: ECOFINDS_JOB_WORKERS of them inside every web process, or
+# none there and a separate "python jobs.py work" process instead.
+#
+# - A job type is registered once at import time with its handler, called as
+#   handler(**payload), and a concurrency limit: at most that many jobs of the
+#   type run at once across all workers sharing the database.
+# - A job that raises is retried after BACKOFF_BASE * 2^(attempt-1) seconds
+#   (capped at BACKOFF_MAX, +-20% jitter) until max_attempts, then kept as
+#   'failed' for "python jobs.py retry".
+# - An idempotency key makes enqueue a no-op while a job with the same key
+#   exists; finished jobs are purged after RETENTION_DAYS, which is how long
+#   keys stay taken.
+# - A claimed job holds a lease (run_at = claim time + lease); if its worker
+#   dies the job becomes claimable again when the lease runs out.
+# Claiming counts the running jobs per type and takes one due job in a single
+# transaction (BEGIN IMMEDIATE on sqlite, FOR UPDATE on MySQL). On MySQL two
+# workers claiming different jobs of the same type at the same moment can
+# overshoot a limit by one until one of them finishes.
+WORKERS = int(os.environ.get("ECOFINDS_JOB_WORKERS", "2"))
+POLL_INTERVAL = float(os.environ.get("ECOFINDS_JOB_POLL_INTERVAL", "1"))
+MAX_ATTEMPTS = 5
+BACKOFF_BASE = 10
+BACKOFF_MAX = 3600
+LEASE = 600
+RETENTION_DAYS = int(os.environ.get("ECOFINDS_JOB_RETENTION_DAYS", "7"))
+# modules whose import registers job types; a standalone worker imports them
+HANDLER_MODULES = ["images", "facets", "archive"]
+
+INSERT_SQL = ("INSERT{ignore} INTO jobs (kind, payload, idempotency_key, status, attempts, max_attempts, run_at, "
+              "created_at) VALUES (%s,%s,%s,'queued',0,%s,%s,%s)")
+
+
+class JobType:
+    def __init__(self, kind, handler, concurrency, max_attempts, lease):
+        self.kind = kind
+        self.handler = handler
+        self.concurrency = concurrency
+        self.max_attempts = max_attempts
+        self.lease = lease
+
+
+_types = {}
+# kind -> seconds between runs, queued by whichever worker notices first
+_periodic = {}
+_queued_slots = {}
+_wake = threading.Event()
+_workers = []
+
+
+def register(kind, handler, concurrency=1, max_attempts=MAX_ATTEMPTS, lease=LEASE):
+    _types[kind] = JobType(kind, handler, concurrency, max_attempts, lease)
+
+
+def every(kind, interval):
+    # run a registered job type (no payload) every interval seconds
+    _periodic[kind] = interval
+
+
+def _insert_sql():
+    return INSERT_SQL.format(ignore=" OR IGNORE" if db.DB_BACKEND == "sqlite" else " IGNORE")
+
+
+def enqueue(kind, payload=None, key=None, delay=0, cursor=None):
+    # queue a job; returns False if a job with this idempotency key already exists.
+    # With cursor the job is part of the caller's transaction and is only seen
+    # once the caller commits.
+    job_type = _types.get(kind)
+    max_attempts = job_type.max_attempts if job_type else MAX_ATTEMPTS
+    now = int(time.time())
+    params = (kind, json.dumps(payload or {}), key, max_attempts, now + int(delay), now)
+    if cursor is not None:
+        cursor.execute(_insert_sql(), params)
+        return cursor.rowcount == 1
+    conn = db.get_db_connection()
+    cur = conn.cursor()
+    try:
+        cur.execute(_insert_sql(), params)
+        queued = cur.rowcount == 1
+        conn.commit()
+    finally:
+        cur.close()
+        conn.close()
+    if queued and not delay:
+        _wake.set()
+    return queued
+
+
+def _backoff(attempts):
+    return min(BACKOFF_BASE * 2 ** (attempts - 1), BACKOFF_MAX) * random.uniform(0.8, 1.2)
+
+
+# ------------------ WORKER ------------------
+def _queue_periodic():
+    now = time.time()
+    for kind, interval in _periodic.items():
+        # one job per interval slot, whichever worker gets there first
+        slot = int(now // interval)
+        if _queued_slots.get(kind) != slot:
+            enqueue(kind, key=f"{kind}:{slot}")
+            _queued_slots[kind] = slot
+
+
+def _claim(conn, cursor, worker_id):
+    # (id, kind, payload, attempts) of a due job this worker may run now, marked running; or None
+    now = int(time.time())
+    # cheap check first, so idle polling doesn't take the sqlite write lock
+    cursor.execute("SELECT 1 FROM jobs WHERE status IN ('queued','running') AND run_at <= %s LIMIT 1", (now,))
+    found = cursor.fetchone()
+    conn.commit()
+    if found is None:
+        return None
+    conn.begin()
+    try:
+        cursor.execute("SELECT kind, COUNT(*) FROM jobs WHERE status='running' AND run_at > %s GROUP BY kind",
+                       (now,))
+        running = dict(cursor.fetchall())
+        kinds = [k for k, t in _types.items() if running.get(k, 0) < t.concurrency]
+        if not kinds:
+            conn.rollback()
+            return None
+        # 'running' rows that are due are jobs whose lease ran out
+        placeholders = ','.join(['%s'] * len(kinds))
+        cursor.execute("SELECT id, kind, payload, attempts FROM jobs WHERE status IN ('queued','running') "
+                       f"AND run_at <= %s AND kind IN ({placeholders}) ORDER BY run_at, id LIMIT 1{db.FOR_UPDATE}",
+                       (now, *kinds))
+        row = cursor.fetchone()
+        if row is None:
+            conn.rollback()
+            return None
+        job_id, kind, payload, attempts = row
+        cursor.execute("UPDATE jobs SET status='running', attempts=attempts+1, locked_by=%s, run_at=%s WHERE id=%s",
+                       (worker_id, now + _types[kind].lease, job_id))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return job_id, kind, payload, attempts + 1
+
+
+def _finish(job_id, worker_id, status, run_at=None, error=None):
+    # only the current lease holder records the outcome
+    conn = db.get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute("UPDATE jobs SET status=%s, run_at=COALESCE(%s, run_at), finished_at=%s, last_error=%s, "
+                   "locked_by=NULL WHERE id=%s AND locked_by=%s",
+                   (status, run_at, int(time.time()) if status != "queued" else None, error, job_id, worker_id))
+    conn.commit()
+    cursor.close()
+    conn.close()
+
+
+def run_one(worker_id):
+    # claim and run one due job; returns False if there was nothing to run
+    conn = db.get_db_connection()
+    cursor = conn.cursor()
+    try:
+        claimed = _claim(conn, cursor, worker_id)
+    finally:
+        # handlers take their own connections; don't hold a second one meanwhile
+        cursor.close()
+        conn.close()
+    if claimed is None:
+        return False
+    job_id, kind, payload, attempts = claimed
+    job_type = _types[kind]
+    try:
+        job_type.handler(**json.loads(payload or "{}"))
+    except Exception as e:
+        error = f"{type(e).__name__}: {e}"
+        if attempts >= job_type.max_attempts:
+            print(f"Warning: job {job_id} ({kind}) failed after {attempts} attempts: {error}")
+            _finish(job_id, worker_id, "failed", error=error)
+        else:
+            delay = _backoff(attempts)
+            print(f"Warning: job {job_id} ({kind}) failed, retrying in {delay:.0f}s: {error}")
+            _finish(job_id, worker_id, "queued", run_at=int(time.time() + delay), error=error)
+    else:
+        _finish(job_id, worker_id, "done")
+    return True
+
+
+def work(worker_id, stop=None, drain=False):
+    # run jobs until stop is set (or, with drain, until none is due)
+    while stop is None or not stop.is_set():
+        try:
+            _queue_periodic()
+            while run_one(worker_id):
+                pass
+        except Exception as e:
+            print(f"Warning: job worker {worker_id} error: {e}")
+            time.sleep(POLL_INTERVAL)
+        if drain:
+            return
+        _wake.wait(POLL_INTERVAL)
+        _wake.clear()
+
+
+def start_workers(count=WORKERS):
+    # daemon worker threads for this process
+    if _workers:
+        return _workers
+    prefix = f"{socket.gethostname()}:{os.getpid()}"
+    for i in range(count):
+        t = threading.Thread(target=work, args=(f"{prefix}:{i}",), name=f"jobs-{i}", daemon=True)
+        t.start()
+        _workers.append(t)
+    return _workers
+
+
+# ------------------ MAINTENANCE ------------------
+def purge(days=RETENTION_DAYS):
+    # drop finished jobs older than days, releasing their idempotency keys
+    conn = db.get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute("DELETE FROM jobs WHERE status='done' AND finished_at < %s", (int(time.time() - days * 86400),))
+    removed = cursor.rowcount
+    conn.commit()
+    cursor.close()
+    conn.close()
+    return removed
+
+
+def retry(job_ids=None):
+    # re-queue failed jobs (all of them without ids); returns how many
+    conn = db.get_db_connection()
+    cursor = conn.cursor()
+    query = "UPDATE jobs SET status='queued', attempts=0, run_at=%s, finished_at=NULL WHERE status='failed'"
+    params = [int(time.time())]
+    if job_ids:
+        query += f" AND id IN ({','.join(['%s'] * len(job_ids))})"
+        params += list(job_ids)
+    cursor.execute(query, tuple(params))
+    count = cursor.rowcount
+    conn.commit()
+    cursor.close()
+    conn.close()
+    _wake.set()
+    return count
+
+
+def stats():
+    conn = db.get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute("SELECT kind, status, COUNT(*), MIN(run_at) FROM jobs GROUP BY kind, status")
+    rows = cursor.fetchall()
+    cursor.close()
+    conn.close()
+    now = time.time()
+    kinds = {}
+    for kind, status, count, first_run_at in rows:
+        entry = kinds.setdefault(kind, {})
+        entry[status] = count
+        if status == "queued":
+            entry["oldest_due_seconds"] = max(0, int(now - first_run_at))
+    return {"workers_in_process": len(_workers),
+            "types": {k: {"concurrency": t.concurrency, "max_attempts": t.max_attempts} for k, t in _types.items()},
+            "jobs": kinds}
+
+
+register("purge_jobs", purge)
+every("purge_jobs", 3600)
+
+
+def debug_jobs():
+    return stats()
+
+
+def init_app(app):
+    app.add_url_rule("/debug_jobs", "debug_jobs", debug_jobs)
+    start_workers()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run or inspect background jobs.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    run = sub.add_parser("work", help="run jobs until interrupted (set ECOFINDS_JOB_WORKERS=0 on the web processes)")
+    run.add_argument("--threads", type=int, default=max(WORKERS, 1))
+    run.add_argument("--drain", action="store_true", help="exit once no job is due")
+    sub.add_parser("status", help="job counts per type and status")
+    again = sub.add_parser("retry", help="re-queue failed jobs")
+    again.add_argument("job_ids", type=int, nargs="*", help="default: every failed job")
+    sub.add_parser("purge", help=f"delete finished jobs older than {RETENTION_DAYS} days")
+    args = parser.parse_args()
+
+    for name in HANDLER_MODULES:
+        importlib.import_module(name)
+    if args.command == "work":
+        prefix = f"{socket.gethostname()}:{os.getpid()}"
+        if args.drain:
+            work(f"{prefix}:0", drain=True)
+            return
+        stop = threading.Event()
+        threads = [threading.Thread(target=work, args=(f"{prefix}:{i}", stop), name=f"jobs-{i}")
+                   for i in range(args.threads)]
+        for t in threads:
+            t.start()
+        try:
+            while any(t.is_alive() for t in threads):
+                time.sleep(1)
+        except KeyboardInterrupt:
+            # finish the jobs in hand, then exit
+            stop.set()
+            _wake.set()
+            for t in threads:
+                t.join()
+    elif args.command == "status":
+        for kind, counts in sorted(stats()["jobs"].items()):
+            print(f"{kind:<20} " + "  ".join(f"{status}={n}" for status, n in sorted(counts.items())))
+    elif args.command == "retry":
+        print(f"Re-queued {retry(args.job_ids)} jobs")
+    elif args.command == "purge":
+        print(f"Removed {purge()} finished jobs")
+
+
+if __name__ == "__main__":
+    # go through the "jobs" module that the handler modules import and register with
+    import jobs
+    jobs.main()
@@ -0,0 +1,328 @@
+import bisect
+import os
+import re
+import sys
+import threading
+import time
+from collections import Counter, deque
+
+from flask import Response, g, has_app_context, request
+
+import db
+import fragments
+
+# Request instrumentation. Every request gets its wall time, number of SQL
+# statements and time spent in them recorded (statements are counted through
+# the query listeners in db.py, so both the sync and the async pool report
+# here). Per-route latency and query-count histograms are exported in the
+# Prometheus text format on /metrics, and each response carries a
+# Server-Timing header so the numbers show up in browser devtools.
+#
+# N+1 detection: a request that runs the same statement (same SQL text, IN
+# lists collapsed) N_PLUS_ONE_THRESHOLD or more times is reported on stdout,
+# counted per route and kept in a short list on /debug_n_plus_one.
+#
+# Opt-in sampling profiler (ECOFINDS_PROFILE=1): while a request is running
+# its thread's stack is sampled every PROFILE_INTERVAL; requests slower than
+# PROFILE_SLOW_MS are written to PROFILE_DIR as folded stacks
+# ("frame;frame;frame count" per line), the input format of flamegraph.pl and
+# speedscope. Async views in asgi.py run on the event loop rather than a
+# request thread and are not sampled.
+ENABLED = os.environ.get("ECOFINDS_METRICS", "1") == "1"
+N_PLUS_ONE_THRESHOLD = int(os.environ.get("ECOFINDS_N_PLUS_ONE_THRESHOLD", "5"))
+PROFILE = os.environ.get("ECOFINDS_PROFILE", "0") == "1"
+PROFILE_INTERVAL = float(os.environ.get("ECOFINDS_PROFILE_INTERVAL_MS", "5")) / 1000
+PROFILE_SLOW_MS = float(os.environ.get("ECOFINDS_PROFILE_SLOW_MS", "500"))
+PROFILE_DIR = os.environ.get("ECOFINDS_PROFILE_DIR", os.path.join(os.path.dirname(__file__), "profiles"))
+
+# seconds
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# statements per request
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+
+_WS_RE = re.compile(r"\s+")
+_IN_LIST_RE = re.compile(r"IN\s*\((?:\s*%s\s*,?)+\)", re.IGNORECASE)
+
+
+def normalize_query(query):
+    # one shape per statement: whitespace folded, IN (%s,%s,...) lists collapsed
+    return _IN_LIST_RE.sub("IN (...)", _WS_RE.sub(" ", query.strip()))
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        # one slot per bucket plus +Inf; not cumulative
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class RequestStats:
+    # per-request counters, kept on flask.g
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.db_time = 0.0
+        self.statements = Counter()
+        self.recorded = False
+
+    def add_query(self, query, seconds):
+        self.queries += 1
+        self.db_time += seconds
+        self.statements[normalize_query(query)] += 1
+
+    def repeated(self):
+        return [(q, n) for q, n in self.statements.most_common() if n >= N_PLUS_ONE_THRESHOLD]
+
+
+class Registry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latency = {}         # (route, method) -> Histogram
+        self.queries = {}         # route -> Histogram
+        self.requests = Counter()  # (route, method, status)
+        self.db_time = Counter()   # route -> seconds
+        self.n_plus_one = Counter()  # route
+        self.recent_n_plus_one = deque(maxlen=50)
+
+    def record(self, route, method, status, elapsed, stats):
+        repeated = stats.repeated()
+        with self._lock:
+            hist = self.latency.get((route, method))
+            if hist is None:
+                hist = self.latency[(route, method)] = Histogram(LATENCY_BUCKETS)
+            hist.observe(elapsed)
+            hist = self.queries.get(route)
+            if hist is None:
+                hist = self.queries[route] = Histogram(QUERY_BUCKETS)
+            hist.observe(stats.queries)
+            self.requests[(route, method, status)] += 1
+            self.db_time[route] += stats.db_time
+            if repeated:
+                self.n_plus_one[route] += 1
+                self.recent_n_plus_one.append({
+                    "route": route,
+                    "path": request.path,
+                    "at": int(time.time()),
+                    "queries": stats.queries,
+                    "repeated": [{"statement": q, "count": n} for q, n in repeated],
+                })
+        for q, n in repeated:
+            print(f"Warning: possible N+1 in {route}: {n}x {q}")
+
+    def render(self):
+        # Prometheus text exposition format 0.0.4
+        out = []
+        with self._lock:
+            _histogram(out, "ecofinds_http_request_duration_seconds", "Request latency by route.",
+                       {("route", r, "method", m): h for (r, m), h in sorted(self.latency.items())})
+            out.append("# HELP ecofinds_http_requests_total Requests by route, method and status.")
+            out.append("# TYPE ecofinds_http_requests_total counter")
+            for (r, m, s), n in sorted(self.requests.items()):
+                out.append(f"ecofinds_http_requests_total{_labels(('route', r, 'method', m, 'status', s))} {n}")
+            _histogram(out, "ecofinds_db_queries_per_request", "SQL statements run per request.",
+                       {("route", r): h for r, h in sorted(self.queries.items())})
+            out.append("# HELP ecofinds_db_seconds_total Time spent in SQL statements by route.")
+            out.append("# TYPE ecofinds_db_seconds_total counter")
+            for r, s in sorted(self.db_time.items()):
+                out.append(f"ecofinds_db_seconds_total{_labels(('route', r))} {s:.6f}")
+            out.append("# HELP ecofinds_n_plus_one_requests_total Requests that repeated one statement "
+                       f"{N_PLUS_ONE_THRESHOLD}+ times.")
+            out.append("# TYPE ecofinds_n_plus_one_requests_total counter")
+            for r, n in sorted(self.n_plus_one.items()):
+                out.append(f"ecofinds_n_plus_one_requests_total{_labels(('route', r))} {n}")
+        pool = db.pool_stats()
+        _gauges(out, "ecofinds_db_pool", "Connection pool", pool,
+                ("size", "in_use", "idle", "checkouts", "timeouts", "wait_avg", "wait_max"))
+        replicas = db.replica_stats()
+        if replicas:
+            out.append("# HELP ecofinds_db_replica Read replica health (1 = in rotation), reads and pool use.")
+            out.append("# TYPE ecofinds_db_replica gauge")
+            for r in replicas:
+                for key, value in (("healthy", int(r["healthy"])), ("reads", r["reads"]),
+                                   ("failures", r["failures"]), ("in_use", r["pool"]["in_use"])):
+                    out.append(f"ecofinds_db_replica{_labels(('replica', r['name'], 'stat', key))} {value}")
+        cache = fragments.stats()
+        _gauges(out, "ecofinds_fragment_cache", "Fragment cache", cache,
+                ("entries", "bytes", "hits", "misses", "evictions", "invalidations"))
+        return "\n".join(out) + "\n"
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(pairs):
+    # flat (name, value, name, value, ...) tuple -> {name="value",...}
+    return "{" + ",".join(f'{pairs[i]}="{_escape(pairs[i + 1])}"' for i in range(0, len(pairs), 2)) + "}"
+
+
+def _histogram(out, name, help_text, series):
+    out.append(f"# HELP {name} {help_text}")
+    out.append(f"# TYPE {name} histogram")
+    for labels, hist in series.items():
+        cumulative = 0
+        for bound, n in zip(hist.buckets, hist.counts):
+            cumulative += n
+            out.append(f"{name}_bucket{_labels(labels + ('le', _number(bound)))} {cumulative}")
+        out.append(f"{name}_bucket{_labels(labels + ('le', '+Inf'))} {hist.count}")
+        out.append(f"{name}_sum{_labels(labels)} {hist.sum:.6f}")
+        out.append(f"{name}_count{_labels(labels)} {hist.count}")
+
+
+def _gauges(out, prefix, help_text, data, keys):
+    for key in keys:
+        out.append(f"# HELP {prefix}_{key} {help_text} {key.replace('_', ' ')}.")
+        out.append(f"# TYPE {prefix}_{key} gauge")
+        out.append(f"{prefix}_{key} {_number(data.get(key, 0))}")
+
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+_registry = Registry()
+
+
+def registry():
+    return _registry
+
+
+# ------------------ SAMPLING PROFILER ------------------
+def _fold(frame):
+    # root-first "func (file:line);..." for one thread's stack
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+
+class SamplingProfiler:
+    def __init__(self, interval=PROFILE_INTERVAL):
+        self.interval = interval
+        # thread ident -> Counter of folded stacks
+        self._active = {}
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+
+    def start(self, ident):
+        with self._lock:
+            self._active[ident] = Counter()
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="ecofinds-profiler", daemon=True)
+                self._thread.start()
+        self._wake.set()
+
+    def stop(self, ident):
+        with self._lock:
+            return self._active.pop(ident, None)
+
+    def _run(self):
+        while True:
+            with self._lock:
+                idents = list(self._active)
+                if not idents:
+                    self._wake.clear()
+            if not idents:
+                self._wake.wait()
+                continue
+            frames = sys._current_frames()
+            for ident in idents:
+                frame = frames.get(ident)
+                if frame is None:
+                    continue
+                stack = _fold(frame)
+                with self._lock:
+                    samples = self._active.get(ident)
+                    if samples is not None:
+                        samples[stack] += 1
+            del frames
+            time.sleep(self.interval)
+
+
+_profiler = SamplingProfiler()
+
+
+def _dump_profile(route, elapsed_ms, samples):
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    name = f"{time.strftime('%Y%m%d-%H%M%S')}-{route.replace('.', '_')}-{int(elapsed_ms)}ms.folded"
+    path = os.path.join(PROFILE_DIR, name)
+    with open(path, "w") as f:
+        for stack, n in samples.most_common():
+            f.write(f"{stack} {n}\n")
+    print(f"Slow request profile ({elapsed_ms:.0f} ms): {path}")
+
+
+# ------------------ REQUEST HOOKS ------------------
+def _on_query(query, params, seconds):
+    if has_app_context():
+        stats = g.get("_metrics")
+        if stats is not None:
+            stats.add_query(query, seconds)
+
+
+def _before_request():
+    g._metrics = RequestStats()
+    if PROFILE and not request.environ.get("ecofinds.async_view"):
+        g._profiled_thread = threading.get_ident()
+        _profiler.start(g._profiled_thread)
+
+
+def _finish(status):
+    stats = g.get("_metrics")
+    if stats is None or stats.recorded:
+        return None
+    stats.recorded = True
+    elapsed = time.perf_counter() - stats.started
+    route = request.endpoint or "unmatched"
+    _registry.record(route, request.method, status, elapsed, stats)
+    ident = g.pop("_profiled_thread", None)
+    if ident is not None:
+        samples = _profiler.stop(ident)
+        if samples and elapsed * 1000 >= PROFILE_SLOW_MS:
+            _dump_profile(route, elapsed * 1000, samples)
+    return stats, elapsed
+
+
+def _after_request(response):
+    result = _finish(response.status_code)
+    if result is not None:
+        stats, elapsed = result
+        response.headers["Server-Timing"] = (f'db;dur={stats.db_time * 1000:.1f};desc="{stats.queries} queries", '
+                                             f"total;dur={elapsed * 1000:.1f}")
+    return response
+
+
+def _teardown_request(exc=None):
+    # requests that raised never reach after_request
+    _finish(500)
+
+
+def metrics_endpoint():
+    return Response(_registry.render(), mimetype="text/plain; version=0.0.4")
+
+
+def debug_n_plus_one():
+    # dev helper: the most recent requests that repeated a statement
+    return {"threshold": N_PLUS_ONE_THRESHOLD, "requests": list(_registry.recent_n_plus_one)}
+
+
+def init_app(app):
+    if not ENABLED:
+        return
+    db.add_query_listener(_on_query)
+    # registered first so the timer covers the other before_request hooks
+    app.before_request_funcs.setdefault(None, []).insert(0, _before_request)
+    app.after_request(_after_request)
+    app.teardown_request(_teardown_request)
+    app.add_url_rule("/metrics", "metrics", metrics_endpoint)
+    app.add_url_rule("/debug_n_plus_one", "debug_n_plus_one", debug_n_plus_one)
@@ -0,0 +1,622 @@
+import argparse
+import calendar
+import time
+
+import db
+
+# Versioned schema migrations.
+# Each migration is (version, description, function(cursor)); applied versions
+# are recorded in schema_migrations and every pending one runs in order, once,
+# in its own transaction (MySQL commits DDL implicitly, so there a failed
+# migration can leave partial changes behind; all of them are written to be
+# safe to re-run). Migrations only move forward. New schema changes are added
+# as a new entry at the end of MIGRATIONS, never by editing an applied one.
+#
+# db.get_pool() applies pending migrations when a process first touches the
+# database unless ECOFINDS_AUTO_MIGRATE=0; deployments that migrate as a
+# separate step run:
+#   python migrations.py status
+#   python migrations.py upgrade [--to VERSION]
+
+# ------------------ 1: BASE SCHEMA ------------------
+# Each listing is a single second-hand item by default, so products.stock
+# starts at 1 and checkout decrements it.
+SQLITE_BASE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    username VARCHAR(100),
+    email VARCHAR(255),
+    password VARCHAR(255),
+    profile_image VARCHAR(255)
+);
+CREATE TABLE IF NOT EXISTS products (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id INT,
+    title VARCHAR(255),
+    description TEXT,
+    category VARCHAR(100),
+    price DECIMAL(10,2),
+    image_url VARCHAR(255),
+    image_variants TEXT,
+    stock INT NOT NULL DEFAULT 1
+);
+CREATE TABLE IF NOT EXISTS orders (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id INT,
+    created_at BIGINT
+);
+CREATE TABLE IF NOT EXISTS order_items (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    order_id INT,
+    product_id INT,
+    quantity INT NOT NULL DEFAULT 1
+);
+CREATE TABLE IF NOT EXISTS uploads (
+    file_key VARCHAR(255) PRIMARY KEY,
+    refcount INT NOT NULL DEFAULT 0,
+    size BIGINT NOT NULL DEFAULT 0,
+    variants TEXT,
+    created_at BIGINT,
+    orphaned_at BIGINT
+);
+CREATE TABLE IF NOT EXISTS purchase_summary (
+    user_id INT PRIMARY KEY,
+    order_count INT NOT NULL DEFAULT 0,
+    item_count INT NOT NULL DEFAULT 0,
+    total_spent DECIMAL(12,2) NOT NULL DEFAULT 0,
+    last_order_at BIGINT
+);
+"""
+
+MYSQL_BASE_SCHEMA = [
+    """CREATE TABLE IF NOT EXISTS users (
+        id INT PRIMARY KEY AUTO_INCREMENT,
+        username VARCHAR(100),
+        email VARCHAR(255),
+        password VARCHAR(255),
+        profile_image VARCHAR(255)
+    ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4""",
+    """CREATE TABLE IF NOT EXISTS products (
+        id INT PRIMARY KEY AUTO_INCREMENT,
+        user_id INT,
+        title VARCHAR(255),
+        description TEXT,
+        category VARCHAR(100),
+        price DECIMAL(10,2),
+        image_url VARCHAR(255),
+        image_variants TEXT,
+        stock INT NOT NULL DEFAULT 1
+    ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4""",
+    """CREATE TABLE IF NOT EXISTS orders (
+        id INT PRIMARY KEY AUTO_INCREMENT,
+        user_id INT,
+        created_at BIGINT
+    ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4""",
+    """CREATE TABLE IF NOT EXISTS order_items (
+        id INT PRIMARY KEY AUTO_INCREMENT,
+        order_id INT,
+        product_id INT,
+        quantity INT NOT NULL DEFAULT 1
+    ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4""",
+    """CREATE TABLE IF NOT EXISTS uploads (
+        file_key VARCHAR(255) PRIMARY KEY,
+        refcount INT NOT NULL DEFAULT 0,
+        size BIGINT NOT NULL DEFAULT 0,
+        variants TEXT,
+        created_at BIGINT,
+        orphaned_at BIGINT
+    ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4""",
+    """CREATE TABLE IF NOT EXISTS purchase_summary (
+        user_id INT PRIMARY KEY,
+        order_count INT NOT NULL DEFAULT 0,
+        item_count INT NOT NULL DEFAULT 0,
+        total_spent DECIMAL(12,2) NOT NULL DEFAULT 0,
+        last_order_at BIGINT
+    ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4""",
+]
+
+# columns databases created by earlier releases may lack: (table, column, definition)
+LEGACY_COLUMNS = [
+    ("users", "profile_image", "VARCHAR(255)"),
+    ("products", "stock", "INT NOT NULL DEFAULT 1"),
+    ("products", "image_variants", "TEXT"),
+    ("order_items", "quantity", "INT NOT NULL DEFAULT 1"),
+]
+
+
+def column_names(cursor, table):
+    if db.DB_BACKEND == "sqlite":
+        cursor.execute(f"PRAGMA table_info({table})")
+        return [r[1] for r in cursor.fetchall()]
+    cursor.execute("SELECT column_name FROM information_schema.columns "
+                   "WHERE table_schema = DATABASE() AND table_name = %s ORDER BY ordinal_position", (table,))
+    return [r[0] for r in cursor.fetchall()]
+
+
+def _base_schema(cursor):
+    # also adopts databases created before migrations existed (tables present, no history)
+    statements = SQLITE_BASE_SCHEMA.split(";") if db.DB_BACKEND == "sqlite" else MYSQL_BASE_SCHEMA
+    for stmt in statements:
+        if stmt.strip():
+            cursor.execute(stmt)
+    for table, column, definition in LEGACY_COLUMNS:
+        if column not in column_names(cursor, table):
+            cursor.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+
+
+# ------------------ 2: INDEXES ------------------
+# (name, table, columns). Secondary indexes end in the primary key on both
+# backends, so (user_id) also serves "WHERE user_id=%s ORDER BY id".
+INDEXES = [
+    ("idx_users_email", "users", "email"),                  # login
+    ("idx_products_user", "products", "user_id"),           # my_listings, FK
+    ("idx_products_category", "products", "category"),      # /products?category=
+    ("idx_products_image", "products", "image_url"),        # image variant backfill
+    ("idx_orders_user", "orders", "user_id, created_at"),   # purchase history (newest first), FK
+    ("idx_order_items_order", "order_items", "order_id"),   # order lines, FK
+    ("idx_order_items_product", "order_items", "product_id"),  # FK (product deletes)
+    ("idx_uploads_orphaned", "uploads", "orphaned_at"),     # orphan sweep
+]
+
+
+def index_names(cursor, table):
+    if db.DB_BACKEND == "sqlite":
+        cursor.execute(f"PRAGMA index_list({table})")
+        return {r[1] for r in cursor.fetchall()}
+    cursor.execute("SELECT DISTINCT index_name FROM information_schema.statistics "
+                   "WHERE table_schema = DATABASE() AND table_name = %s", (table,))
+    return {r[0] for r in cursor.fetchall()}
+
+
+def _create_indexes(cursor, tables=None):
+    for name, table, columns in INDEXES:
+        if tables is not None and table not in tables:
+            continue
+        if name not in index_names(cursor, table):
+            cursor.execute(f"CREATE INDEX {name} ON {table} ({columns})")
+
+
+def _indexes(cursor):
+    _create_indexes(cursor)
+
+
+# ------------------ 3: FOREIGN KEYS ------------------
+# References that point at missing rows are cleared first so the constraints
+# can be added to existing data: order lines of missing orders are deleted,
+# other dangling references become NULL (the pages already treat those rows
+# as having no seller / product).
+DANGLING_CLEANUP = [
+    "DELETE FROM order_items WHERE order_id IS NULL OR order_id NOT IN (SELECT id FROM orders)",
+    "UPDATE order_items SET product_id = NULL WHERE product_id NOT IN (SELECT id FROM products)",
+    "UPDATE products SET user_id = NULL WHERE user_id NOT IN (SELECT id FROM users)",
+    "UPDATE orders SET user_id = NULL WHERE user_id NOT IN (SELECT id FROM users)",
+    "DELETE FROM purchase_summary WHERE user_id NOT IN (SELECT id FROM users)",
+]
+
+# SQLite cannot add a constraint to an existing table, so these tables are
+# rebuilt with their final definition and the rows copied over.
+SQLITE_FK_TABLES = [
+    ("products", """CREATE TABLE products_new (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id INT REFERENCES users(id),
+    title VARCHAR(255),
+    description TEXT,
+    category VARCHAR(100),
+    price DECIMAL(10,2),
+    image_url VARCHAR(255),
+    image_variants TEXT,
+    stock INT NOT NULL DEFAULT 1
+)"""),
+    ("orders", """CREATE TABLE orders_new (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id INT REFERENCES users(id),
+    created_at BIGINT
+)"""),
+    ("order_items", """CREATE TABLE order_items_new (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    order_id INT REFERENCES orders(id) ON DELETE CASCADE,
+    product_id INT REFERENCES products(id) ON DELETE SET NULL,
+    quantity INT NOT NULL DEFAULT 1
+)"""),
+    ("purchase_summary", """CREATE TABLE purchase_summary_new (
+    user_id INT PRIMARY KEY REFERENCES users(id) ON DELETE CASCADE,
+    order_count INT NOT NULL DEFAULT 0,
+    item_count INT NOT NULL DEFAULT 0,
+    total_spent DECIMAL(12,2) NOT NULL DEFAULT 0,
+    last_order_at BIGINT
+)"""),
+]
+
+MYSQL_FOREIGN_KEYS = [
+    ("products", "fk_products_user", "FOREIGN KEY (user_id) REFERENCES users(id)"),
+    ("orders", "fk_orders_user", "FOREIGN KEY (user_id) REFERENCES users(id)"),
+    ("order_items", "fk_order_items_order", "FOREIGN KEY (order_id) REFERENCES orders(id) ON DELETE CASCADE"),
+    ("order_items", "fk_order_items_product",
+     "FOREIGN KEY (product_id) REFERENCES products(id) ON DELETE SET NULL"),
+    ("purchase_summary", "fk_purchase_summary_user",
+     "FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE"),
+]
+
+
+def _foreign_keys(cursor):
+    for stmt in DANGLING_CLEANUP:
+        cursor.execute(stmt)
+    if db.DB_BACKEND == "sqlite":
+        # runs with foreign_keys=OFF (see _apply), as SQLite's table rebuild procedure requires
+        for table, create in SQLITE_FK_TABLES:
+            cursor.execute(create)
+            new_columns = column_names(cursor, f"{table}_new")
+            columns = ", ".join(c for c in column_names(cursor, table) if c in new_columns)
+            cursor.execute(f"INSERT INTO {table}_new ({columns}) SELECT {columns} FROM {table}")
+            cursor.execute(f"DROP TABLE {table}")
+            cursor.execute(f"ALTER TABLE {table}_new RENAME TO {table}")
+        # dropping the old tables dropped their indexes
+        _create_indexes(cursor, {table for table, _ in SQLITE_FK_TABLES})
+        return
+    cursor.execute("SELECT constraint_name FROM information_schema.table_constraints "
+                   "WHERE table_schema = DATABASE() AND constraint_type = 'FOREIGN KEY'")
+    existing = {r[0] for r in cursor.fetchall()}
+    for table, name, definition in MYSQL_FOREIGN_KEYS:
+        if name not in existing:
+            cursor.execute(f"ALTER TABLE {table} ADD CONSTRAINT {name} {definition}")
+
+
+# ------------------ 4: ANALYTICS ROLLUPS ------------------
+# Daily per-listing and per-seller-category counters maintained by
+# analytics.py. day is days since the epoch (UTC). Both tables are clustered
+# on (seller_id, day, ...) (InnoDB primary key, SQLite WITHOUT ROWID), so a
+# seller's date range is one contiguous read with no row lookups. No foreign
+# keys: rows outlive deleted listings so a seller's history keeps adding up.
+ROLLUP_TABLES = [
+    """CREATE TABLE IF NOT EXISTS product_daily (
+    seller_id INT NOT NULL,
+    day INT NOT NULL,
+    product_id INT NOT NULL,
+    views INT NOT NULL DEFAULT 0,
+    cart_adds INT NOT NULL DEFAULT 0,
+    units_sold INT NOT NULL DEFAULT 0,
+    revenue DECIMAL(14,2) NOT NULL DEFAULT 0,
+    PRIMARY KEY (seller_id, day, product_id)
+)""",
+    """CREATE TABLE IF NOT EXISTS category_daily (
+    seller_id INT NOT NULL,
+    day INT NOT NULL,
+    category VARCHAR(100) NOT NULL,
+    views INT NOT NULL DEFAULT 0,
+    cart_adds INT NOT NULL DEFAULT 0,
+    units_sold INT NOT NULL DEFAULT 0,
+    revenue DECIMAL(14,2) NOT NULL DEFAULT 0,
+    PRIMARY KEY (seller_id, day, category)
+)""",
+]
+
+
+def _rollups(cursor):
+    suffix = " WITHOUT ROWID" if db.DB_BACKEND == "sqlite" else " ENGINE=InnoDB DEFAULT CHARSET=utf8mb4"
+    for create in ROLLUP_TABLES:
+        cursor.execute(create + suffix)
+
+
+# ------------------ 5: SIMILAR PRODUCTS ------------------
+# Top-k similar listings per product, written by recommend.py and read with
+# one primary key range scan on the detail page.
+SIMILAR_TABLE = """CREATE TABLE IF NOT EXISTS product_similar (
+    product_id INT NOT NULL,
+    position INT NOT NULL,
+    similar_id INT NOT NULL,
+    score FLOAT NOT NULL,
+    PRIMARY KEY (product_id, position)
+)"""
+
+
+def _similar(cursor):
+    suffix = " WITHOUT ROWID" if db.DB_BACKEND == "sqlite" else " ENGINE=InnoDB DEFAULT CHARSET=utf8mb4"
+    cursor.execute(SIMILAR_TABLE + suffix)
+
+
+# ------------------ 6: JOB QUEUE ------------------
+# Background jobs (jobs.py). run_at is when a queued job is due or, while it
+# runs, when its lease expires, so "what can run now" and "what is running"
+# are both ranges of (status, run_at). idempotency_key is unique (NULLs are
+# not), which makes enqueueing with a key an INSERT IGNORE.
+JOBS_COLUMNS = """
+    kind VARCHAR(64) NOT NULL,
+    payload TEXT,
+    idempotency_key VARCHAR(191) UNIQUE,
+    status VARCHAR(16) NOT NULL,
+    attempts INT NOT NULL DEFAULT 0,
+    max_attempts INT NOT NULL,
+    run_at BIGINT NOT NULL,
+    locked_by VARCHAR(128),
+    last_error TEXT,
+    created_at BIGINT,
+    finished_at BIGINT
+)"""
+
+
+def _jobs(cursor):
+    if db.DB_BACKEND == "sqlite":
+        cursor.execute("CREATE TABLE IF NOT EXISTS jobs (id INTEGER PRIMARY KEY AUTOINCREMENT," + JOBS_COLUMNS)
+    else:
+        cursor.execute("CREATE TABLE IF NOT EXISTS jobs (id BIGINT PRIMARY KEY AUTO_INCREMENT," + JOBS_COLUMNS
+                       + " ENGINE=InnoDB DEFAULT CHARSET=utf8mb4")
+    if "idx_jobs_due" not in index_names(cursor, "jobs"):
+        cursor.execute("CREATE INDEX idx_jobs_due ON jobs (status, run_at)")
+
+
+# ------------------ 7: PRICE FILTERS AND FACETS ------------------
+# One index per browse order: newest pages use the primary key (all) or
+# idx_products_category (category, implicitly + id); the price orders and
+# price ranges use (price, id) and (category, price, id). They cover the
+# WHERE and ORDER BY of every filter/sort combination, so a page reads its
+# rows in order and stops after LIMIT; the card columns are then read for
+# those rows only. product_facets holds listing counts per category and price
+# bucket (facets.py), kept current by the product writes; the migration counts
+# the existing listings with the buckets facets.PRICE_EDGES had then.
+PRICE_INDEXES = [
+    ("idx_products_price", "products", "price, id"),
+    ("idx_products_category_price", "products", "category, price, id"),
+]
+FACETS_TABLE = """CREATE TABLE IF NOT EXISTS product_facets (
+    category VARCHAR(100) NOT NULL,
+    bucket INT NOT NULL,
+    products INT NOT NULL,
+    PRIMARY KEY (category, bucket)
+)"""
+FACETS_EDGES = [0, 250, 500, 1000, 2500, 5000, 10000, 25000, 50000]
+FACETS_REFILL_SQL = ("INSERT INTO product_facets (category, bucket, products) "
+                     "SELECT COALESCE(category, ''), CASE WHEN price IS NULL THEN -1 "
+                     + " ".join(f"WHEN price < {edge} THEN {i}" for i, edge in enumerate(FACETS_EDGES[1:]))
+                     + f" ELSE {len(FACETS_EDGES) - 1} END, COUNT(*) FROM products GROUP BY 1, 2")
+
+
+def _facets(cursor):
+    for name, table, columns in PRICE_INDEXES:
+        if name not in index_names(cursor, table):
+            cursor.execute(f"CREATE INDEX {name} ON {table} ({columns})")
+    suffix = " WITHOUT ROWID" if db.DB_BACKEND == "sqlite" else " ENGINE=InnoDB DEFAULT CHARSET=utf8mb4"
+    cursor.execute(FACETS_TABLE + suffix)
+    # counts for the existing listings
+    cursor.execute("DELETE FROM product_facets")
+    cursor.execute(FACETS_REFILL_SQL)
+
+
+# ------------------ 8: ORDER PARTITIONS ------------------
+# Old orders move to monthly archive files (archive.py); idx_orders_created
+# finds a month's orders and the boundary between archive and database. On
+# MySQL orders is also RANGE partitioned by created_at, one partition per
+# month, so an archived month goes with DROP PARTITION. A partitioned table
+# can't have or be the target of foreign keys, and every unique key must
+# contain created_at: orders loses fk_orders_user, order_items loses
+# fk_order_items_order (the archive job deletes order lines itself) and the
+# primary key becomes (id, created_at). The partitions run from the month of
+# the oldest order to PARTITION_MONTHS_AHEAD months after the current one;
+# from then on the archive job keeps archive.PARTITIONS_AHEAD months ready.
+PARTITION_FOREIGN_KEYS = [
+    ("order_items", "fk_order_items_order"),
+    ("orders", "fk_orders_user"),
+]
+PARTITION_MONTHS_AHEAD = 3
+
+
+def _next_month(start):
+    t = time.gmtime(start)
+    return calendar.timegm((t.tm_year + t.tm_mon // 12, t.tm_mon % 12 + 1, 1, 0, 0, 0))
+
+
+def _month_start(ts):
+    t = time.gmtime(ts)
+    return calendar.timegm((t.tm_year, t.tm_mon, 1, 0, 0, 0))
+
+
+def _order_partitions(cursor):
+    if "idx_orders_created" not in index_names(cursor, "orders"):
+        cursor.execute("CREATE INDEX idx_orders_created ON orders (created_at)")
+    if db.DB_BACKEND == "sqlite":
+        return
+    cursor.execute("SELECT constraint_name FROM information_schema.table_constraints "
+                   "WHERE table_schema = DATABASE() AND constraint_type = 'FOREIGN KEY'")
+    existing = {r[0] for r in cursor.fetchall()}
+    for table, name in PARTITION_FOREIGN_KEYS:
+        if name in existing:
+            cursor.execute(f"ALTER TABLE {table} DROP FOREIGN KEY {name}")
+    cursor.execute("SELECT COUNT(*) FROM information_schema.partitions WHERE table_schema = DATABASE() "
+                   "AND table_name = 'orders' AND partition_name IS NOT NULL")
+    if cursor.fetchone()[0]:
+        return
+    cursor.execute("UPDATE orders SET created_at = 0 WHERE created_at IS NULL")
+    cursor.execute("ALTER TABLE orders MODIFY created_at BIGINT NOT NULL, "
+                   "DROP PRIMARY KEY, ADD PRIMARY KEY (id, created_at)")
+    # orders without a time go to p_old
+    cursor.execute("SELECT MIN(created_at) FROM orders WHERE created_at > 0")
+    oldest = cursor.fetchone()[0]
+    first = month = _month_start(oldest if oldest is not None else int(time.time()))
+    stop = _month_start(int(time.time()))
+    for _ in range(PARTITION_MONTHS_AHEAD + 1):
+        stop = _next_month(stop)
+    parts = [f"PARTITION p_old VALUES LESS THAN ({first})"]
+    while month < stop:
+        upper = _next_month(month)
+        parts.append(f"PARTITION p{time.strftime('%Y%m', time.gmtime(month))} VALUES LESS THAN ({upper})")
+        month = upper
+    parts.append("PARTITION p_future VALUES LESS THAN MAXVALUE")
+    cursor.execute("ALTER TABLE orders PARTITION BY RANGE (created_at) (" + ", ".join(parts) + ")")
+
+
+# ------------------ 9: PRODUCT VERSIONS ------------------
+# A counter every UPDATE of a product row increments (edits, stock taken by
+# checkout, image variants), so the JSON API (api.py) can derive ETags from
+# the rows it shows without comparing their contents.
+def _product_versions(cursor):
+    if "version" not in column_names(cursor, "products"):
+        cursor.execute("ALTER TABLE products ADD COLUMN version INT NOT NULL DEFAULT 1")
+
+
+# ------------------ 10: UPLOAD REFERENCES ------------------
+# uploads rows (storage.py) for the files stored before reference counting,
+# and every refcount recounted from the rows that name a file:
+# products.image_url and users.profile_image. A row nothing names any more is
+# orphaned now, so the sweep removes its file after the grace period. Rows
+# the sweep is deleting right now (refcount -1) are left to it.
+UPLOAD_REFERENCES_SQL = """SELECT file_key, COUNT(*) FROM (
+    SELECT image_url AS file_key FROM products WHERE image_url IS NOT NULL AND image_url <> ''
+    UNION ALL
+    SELECT profile_image FROM users WHERE profile_image IS NOT NULL AND profile_image <> ''
+) refs GROUP BY file_key"""
+
+
+def _upload_references(cursor):
+    now = int(time.time())
+    cursor.execute(UPLOAD_REFERENCES_SQL)
+    counts = dict(cursor.fetchall())
+    cursor.execute("SELECT file_key, refcount FROM uploads")
+    stored = dict(cursor.fetchall())
+    inserts = [(key, n, now) for key, n in counts.items() if key not in stored]
+    if inserts:
+        cursor.executemany("INSERT INTO uploads (file_key, refcount, size, created_at) VALUES (%s,%s,0,%s)", inserts)
+    updates = [(counts[key], key) for key, refcount in stored.items()
+               if key in counts and refcount >= 0 and refcount != counts[key]]
+    if updates:
+        cursor.executemany("UPDATE uploads SET refcount=%s, orphaned_at=NULL WHERE file_key=%s", updates)
+    orphaned = [(now, key) for key, refcount in stored.items() if key not in counts and refcount > 0]
+    if orphaned:
+        cursor.executemany("UPDATE uploads SET refcount=0, orphaned_at=%s WHERE file_key=%s", orphaned)
+
+
+# ------------------ 11: ORDER LINE PRICES ------------------
+# The unit price a line was bought at, written by checkout, so rebuilt sales
+# (analytics.backfill) count what the buyer paid rather than the listing's
+# price today. Lines written before this migration keep NULL.
+def _order_item_prices(cursor):
+    if "price" not in column_names(cursor, "order_items"):
+        cursor.execute("ALTER TABLE order_items ADD COLUMN price DECIMAL(10,2)")
+
+
+MIGRATIONS = [
+    (1, "base schema", _base_schema),
+    (2, "indexes for login, listing, order and upload lookups", _indexes),
+    (3, "foreign keys", _foreign_keys),
+    (4, "seller analytics rollup tables", _rollups),
+    (5, "similar products table", _similar),
+    (6, "background job queue", _jobs),
+    (7, "price indexes and listing facets", _facets),
+    (8, "order partitions by month", _order_partitions),
+    (9, "product row versions", _product_versions),
+    (10, "upload reference counts for existing files", _upload_references),
+    (11, "unit prices on order lines", _order_item_prices),
+]
+
+
+# ------------------ RUNNER ------------------
+MIGRATIONS_TABLE = """CREATE TABLE IF NOT EXISTS schema_migrations (
+    version INT PRIMARY KEY,
+    description VARCHAR(255),
+    applied_at BIGINT
+)"""
+
+
+def applied_versions(cursor):
+    cursor.execute(MIGRATIONS_TABLE)
+    cursor.execute("SELECT version FROM schema_migrations")
+    return {r[0] for r in cursor.fetchall()}
+
+
+def pending(conn):
+    cursor = conn.cursor()
+    done = applied_versions(cursor)
+    conn.commit()
+    cursor.close()
+    return [m for m in MIGRATIONS if m[0] not in done]
+
+
+def _apply(conn, version, description, migrate):
+    # one migration in one transaction; False if another process applied it first
+    cursor = conn.cursor()
+    try:
+        conn.begin()
+        if version in applied_versions(cursor):
+            conn.rollback()
+            return False
+        migrate(cursor)
+        if db.DB_BACKEND == "sqlite":
+            cursor.execute("PRAGMA foreign_key_check")
+            violations = cursor.fetchall()
+            if violations:
+                raise RuntimeError(f"migration {version} leaves foreign key violations: {violations[:5]}")
+        cursor.execute("INSERT INTO schema_migrations (version, description, applied_at) VALUES (%s,%s,%s)",
+                       (version, description, int(time.time())))
+        conn.commit()
+        return True
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+
+
+def upgrade(conn, target=None, log=print):
+    # apply pending migrations up to target (default: all); returns applied versions
+    todo = [m for m in pending(conn) if target is None or m[0] <= target]
+    if not todo:
+        return []
+    applied = []
+    cursor = conn.cursor()
+    if db.DB_BACKEND == "sqlite":
+        # must be switched outside a transaction; table rebuilds need it off
+        cursor.execute("PRAGMA foreign_keys=OFF")
+    else:
+        # one migrating process at a time across the deployment
+        cursor.execute("SELECT GET_LOCK('ecofinds_migrations', 60)")
+        cursor.fetchall()
+    try:
+        for version, description, migrate in todo:
+            if _apply(conn, version, description, migrate):
+                log(f"Applied migration {version}: {description}")
+                applied.append(version)
+    finally:
+        if db.DB_BACKEND == "sqlite":
+            cursor.execute("PRAGMA foreign_keys=ON")
+        else:
+            cursor.execute("SELECT RELEASE_LOCK('ecofinds_migrations')")
+            cursor.fetchall()
+        cursor.close()
+    return applied
+
+
+def status(conn):
+    # [(version, description, applied_at or None)]
+    cursor = conn.cursor()
+    cursor.execute(MIGRATIONS_TABLE)
+    cursor.execute("SELECT version, applied_at FROM schema_migrations")
+    applied_at = dict(cursor.fetchall())
+    conn.commit()
+    cursor.close()
+    return [(v, d, applied_at.get(v)) for v, d, _ in MIGRATIONS]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Apply or inspect database schema migrations.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("status", help="list migrations and whether they are applied")
+    up = sub.add_parser("upgrade", help="apply pending migrations")
+    up.add_argument("--to", type=int, default=None, help="stop after this version")
+    args = parser.parse_args()
+
+    pool = db.ConnectionPool(db._connect_sqlite if db.DB_BACKEND == "sqlite" else db._connect_mysql, size=1)
+    conn = pool.acquire()
+    try:
+        if args.command == "status":
+            for version, description, applied_at in status(conn):
+                when = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(applied_at)) if applied_at else "pending"
+                print(f"{version:>4}  {when:<19}  {description}")
+        else:
+            applied = upgrade(conn, args.to)
+            if not applied:
+                print("Database is up to date")
+    finally:
+        conn.release()
+        pool.dispose()
+
+
+if __name__ == "__main__":
+    main()
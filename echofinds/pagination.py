@@ -0,0 +1,204 @@
+import base64
+import math
+import os
+from collections import namedtuple
+
+# Keyset (cursor) pagination for product listings.
+# Pages are ordered newest first (id DESC) or by price (price, id). A cursor
+# is an opaque token that encodes the direction and the sort key at the page
+# boundary, so every page costs one indexed range scan no matter how deep the
+# user has paged. Price orders leave out listings without a price.
+PAGE_SIZE = int(os.environ.get("ECOFINDS_PAGE_SIZE", "24"))
+
+SORTS = ("newest", "price_asc", "price_desc")
+PRICE_SORTS = ("price_asc", "price_desc")
+
+# columns used by the product card templates (dashboard.html, products.html)
+CARD_COLUMNS = "id, user_id, title, category, price, image_url, image_variants"
+# dashboard cards also show a short description
+CARD_COLUMNS_WITH_SUMMARY = CARD_COLUMNS + ", SUBSTR(description, 1, 160) AS description"
+
+Page = namedtuple("Page", ["items", "next_cursor", "prev_cursor"])
+# what a listing shows; sort None is the default order (newest first, or
+# relevance for search results)
+Filters = namedtuple("Filters", ["category", "min_price", "max_price", "sort"], defaults=(None, None, None, None))
+
+
+def _price(value):
+    try:
+        price = float(value)
+    except (TypeError, ValueError):
+        return None
+    return price if math.isfinite(price) and price >= 0 else None
+
+
+def filters_from_args(args):
+    # Filters from the query string; values that don't parse are ignored
+    sort = args.get("sort")
+    return Filters(args.get("category", "").strip() or None, _price(args.get("min_price")),
+                   _price(args.get("max_price")), sort if sort in SORTS else None)
+
+
+def filter_args(filters):
+    # the query string arguments for filters (for url_for), without the unset ones
+    args = {"category": filters.category, "sort": filters.sort}
+    for name in ("min_price", "max_price"):
+        value = getattr(filters, name)
+        if value is not None:
+            args[name] = f"{value:.2f}".rstrip("0").rstrip(".")
+    return {k: v for k, v in args.items() if v is not None}
+
+
+def filter_clauses(filters):
+    # (where, params) for keyset_query
+    where, params = [], []
+    if filters.category:
+        where.append("category=%s")
+        params.append(filters.category)
+    if filters.min_price is not None:
+        where.append("price >= %s")
+        params.append(filters.min_price)
+    elif filters.sort in PRICE_SORTS:
+        where.append("price IS NOT NULL")
+    if filters.max_price is not None:
+        where.append("price <= %s")
+        params.append(filters.max_price)
+    return where, params
+
+
+def encode_cursor(kind, value):
+    raw = f"{kind}:{value}".encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def _decode(token):
+    padded = token + "=" * (-len(token) % 4)
+    return base64.urlsafe_b64decode(padded.encode()).decode().split(":", 1)
+
+
+def decode_cursor(token):
+    # returns (kind, int value) or (None, None) for a missing/invalid token
+    if not token:
+        return None, None
+    try:
+        kind, value = _decode(token)
+        value = int(value)
+    except Exception:
+        return None, None
+    if kind not in ("a", "b", "o") or value < 0:
+        return None, None
+    return kind, value
+
+
+def encode_time_cursor(created_at, row_id):
+    # (created_at, id) boundary for lists ordered newest first by timestamp
+    return encode_cursor("t", f"{created_at}.{row_id}")
+
+
+def decode_price_cursor(token):
+    # returns (kind, price, id) or (None, None, None) for a missing/invalid token
+    if not token:
+        return None, None, None
+    try:
+        kind, value = _decode(token)
+        price, row_id = value.split(":")
+        price, row_id = float(price), int(row_id)
+    except Exception:
+        return None, None, None
+    if kind not in ("a", "b") or not math.isfinite(price):
+        return None, None, None
+    return kind, price, row_id
+
+
+def _boundary_cursor(kind, row, sort):
+    if sort in PRICE_SORTS:
+        return encode_cursor(kind, f"{row['price']}:{row['id']}")
+    return encode_cursor(kind, row["id"])
+
+
+def decode_time_cursor(token):
+    # returns (created_at, id) or None for a missing/invalid token
+    if not token:
+        return None
+    try:
+        kind, value = _decode(token)
+        created_at, row_id = value.split(".")
+        if kind != "t":
+            return None
+        return int(created_at), int(row_id)
+    except Exception:
+        return None
+
+
+def keyset_query(columns, where=(), params=(), token=None, page_size=PAGE_SIZE, sort=None, hint=""):
+    # returns (query, args, cursor kind) for one page; see keyset_page.
+    # where is a sequence of SQL conditions joined with AND, params their values;
+    # hint an index hint for the table (db.index_hint).
+    # "a" cursors fetch the rows after the boundary in sort order (older, or
+    # further along the price order), "b" cursors the rows before it.
+    clauses = list(where)
+    args = list(params)
+    descending = sort != "price_asc"
+    if sort in PRICE_SORTS:
+        kind, price, boundary = decode_price_cursor(token)
+    else:
+        kind, boundary = decode_cursor(token)
+        kind = kind if kind in ("a", "b") else None
+    if kind == "b":
+        descending = not descending
+    if kind:
+        op = "<" if descending else ">"
+        if sort in PRICE_SORTS:
+            # (price, id) past the boundary, written so the price index range starts at it
+            clauses.append(f"price {op}= %s AND (price {op} %s OR id {op} %s)")
+            args += [price, price, boundary]
+        else:
+            clauses.append(f"id {op} %s")
+            args.append(boundary)
+    order = "DESC" if descending else "ASC"
+    query = f"SELECT {columns} FROM products{hint}"
+    if clauses:
+        query += " WHERE " + " AND ".join(clauses)
+    if sort in PRICE_SORTS:
+        query += f" ORDER BY price {order}, id {order} LIMIT %s"
+    else:
+        query += f" ORDER BY id {order} LIMIT %s"
+    args.append(page_size + 1)
+    return query, tuple(args), kind
+
+
+def keyset_result(rows, kind, page_size=PAGE_SIZE, sort=None):
+    # turn the rows fetched for keyset_query into a Page
+    rows = list(rows)
+    has_more = len(rows) > page_size
+    rows = rows[:page_size]
+    if kind == "b":
+        rows.reverse()
+    if not rows:
+        return Page([], None, None)
+    if kind == "b":
+        # walking back towards newer rows: we came from an older page
+        has_next, has_prev = True, has_more
+    else:
+        has_next, has_prev = has_more, kind == "a"
+    next_cursor = _boundary_cursor("a", rows[-1], sort) if has_next else None
+    prev_cursor = _boundary_cursor("b", rows[0], sort) if has_prev else None
+    return Page(rows, next_cursor, prev_cursor)
+
+
+def keyset_page(cursor, columns, where=(), params=(), token=None, page_size=PAGE_SIZE, sort=None):
+    query, args, kind = keyset_query(columns, where, params, token, page_size, sort)
+    cursor.execute(query, args)
+    return keyset_result(cursor.fetchall(), kind, page_size, sort)
+
+
+def offset_window(token):
+    # search results are ordered by relevance, not id, so they page by offset
+    kind, value = decode_cursor(token)
+    return value if kind == "o" else 0
+
+
+def offset_page(items, offset, has_more, page_size=PAGE_SIZE):
+    next_cursor = encode_cursor("o", offset + page_size) if has_more else None
+    prev_cursor = encode_cursor("o", max(offset - page_size, 0)) if offset > 0 else None
+    return Page(items, next_cursor, prev_cursor)
@@ -0,0 +1,111 @@
+import os
+import threading
+import time
+
+import db
+import repository
+
+# In-process bitmap of product ids that exist, used to validate session carts
+# without a database round trip. add_product/delete_product keep it current in
+# this process; the whole bitmap is reloaded after REFRESH_INTERVAL so writes
+# from other processes are picked up. A stale "present" bit is harmless (the
+# cart and checkout views read the rows anyway); a "missing" bit is confirmed
+# against the database before an id is dropped from a cart.
+REFRESH_INTERVAL = float(os.environ.get("ECOFINDS_PRODUCT_IDS_REFRESH", "60"))
+
+
+class ProductIdCache:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._bits = bytearray()
+        self.loaded_at = None
+        # bumped on every change so callers can tell the set moved on
+        self.version = 0
+
+    def _set(self, pid, present):
+        byte, bit = divmod(pid, 8)
+        if byte >= len(self._bits):
+            if not present:
+                return
+            # grow with headroom so sequential inserts don't reallocate every time
+            self._bits.extend(bytearray(byte - len(self._bits) + 1 + len(self._bits) // 4))
+        if present:
+            self._bits[byte] |= 1 << bit
+        else:
+            self._bits[byte] &= ~(1 << bit) & 0xFF
+
+    def __contains__(self, pid):
+        byte, bit = divmod(pid, 8)
+        return byte < len(self._bits) and bool(self._bits[byte] & (1 << bit))
+
+    def load(self, ids):
+        ids = list(ids)
+        bits = bytearray(max(ids) // 8 + 1 if ids else 0)
+        for pid in ids:
+            bits[pid >> 3] |= 1 << (pid & 7)
+        with self._lock:
+            self._bits = bits
+            self.loaded_at = time.monotonic()
+            self.version += 1
+
+    def add(self, pid):
+        with self._lock:
+            self._set(pid, True)
+            self.version += 1
+
+    def discard(self, pid):
+        with self._lock:
+            self._set(pid, False)
+            self.version += 1
+
+
+_cache = ProductIdCache()
+_reload_lock = threading.Lock()
+
+
+def _reload():
+    conn = db.get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute("SELECT id FROM products")
+    _cache.load(r[0] for r in cursor.fetchall())
+    cursor.close()
+    conn.close()
+
+
+def _ensure_loaded():
+    # one thread reloads at a time; the others use the current bitmap meanwhile
+    if _cache.loaded_at is None:
+        with _reload_lock:
+            if _cache.loaded_at is None:
+                _reload()
+    elif time.monotonic() - _cache.loaded_at > REFRESH_INTERVAL and _reload_lock.acquire(blocking=False):
+        try:
+            _reload()
+        finally:
+            _reload_lock.release()
+    return _cache
+
+
+def existing(ids):
+    # subset of ids that still exist as products
+    cache = _ensure_loaded()
+    found = {pid for pid in ids if pid in cache}
+    unknown = [pid for pid in set(ids) if pid not in found]
+    if unknown:
+        # possibly created by another process since the last reload
+        conn = db.get_db_connection()
+        for pid in repository.existing_product_ids(conn, unknown):
+            found.add(pid)
+            cache.add(pid)
+        conn.close()
+    return found
+
+
+def product_added(pid):
+    if _cache.loaded_at is not None:
+        _cache.add(pid)
+
+
+def product_deleted(pid):
+    if _cache.loaded_at is not None:
+        _cache.discard(pid)
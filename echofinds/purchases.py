@@ -0,0 +1,169 @@
+import os
+from collections import Counter
+from decimal import Decimal
+
+import archive
+import pagination
+import repository
+
+# Purchase history helpers for previous_purchases() and checkout().
+# History pages load in two set-based queries (one page of orders, then all of
+# their items) instead of one query per order. Orders older than the archive
+# boundary are read from the archive files (archive.py), only once a user
+# pages past their last order still in the database.
+ORDERS_PAGE_SIZE = int(os.environ.get("ECOFINDS_ORDERS_PAGE_SIZE", "10"))
+
+# Optional per-user purchase_summary row, kept current by checkout(), so the
+# history page header costs one primary key lookup however many orders exist.
+SUMMARY_ENABLED = os.environ.get("ECOFINDS_PURCHASE_SUMMARY", "0") == "1"
+
+# columns used by previous_purchases.html
+GUEST_PRODUCT_COLUMNS = "id, title, price, image_url, image_variants"
+ITEM_COLUMNS = "oi.order_id, oi.quantity AS qty, p.id, p.title, p.price, p.image_url, p.image_variants, p.version"
+
+
+# SQL shared with the async views (asgi.py), which run the same queries on the async pool
+SUMMARY_INCREMENT_SQL = ('UPDATE purchase_summary SET order_count = order_count + 1, item_count = item_count + %s, '
+                         'total_spent = total_spent + %s, last_order_at = %s WHERE user_id=%s')
+# build the summary row from existing orders (spend uses current prices)
+SUMMARY_BACKFILL_SQL = ('SELECT COUNT(DISTINCT o.id), COALESCE(SUM(oi.quantity), 0), '
+                        'COALESCE(SUM(oi.quantity * p.price), 0), MAX(o.created_at) '
+                        'FROM orders o LEFT JOIN order_items oi ON oi.order_id=o.id '
+                        'LEFT JOIN products p ON p.id=oi.product_id WHERE o.user_id=%s')
+SUMMARY_INSERT_SQL = ('INSERT INTO purchase_summary (user_id, order_count, item_count, total_spent, last_order_at) '
+                      'VALUES (%s,%s,%s,%s,%s)')
+SUMMARY_SELECT_SQL = 'SELECT order_count, item_count, total_spent, last_order_at FROM purchase_summary WHERE user_id=%s'
+
+
+def orders_query(user_id, token=None, page_size=ORDERS_PAGE_SIZE):
+    # one page of a user's orders still in the database, newest first, keyset on (created_at, id)
+    boundary = pagination.decode_time_cursor(token)
+    if boundary:
+        return ('SELECT id, created_at FROM orders WHERE user_id=%s AND created_at >= %s AND '
+                '(created_at < %s OR (created_at = %s AND id < %s)) '
+                'ORDER BY created_at DESC, id DESC LIMIT %s',
+                (user_id, archive.boundary(), boundary[0], boundary[0], boundary[1], page_size + 1))
+    return ('SELECT id, created_at FROM orders WHERE user_id=%s AND created_at >= %s '
+            'ORDER BY created_at DESC, id DESC LIMIT %s', (user_id, archive.boundary(), page_size + 1))
+
+
+def items_query(order_ids):
+    placeholders = ','.join(['%s'] * len(order_ids))
+    return (f'SELECT {ITEM_COLUMNS} FROM order_items oi JOIN products p ON oi.product_id=p.id '
+            f'WHERE oi.order_id IN ({placeholders}) ORDER BY oi.id', tuple(order_ids))
+
+
+def archived_orders(user_id, rows, token=None, page_size=ORDERS_PAGE_SIZE):
+    # the archived orders that complete a page the rows of orders_query leave short (reads files)
+    if len(rows) > page_size or not archive.boundary():
+        return []
+    if rows:
+        before = (rows[-1]['created_at'], rows[-1]['id'])
+    else:
+        before = pagination.decode_time_cursor(token)
+    return archive.user_orders(user_id, before, page_size + 1 - len(rows))
+
+
+def history_page(rows, items, page_size=ORDERS_PAGE_SIZE, archived=()):
+    # (orders, next_cursor) from the rows of orders_query and items_query, then archived_orders
+    grouped = {}
+    for item in items:
+        grouped.setdefault(item.pop('order_id'), []).append(item)
+    orders = [{'id': o['id'], 'created_at': o['created_at'], 'products': grouped.get(o['id'], [])} for o in rows]
+    orders += [{'id': o['id'], 'created_at': o['created_at'], 'products': o['products']} for o in archived]
+    has_more = len(orders) > page_size
+    orders = orders[:page_size]
+    next_cursor = pagination.encode_time_cursor(orders[-1]['created_at'], orders[-1]['id']) if has_more else None
+    return [{'id': o['id'], 'timestamp': o['created_at'], 'products': o['products']} for o in orders], next_cursor
+
+
+def order_history(conn, user_id, token=None, page_size=ORDERS_PAGE_SIZE):
+    # returns (orders, next_cursor); orders are newest first, keyset on (created_at, id)
+    cursor = conn.cursor(dictionary=True)
+    cursor.execute(*orders_query(user_id, token, page_size))
+    rows = cursor.fetchall()
+    items = []
+    if rows:
+        cursor.execute(*items_query([o['id'] for o in rows[:page_size]]))
+        items = cursor.fetchall()
+    cursor.close()
+    return history_page(rows, items, page_size, archived_orders(user_id, rows, token, page_size))
+
+
+def guest_products_query(session_orders):
+    # session orders reference product ids only; all of them come from one query
+    all_ids = sorted({pid for o in session_orders for pid in o.get('items', [])})
+    if not all_ids:
+        return None
+    placeholders = ','.join(['%s'] * len(all_ids))
+    return (f"SELECT {GUEST_PRODUCT_COLUMNS} FROM products WHERE id IN ({placeholders})",
+            tuple(all_ids))
+
+
+def guest_detail(session_orders, rows):
+    by_id = {r['id']: r for r in rows}
+    detailed = []
+    for o in session_orders:
+        counts = Counter(o.get('items', []))
+        prods = [dict(by_id[pid], qty=counts[pid]) for pid in sorted(counts) if pid in by_id]
+        detailed.append({'timestamp': o.get('timestamp'), 'products': prods})
+    return detailed
+
+
+def guest_history(conn, session_orders):
+    ids = {pid for o in session_orders for pid in o.get('items', [])}
+    rows = repository.products_by_ids(conn, ids, GUEST_PRODUCT_COLUMNS) if ids else []
+    return guest_detail(session_orders, rows)
+
+
+def with_archived(user_id, row):
+    # SUMMARY_INSERT_SQL params from a SUMMARY_BACKFILL_SQL row plus the user's archived orders (reads files)
+    order_count, item_count, total_spent, last_order_at = row
+    if archive.boundary():
+        orders, items, spent, last = archive.totals(user_id)
+        order_count, item_count = order_count + orders, item_count + items
+        total_spent = str(Decimal(str(total_spent or 0)) + spent)
+        last_order_at = max(last_order_at or 0, last or 0) or None
+    return (user_id, order_count, item_count, total_spent, last_order_at)
+
+
+def _backfill_summary(cursor, user_id):
+    cursor.execute(SUMMARY_BACKFILL_SQL, (user_id,))
+    cursor.execute(SUMMARY_INSERT_SQL, with_archived(user_id, cursor.fetchone()))
+
+
+def record_order(conn, user_id, created_at, item_count, total):
+    # called inside the checkout transaction, after the order rows are written
+    if not SUMMARY_ENABLED:
+        return
+    cursor = conn.cursor()
+    cursor.execute(SUMMARY_INCREMENT_SQL, (item_count, total, created_at, user_id))
+    if cursor.rowcount == 0:
+        # first order since the summary was enabled; the new order is already included
+        _backfill_summary(cursor, user_id)
+    cursor.close()
+
+
+def _read_summary(conn, user_id):
+    cursor = conn.cursor(dictionary=True)
+    cursor.execute(SUMMARY_SELECT_SQL, (user_id,))
+    summary = cursor.fetchone()
+    cursor.close()
+    return summary
+
+
+def get_summary(conn, user_id):
+    if not SUMMARY_ENABLED:
+        return None
+    summary = _read_summary(conn, user_id)
+    if summary is None:
+        cursor = conn.cursor()
+        try:
+            _backfill_summary(cursor, user_id)
+            conn.commit()
+        except Exception:
+            # another request backfilled it first
+            conn.rollback()
+        cursor.close()
+        summary = _read_summary(conn, user_id)
+    return summary
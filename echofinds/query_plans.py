@@ -0,0 +1,132 @@
+import random
+import re
+from urllib.parse import urlencode
+
+import db
+import facets
+import metrics
+
+# Query plan checks shared by benchmarks/explain_check.py (every route on a
+# large dataset) and tests/test_query_plans.py (the product listings on a
+# small one): seed a database, then EXPLAIN statements the app ran and report
+# the ones that scan a table or sort rows in a temporary structure.
+# A table scan is only accepted when it is bounded: the statement has a LIMIT,
+# filters on nothing but the primary key and needs no sort (e.g. the
+# newest-first listing pages), or is a newest-first walk over a wide price
+# range.
+CATEGORIES = ["Furniture", "Books", "Music", "Clothing", "Electronics", "Garden", "Toys", "Sports"]
+
+# Deliberate full scans: the in-process search index and product id bitmap
+# load every product in the background (see search.py and product_ids.py),
+# the facet refill job recounts them and the facet table (categories x price
+# buckets rows) is read whole (facets.py).
+ALLOWED_SCANS = {
+    "SELECT id, title, description, category, price FROM products",
+    "SELECT id FROM products",
+    metrics.normalize_query(facets.REFILL_SQL),
+    "DELETE FROM product_facets",
+    "SELECT category, bucket, products FROM product_facets",
+    # the full similar-items rebuild sweeps lists of deleted listings
+    "DELETE FROM product_similar WHERE product_id NOT IN (SELECT id FROM products)",
+}
+
+_WHERE_RE = re.compile(r"\bWHERE\b(.*?)(?:\bORDER BY\b|\bGROUP BY\b|\bLIMIT\b|$)", re.IGNORECASE | re.DOTALL)
+_COLUMN_RE = re.compile(r"(?:\w+\.)?(\w+)\s*(?:=|<|>|\bIN\b|\bLIKE\b|\bIS\b)", re.IGNORECASE)
+
+
+def seed(n_users, n_products, n_orders):
+    # adds to whatever the database holds; the new rows reference each other
+    rng = random.Random(7)
+    conn = db.get_db_connection()
+    cursor = conn.cursor()
+    last = {}
+    for table in ("users", "products", "orders"):
+        cursor.execute(f"SELECT COALESCE(MAX(id), 0) FROM {table}")
+        last[table] = cursor.fetchone()[0]
+
+    def added(table):
+        cursor.execute(f"SELECT id FROM {table} WHERE id > %s ORDER BY id", (last[table],))
+        return [r[0] for r in cursor.fetchall()]
+
+    cursor.executemany("INSERT INTO users (username, email, password) VALUES (%s,%s,%s)",
+                       [(f"user{i}", f"user{i}@example.com", "pw") for i in range(n_users)])
+    users = added("users")
+    cursor.executemany(
+        "INSERT INTO products (user_id, title, description, category, price, image_url) VALUES (%s,%s,%s,%s,%s,%s)",
+        [(rng.choice(users), f"item {i}", "seeded item", rng.choice(CATEGORIES), rng.randint(1, 500), None)
+         for i in range(n_products)])
+    products = added("products")
+    cursor.executemany("INSERT INTO orders (user_id, created_at) VALUES (%s,%s)",
+                       [(rng.choice(users), 1700000000 + i) for i in range(n_orders)])
+    cursor.executemany("INSERT INTO order_items (order_id, product_id, quantity) VALUES (%s,%s,%s)",
+                       [(o, rng.choice(products), 1) for o in added("orders") for _ in range(2)])
+    conn.commit()
+    # statistics for the seeded tables only: the others hold a row or two here,
+    # and statistics saying so would make a scan look like the best plan
+    if db.DB_BACKEND == "sqlite":
+        for table in ("users", "products", "orders", "order_items"):
+            cursor.execute(f"ANALYZE {table}")
+    else:
+        cursor.execute("ANALYZE TABLE users, products, orders, order_items")
+        cursor.fetchall()
+    facets.refill(cursor)
+    conn.commit()
+    cursor.close()
+    conn.close()
+
+
+def filter_urls():
+    # every browse sort x category x price range combination, and one search
+    urls = []
+    for sort in ("", "price_asc", "price_desc"):
+        for category in ("", "Books"):
+            for low, high in (("", ""), ("100", ""), ("", "20"), ("100", "120")):
+                args = {"sort": sort, "category": category, "min_price": low, "max_price": high}
+                urls.append("/products?" + urlencode({k: v for k, v in args.items() if v}))
+    return urls + ["/products?q=item&sort=price_asc&min_price=100"]
+
+
+def api_urls():
+    return ["/api/v1/products", "/api/v1/products?category=Books&sort=price_desc&fields=id,price",
+            "/api/v1/products?min_price=100&max_price=120", "/api/v1/products/12", "/api/v1/categories",
+            "/api/v1/purchases"]
+
+
+def _bounded(query):
+    # LIMITed and filtering only on the primary key: the scan stops after LIMIT rows.
+    # Newest-first pages over a wide price range walk the primary key on purpose
+    # and stop after LIMIT matches (see fragments.NARROW_PRICE_RANGE).
+    if not re.search(r"\bLIMIT\b", query, re.IGNORECASE):
+        return False
+    if re.search(r"\bNOT INDEXED\b|FORCE INDEX \(PRIMARY\)", query) and re.search(r"ORDER BY id \w+ LIMIT", query):
+        return True
+    where = _WHERE_RE.search(query)
+    return where is None or all(col.lower() == "id" for col in _COLUMN_RE.findall(where.group(1)))
+
+
+def explain(cursor, query, params, tables):
+    # returns (plan lines, problems): scans of the given tables that aren't
+    # bounded, or any scan when the statement also sorts
+    if db.DB_BACKEND == "sqlite":
+        cursor.execute("EXPLAIN QUERY PLAN " + query, params)
+        plan = [row[-1] for row in cursor.fetchall()]
+        problems = []
+        for line in plan:
+            words = line.split()
+            if words[0] != "SCAN" or words[1] not in tables:
+                continue
+            if "USE TEMP B-TREE" in " ".join(plan) or not _bounded(query):
+                problems.append(line)
+        return plan, problems
+    cursor.execute("EXPLAIN " + query, params)
+    columns = [d[0] for d in cursor.description]
+    rows = [dict(zip(columns, r)) for r in cursor.fetchall()]
+    plan = [f"{r['table']}: type={r['type']} key={r['key']} rows={r['rows']} {r.get('Extra') or ''}" for r in rows]
+    problems = [p for r, p in zip(rows, plan)
+                if r["type"] == "ALL" and r["table"] in tables and not (_bounded(query) and "filesort" not in p)]
+    return plan, problems
+
+
+def sorts(plan):
+    # plan lines that sort rows outside an index
+    return [line for line in plan if "USE TEMP B-TREE" in line or "filesort" in line.lower()]
@@ -0,0 +1,471 @@
+import argparse
+import math
+import os
+import queue
+import threading
+import time
+import zlib
+from collections import Counter
+
+try:
+    import numpy as np
+except ImportError:
+    # numpy is only needed to build recommendations; pages still serve stored ones
+    np = None
+
+import db
+import pagination
+import search
+
+# "Similar items" for the product detail page.
+# Every listing is a TF-IDF vector of its title and description (tokens from
+# search.tokenize, title words weighted as in search), hashed into DIMENSIONS
+# signed buckets and L2-normalised, so the whole catalog is one float32
+# matrix. A listing's neighbours are the other listings in its category with
+# the highest
+#   cosine(text) + PRICE_WEIGHT * price affinity
+# where price affinity is 1 in the same half-octave price band, 0.5 in the next
+# band and 0 beyond. The price band is appended to the text vector as two
+# adjacent one-hot columns (band b at b and b+1, each sqrt(PRICE_WEIGHT / 2)),
+# whose dot product is exactly that affinity, so scoring BLOCK_ROWS listings
+# against their category is a single matrix product. The TOP_K best are
+# stored in product_similar, so a detail page only reads TOP_K rows by
+# primary key.
+#
+# A background thread owns the model: it builds it on start and every
+# REBUILD_INTERVAL seconds, and in between applies the changes queued by
+# add/edit/delete (product_changed / product_deleted): the changed listing
+# gets fresh neighbours, listings it now beats get it inserted, and listings
+# that pointed at a deleted or moved listing are recomputed. New words get the
+# IDF of a word seen once until the next full build. Like the search index
+# the model is per process; with several workers, set ECOFINDS_RECOMMEND=0 on
+# all but one or run "python recommend.py build" from cron instead.
+ENABLED = os.environ.get("ECOFINDS_RECOMMEND", "1") == "1" and np is not None
+TOP_K = int(os.environ.get("ECOFINDS_RECOMMEND_K", "8"))
+DIMENSIONS = int(os.environ.get("ECOFINDS_RECOMMEND_DIMENSIONS", "256"))
+REBUILD_INTERVAL = float(os.environ.get("ECOFINDS_RECOMMEND_REBUILD_INTERVAL", "3600"))
+PRICE_WEIGHT = 0.25
+# half-octave bands from 1 up to ~8 million; prices beyond share the last band
+PRICE_BANDS = 46
+# rows scored per matrix product; the score block is BLOCK_ROWS x category size
+BLOCK_ROWS = 256
+# products written per transaction
+WRITE_CHUNK = 500
+TEXT_WEIGHTS = {"title": search.FIELD_WEIGHTS["title"], "description": search.FIELD_WEIGHTS["description"]}
+
+SIMILAR_SQL = (f"SELECT {', '.join('p.' + c.strip() for c in pagination.CARD_COLUMNS.split(','))} "
+               "FROM product_similar s JOIN products p ON p.id = s.similar_id "
+               "WHERE s.product_id=%s ORDER BY s.position")
+
+
+def _terms(title, description):
+    # term -> dampened weighted count, as in the search index
+    weights = Counter()
+    for field, text in (("title", title), ("description", description)):
+        for term in search.tokenize(text):
+            weights[term] += TEXT_WEIGHTS[field]
+    return {term: 1.0 + math.log(w) for term, w in weights.items()}
+
+
+def _price_band(price):
+    # half-octave bands: 100 and 140 share one, 100 and 200 are two apart
+    return min(int(math.floor(math.log2(max(float(price or 0), 1.0)) * 2)), PRICE_BANDS - 1)
+
+
+def _top_k(scores, k):
+    # column indices of the k best scores in each row, best first
+    k = min(k, scores.shape[1])
+    if k <= 0:
+        return np.zeros((scores.shape[0], 0), dtype=np.int64)
+    if k < scores.shape[1]:
+        best = np.argpartition(scores, scores.shape[1] - k, axis=1)[:, -k:]
+    else:
+        best = np.tile(np.arange(scores.shape[1]), (scores.shape[0], 1))
+    order = np.argsort(-np.take_along_axis(scores, best, axis=1), axis=1, kind="stable")
+    return np.take_along_axis(best, order, axis=1)
+
+
+class SimilarityModel:
+    def __init__(self, dims=DIMENSIONS, k=TOP_K):
+        self.dims = dims
+        self.k = k
+        self.idf = {}
+        self.default_idf = 1.0
+        self._buckets = {}     # term -> (bucket, sign)
+        self.rows = {}         # product_id -> row
+        self._categories = {}  # category -> code
+        self.n = 0
+        self._allocate(0)
+        self.built_at = None
+        self.build_seconds = None
+
+    def _allocate(self, capacity):
+        self.ids = np.zeros(capacity, dtype=np.int64)
+        # text columns, then PRICE_BANDS + 1 price columns
+        self.vectors = np.zeros((capacity, self.dims + PRICE_BANDS + 1), dtype=np.float32)
+        # -1 marks a deleted row: never a candidate
+        self.category = np.full(capacity, -1, dtype=np.int32)
+        # neighbour product ids (0 = empty slot) and their scores
+        self.neighbours = np.zeros((capacity, self.k), dtype=np.int64)
+        self.scores = np.full((capacity, self.k), -np.inf, dtype=np.float32)
+
+    def _grow(self):
+        old = (self.ids, self.vectors, self.category, self.neighbours, self.scores)
+        self._allocate(max(16, len(self.ids) * 2))
+        for new, current in zip((self.ids, self.vectors, self.category, self.neighbours, self.scores), old):
+            new[:self.n] = current[:self.n]
+
+    def memory_bytes(self):
+        return sum(a.nbytes for a in (self.ids, self.vectors, self.category, self.neighbours, self.scores))
+
+    def _bucket(self, term):
+        hashed = self._buckets.get(term)
+        if hashed is None:
+            h = zlib.crc32(term.encode("utf8"))
+            hashed = self._buckets[term] = (h % self.dims, 1.0 if h & 0x80000000 else -1.0)
+        return hashed
+
+    def _category_code(self, category):
+        return self._categories.setdefault(category or "", len(self._categories))
+
+    def _set_vector(self, r, terms, price):
+        vec = self.vectors[r]
+        vec[:] = 0
+        for term, tf in terms.items():
+            bucket, sign = self._bucket(term)
+            vec[bucket] += sign * tf * self.idf.get(term, self.default_idf)
+        norm = np.linalg.norm(vec[:self.dims])
+        if norm:
+            vec[:self.dims] /= norm
+        band = self.dims + _price_band(price)
+        vec[band:band + 2] = math.sqrt(PRICE_WEIGHT / 2)
+
+    # ---- full build ----
+    def build(self, rows):
+        # rows: dicts with id, title, description, category, price
+        started = time.perf_counter()
+        docs = [_terms(r["title"], r["description"]) for r in rows]
+        n = len(docs)
+        df = Counter(term for terms in docs for term in terms)
+        self.idf = {term: math.log(1.0 + n / count) for term, count in df.items()}
+        self.default_idf = math.log(1.0 + max(n, 1))
+        self._categories = {}
+        self.rows = {}
+        self._allocate(n)
+        self.n = n
+        # sparse (row, bucket, weight) triples summed into the dense matrix a slice at a time,
+        # bounding the float64 scratch space of bincount
+        for start in range(0, n, 10000):
+            index, weights = [], []
+            for i, terms in enumerate(docs[start:start + 10000]):
+                for term, tf in terms.items():
+                    bucket, sign = self._bucket(term)
+                    index.append(i * self.dims + bucket)
+                    weights.append(sign * tf * self.idf[term])
+            count = min(10000, n - start)
+            block = np.bincount(np.array(index, dtype=np.int64), weights=np.array(weights),
+                                minlength=count * self.dims)
+            self.vectors[start:start + count, :self.dims] = block.reshape(count, self.dims)
+            text = self.vectors[start:start + count, :self.dims]
+            norms = np.linalg.norm(text, axis=1, keepdims=True)
+            np.divide(text, norms, out=text, where=norms > 0)
+        price_weight = math.sqrt(PRICE_WEIGHT / 2)
+        for i, r in enumerate(rows):
+            self.ids[i] = r["id"]
+            self.rows[r["id"]] = i
+            self.category[i] = self._category_code(r["category"])
+            band = self.dims + _price_band(r["price"])
+            self.vectors[i, band:band + 2] = price_weight
+        for code in range(len(self._categories)):
+            members = np.flatnonzero(self.category[:n] == code)
+            self._score(members, members)
+        self.built_at = time.time()
+        self.build_seconds = time.perf_counter() - started
+
+    def _score(self, targets, candidates):
+        # recompute the neighbour lists of the target rows against the candidate rows
+        matrix = self.vectors[candidates].T
+        candidate_ids = self.ids[candidates]
+        for start in range(0, len(targets), BLOCK_ROWS):
+            block = targets[start:start + BLOCK_ROWS]
+            scores = self.vectors[block] @ matrix
+            # a listing is not similar to itself
+            scores[block[:, None] == candidates[None, :]] = -np.inf
+            best = _top_k(scores, self.k)
+            best_scores = np.take_along_axis(scores, best, axis=1)
+            found = best.shape[1]
+            self.neighbours[block] = 0
+            self.scores[block] = -np.inf
+            self.neighbours[block, :found] = np.where(np.isfinite(best_scores), candidate_ids[best], 0)
+            self.scores[block, :found] = best_scores
+
+    def _members(self, code):
+        return np.flatnonzero(self.category[:self.n] == code)
+
+    # ---- incremental updates ----
+    def upsert(self, row):
+        # add or replace one listing; returns the rows whose neighbour lists changed
+        pid = row["id"]
+        r = self.rows.get(pid)
+        old_code = None
+        if r is None:
+            if self.n == len(self.ids):
+                self._grow()
+            r = self.rows[pid] = self.n
+            self.n += 1
+            self.ids[r] = pid
+        else:
+            old_code = self.category[r]
+        self._set_vector(r, _terms(row["title"], row["description"]), row["price"])
+        self.category[r] = self._category_code(row["category"])
+        changed = {r}
+        # lists holding the old version may now rank it wrongly or in the wrong category
+        holders = self._holders(pid)
+        if old_code is not None and len(holders):
+            for code in set(self.category[holders].tolist()):
+                group = holders[self.category[holders] == code]
+                self._score(group, self._members(code))
+            changed.update(holders.tolist())
+        members = self._members(self.category[r])
+        self._score(np.array([r]), members)
+        # insert it into the lists it now beats
+        others = members[members != r]
+        if len(others):
+            scores = self.vectors[others] @ self.vectors[r]
+            beats = (scores > self.scores[others, -1]) & ~np.isin(others, holders)
+            for o, score in zip(others[beats], scores[beats]):
+                self._insert(o, pid, score)
+                changed.add(int(o))
+        return changed
+
+    def _insert(self, row, pid, score):
+        slot = int(np.searchsorted(-self.scores[row], -score, side="right"))
+        self.neighbours[row, slot + 1:] = self.neighbours[row, slot:-1].copy()
+        self.scores[row, slot + 1:] = self.scores[row, slot:-1].copy()
+        self.neighbours[row, slot] = pid
+        self.scores[row, slot] = score
+
+    def _holders(self, pid):
+        # rows with pid in their neighbour list
+        return np.flatnonzero((self.neighbours[:self.n] == pid).any(axis=1))
+
+    def remove(self, pid):
+        # returns the rows whose neighbour lists changed
+        r = self.rows.pop(pid, None)
+        if r is None:
+            return set()
+        self.category[r] = -1
+        self.neighbours[r] = 0
+        self.scores[r] = -np.inf
+        holders = self._holders(pid)
+        for code in set(self.category[holders].tolist()):
+            group = holders[self.category[holders] == code]
+            self._score(group, self._members(code))
+        return set(holders.tolist())
+
+    def neighbours_of(self, row):
+        # [(similar product id, score)] best first
+        return [(int(pid), float(score)) for pid, score in zip(self.neighbours[row], self.scores[row]) if pid]
+
+
+# ------------------ STORAGE ------------------
+def _load_rows(cursor, ids=None):
+    query = "SELECT id, title, description, category, price FROM products"
+    if ids is None:
+        cursor.execute(query)
+    else:
+        placeholders = ','.join(['%s'] * len(ids))
+        cursor.execute(query + f" WHERE id IN ({placeholders})", tuple(ids))
+    columns = [d[0] for d in cursor.description]
+    return [dict(zip(columns, r)) for r in cursor.fetchall()]
+
+
+def _store(model, rows):
+    # replace the stored lists of the given model rows, WRITE_CHUNK products per transaction
+    rows = sorted(rows)
+    conn = db.get_db_connection()
+    cursor = conn.cursor()
+    try:
+        for start in range(0, len(rows), WRITE_CHUNK):
+            chunk = rows[start:start + WRITE_CHUNK]
+            pids = [int(model.ids[r]) for r in chunk]
+            conn.begin()
+            placeholders = ','.join(['%s'] * len(pids))
+            cursor.execute(f"DELETE FROM product_similar WHERE product_id IN ({placeholders})", tuple(pids))
+            values = [(pid, position, similar, score)
+                      for pid, r in zip(pids, chunk) if model.category[r] >= 0
+                      for position, (similar, score) in enumerate(model.neighbours_of(r))]
+            if values:
+                cursor.executemany("INSERT INTO product_similar (product_id, position, similar_id, score) "
+                                   "VALUES (%s,%s,%s,%s)", values)
+            conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+        conn.close()
+
+
+def _delete_stored(pids):
+    conn = db.get_db_connection()
+    cursor = conn.cursor()
+    placeholders = ','.join(['%s'] * len(pids))
+    cursor.execute(f"DELETE FROM product_similar WHERE product_id IN ({placeholders})", tuple(pids))
+    conn.commit()
+    cursor.close()
+    conn.close()
+
+
+def build(log=print):
+    # full rebuild from the products table; returns the model
+    conn = db.get_db_connection()
+    cursor = conn.cursor()
+    rows = _load_rows(cursor)
+    cursor.close()
+    conn.close()
+    model = SimilarityModel()
+    model.build(rows)
+    started = time.perf_counter()
+    _store(model, range(model.n))
+    # lists of listings deleted while the model was being built
+    conn = db.get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute("DELETE FROM product_similar WHERE product_id NOT IN (SELECT id FROM products)")
+    conn.commit()
+    cursor.close()
+    conn.close()
+    log(f"Built similar products for {model.n} listings in {model.build_seconds:.1f}s "
+        f"(stored in {time.perf_counter() - started:.1f}s, model {model.memory_bytes() / 2 ** 20:.0f} MB)")
+    return model
+
+
+def similar_products(product_id):
+    # card rows of the stored neighbours, best first (listings deleted since drop out)
+    conn = db.get_read_connection()
+    cursor = conn.cursor(dictionary=True)
+    cursor.execute(SIMILAR_SQL, (product_id,))
+    rows = cursor.fetchall()
+    cursor.close()
+    conn.close()
+    return rows
+
+
+# ------------------ BACKGROUND MODEL ------------------
+_changes = queue.Queue()
+_state = {"model": None, "applied": 0, "last_error": None}
+_worker = None
+
+
+def product_changed(product_id):
+    if ENABLED:
+        _changes.put(("upsert", product_id))
+
+
+def product_deleted(product_id):
+    if ENABLED:
+        _changes.put(("delete", product_id))
+
+
+def _apply(model, changes):
+    # latest change per listing wins
+    latest = dict((pid, kind) for kind, pid in changes)
+    deleted = [pid for pid, kind in latest.items() if kind == "delete"]
+    changed = set()
+    for pid in deleted:
+        changed |= model.remove(pid)
+    upserts = [pid for pid, kind in latest.items() if kind == "upsert"]
+    if upserts:
+        conn = db.get_db_connection()
+        cursor = conn.cursor()
+        rows = _load_rows(cursor, upserts)
+        cursor.close()
+        conn.close()
+        found = {r["id"] for r in rows}
+        for row in rows:
+            changed |= model.upsert(row)
+        # edited and deleted again before we got to it
+        for pid in set(upserts) - found:
+            changed |= model.remove(pid)
+            deleted.append(pid)
+    if deleted:
+        _delete_stored(deleted)
+    changed = {r for r in changed if model.category[r] >= 0}
+    if changed:
+        _store(model, changed)
+    _state["applied"] += len(latest)
+
+
+def _run():
+    next_build = 0.0
+    while True:
+        try:
+            if time.monotonic() >= next_build:
+                _state["model"] = build()
+                next_build = time.monotonic() + REBUILD_INTERVAL if REBUILD_INTERVAL > 0 else math.inf
+            try:
+                changes = [_changes.get(timeout=min(60.0, max(next_build - time.monotonic(), 0.1)))]
+            except queue.Empty:
+                continue
+            while True:
+                try:
+                    changes.append(_changes.get_nowait())
+                except queue.Empty:
+                    break
+            _apply(_state["model"], changes)
+        except Exception as e:
+            _state["last_error"] = str(e)
+            print(f"Warning: recommendation update failed: {e}")
+            time.sleep(5)
+
+
+def start_worker():
+    global _worker
+    if _worker is None and ENABLED:
+        _worker = threading.Thread(target=_run, name="recommend", daemon=True)
+        _worker.start()
+    return _worker
+
+
+def stats():
+    model = _state["model"]
+    return {
+        "enabled": ENABLED,
+        "products": len(model.rows) if model else 0,
+        "built_at": model.built_at if model else None,
+        "build_seconds": round(model.build_seconds, 3) if model else None,
+        "model_mb": round(model.memory_bytes() / 2 ** 20, 1) if model else None,
+        "pending_changes": _changes.qsize(),
+        "applied_changes": _state["applied"],
+        "last_error": _state["last_error"],
+    }
+
+
+def debug_recommend():
+    return stats()
+
+
+def init_app(app):
+    app.add_url_rule("/debug_recommend", "debug_recommend", debug_recommend)
+    start_worker()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build or inspect the similar-products lists.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("build", help="recompute and store the lists for every listing")
+    show = sub.add_parser("similar", help="print the stored list of one listing")
+    show.add_argument("product_id", type=int)
+    args = parser.parse_args()
+
+    if args.command == "build":
+        if np is None:
+            parser.error("numpy is not installed")
+        build()
+        return
+    for p in similar_products(args.product_id):
+        print(f"{p['id']:>8}  {p['category'] or '':<16} {p['price']:>10}  {p['title']}")
+
+
+if __name__ == "__main__":
+    main()
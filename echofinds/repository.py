@@ -0,0 +1,169 @@
+from collections import namedtuple
+
+import db
+
+# Queries the pages repeat on every request: products and users by id and the
+# IN (...) product fetches; fragments.py runs the listing pages through
+# fetch_all too.
+# - Statements are prepared once per connection and reused
+#   (PooledConnection.prepared_cursor): server-side prepared statements on
+#   MySQL, SQLite's own per-connection statement cache on SQLite.
+# - Rows are tuples with named fields (one namedtuple class per statement)
+#   rather than a dict per row. They read like the dict rows they replace
+#   (row.title, row["title"], row.get("title"), dict(row)) but are immutable;
+#   dict(row, qty=2) makes a copy with extra values.
+# - IN lists go out in chunks of at most IN_CHUNK ids, each padded to a
+#   power of two by repeating its last id, so any list uses one of a handful
+#   of statement texts and stays in the cache.
+# The async views (asgi.py) run the same statements through the *_async
+# functions on an adb connection; their rows are adb's dicts.
+IN_CHUNK = 256
+
+# every products column, in schema order (what SELECT * returned)
+PRODUCT_COLUMNS = "id, user_id, title, description, category, price, image_url, image_variants, stock, version"
+USER_COLUMNS = "id, username, email, password, profile_image"
+
+PRODUCT_SQL = f"SELECT {PRODUCT_COLUMNS} FROM products WHERE id=%s"
+PRODUCT_DETAIL_SQL = (f"SELECT {', '.join('p.' + c for c in PRODUCT_COLUMNS.split(', '))}, u.username AS seller "
+                      "FROM products p LEFT JOIN users u ON p.user_id=u.id WHERE p.id=%s")
+USER_SQL = f"SELECT {USER_COLUMNS} FROM users WHERE id=%s"
+LATEST_PRODUCT_SQL = f"SELECT {PRODUCT_COLUMNS} FROM products ORDER BY id DESC LIMIT 1"
+ORDER_SQL = "SELECT id, user_id, created_at FROM orders WHERE id=%s AND user_id=%s"
+ORDER_ITEMS_SQL = (f"SELECT {', '.join('p.' + c for c in PRODUCT_COLUMNS.split(', '))}, oi.quantity AS qty "
+                   "FROM order_items oi JOIN products p ON oi.product_id=p.id WHERE oi.order_id=%s")
+
+
+class Row:
+    # mapping-style access on top of the namedtuple fields
+    __slots__ = ()
+
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            return tuple.__getitem__(self, self._index[key])
+        return tuple.__getitem__(self, key)
+
+    def get(self, key, default=None):
+        i = self._index.get(key)
+        return default if i is None else tuple.__getitem__(self, i)
+
+    def keys(self):
+        return self._fields
+
+    def values(self):
+        return tuple(self)
+
+    def items(self):
+        return zip(self._fields, self)
+
+
+_row_classes = {}
+
+
+def _row_class(sql, description):
+    # one class per statement, built from the column names of its first result
+    cls = _row_classes.get(sql)
+    if cls is None:
+        base = namedtuple("Row", [d[0] for d in description], rename=True)
+        index = {name: i for i, name in enumerate(base._fields)}
+        cls = _row_classes[sql] = type("Row", (Row, base), {"__slots__": (), "_index": index})
+    return cls
+
+
+def fetch_all(conn, sql, params=()):
+    cursor = conn.prepared_cursor(sql)
+    cursor.execute(sql, params)
+    rows = cursor.fetchall()
+    make = _row_class(sql, cursor.description)._make
+    return list(map(make, rows))
+
+
+def fetch_one(conn, sql, params=()):
+    rows = fetch_all(conn, sql, params)
+    return rows[0] if rows else None
+
+
+def _in_chunks(ids):
+    # (placeholders, params) per chunk of the distinct ids, sorted
+    ids = sorted(set(ids))
+    for start in range(0, len(ids), IN_CHUNK):
+        chunk = ids[start:start + IN_CHUNK]
+        size = 1
+        while size < len(chunk):
+            size *= 2
+        chunk += [chunk[-1]] * (size - len(chunk))
+        yield ','.join(['%s'] * size), tuple(chunk)
+
+
+# ------------------ PRODUCTS ------------------
+def product(conn, product_id):
+    return fetch_one(conn, PRODUCT_SQL, (product_id,))
+
+
+def product_detail(conn, product_id):
+    # product plus its seller's username, for the detail page
+    return fetch_one(conn, PRODUCT_DETAIL_SQL, (product_id,))
+
+
+def latest_product(conn):
+    return fetch_one(conn, LATEST_PRODUCT_SQL)
+
+
+def products_by_ids(conn, ids, columns=PRODUCT_COLUMNS):
+    # rows for the ids that exist, in id order
+    rows = []
+    for placeholders, params in _in_chunks(ids):
+        rows += fetch_all(conn, f"SELECT {columns} FROM products WHERE id IN ({placeholders}) ORDER BY id", params)
+    return rows
+
+
+def existing_product_ids(conn, ids):
+    found = set()
+    for placeholders, params in _in_chunks(ids):
+        found.update(r[0] for r in fetch_all(conn, f"SELECT id FROM products WHERE id IN ({placeholders})", params))
+    return found
+
+
+def lock_products(conn, ids):
+    # (id, stock, price) rows locked for update, in id order so concurrent checkouts can't deadlock
+    rows = []
+    for placeholders, params in _in_chunks(ids):
+        rows += fetch_all(conn, f"SELECT id, stock, price FROM products WHERE id IN ({placeholders}) "
+                                f"ORDER BY id{db.FOR_UPDATE}", params)
+    return rows
+
+
+# ------------------ USERS ------------------
+def user(conn, user_id):
+    return fetch_one(conn, USER_SQL, (user_id,))
+
+
+# ------------------ ORDERS ------------------
+def order(conn, order_id, user_id):
+    # one of the user's orders, None if it isn't theirs
+    return fetch_one(conn, ORDER_SQL, (order_id, user_id))
+
+
+def order_items(conn, order_id):
+    # the order's products with the quantity bought (qty)
+    return fetch_all(conn, ORDER_ITEMS_SQL, (order_id,))
+
+
+# ------------------ ASYNC ------------------
+async def user_async(conn, user_id):
+    return await conn.fetchone(USER_SQL, (user_id,))
+
+
+async def products_by_ids_async(conn, ids, columns=PRODUCT_COLUMNS):
+    rows = []
+    for placeholders, params in _in_chunks(ids):
+        rows += await conn.fetchall(f"SELECT {columns} FROM products WHERE id IN ({placeholders}) ORDER BY id", params)
+    return rows
+
+
+async def lock_products_async(conn, ids):
+    # (id, stock, price) tuples, as lock_products
+    rows = []
+    for placeholders, params in _in_chunks(ids):
+        rows += await conn.fetchall(f"SELECT id, stock, price FROM products WHERE id IN ({placeholders}) "
+                                    f"ORDER BY id{db.FOR_UPDATE}", params, dictionary=False)
+    return rows
@@ -0,0 +1,263 @@
+import bisect
+import heapq
+import math
+import os
+import re
+import threading
+import time
+from collections import Counter
+
+import db
+
+# In-process inverted index over product title, description and category,
+# with each product's price for the price filters and sorts.
+# Built lazily from the products table and kept up to date by the views that
+# write products (add_product, edit_product, delete_product). Each worker
+# process holds its own copy; REBUILD_INTERVAL bounds how long writes made by
+# other processes can stay invisible.
+REBUILD_INTERVAL = float(os.environ.get("ECOFINDS_SEARCH_REBUILD_INTERVAL", "300"))
+
+# relative weight of a term depending on the field it was found in
+FIELD_WEIGHTS = {"title": 3.0, "category": 2.0, "description": 1.0}
+
+STOPWORDS = {
+    "a", "an", "and", "are", "as", "at", "be", "by", "for", "from", "in", "is",
+    "it", "of", "on", "or", "the", "to", "with",
+}
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+
+def stem(word):
+    # very small suffix stripper (plurals and -ing); enough for listing titles
+    if len(word) <= 3 or word.isdigit():
+        return word
+    if word.endswith("ies") and len(word) > 4:
+        return word[:-3] + "y"
+    for suffix in ("sses", "ches", "shes", "xes", "zes"):
+        if word.endswith(suffix):
+            return word[:-2]
+    if word.endswith("s") and not word.endswith(("ss", "us", "is")):
+        return word[:-1]
+    if word.endswith("ing") and len(word) >= 7:
+        return word[:-3]
+    return word
+
+
+def tokenize(text):
+    if not text:
+        return []
+    return [stem(t) for t in _TOKEN_RE.findall(str(text).lower()) if t not in STOPWORDS]
+
+
+class SearchIndex:
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._clear()
+
+    def _clear(self):
+        # term -> {product_id: weight}
+        self.postings = {}
+        # sorted list of all terms, used for prefix expansion
+        self.terms = []
+        # product_id -> (set of terms, category, price or None)
+        self.docs = {}
+        # category -> number of products
+        self.category_counts = Counter()
+        self.built_at = None
+
+    # ---- writes ----
+    def build(self, rows):
+        with self._lock:
+            self._clear()
+            for r in rows:
+                self._add(r["id"], r.get("title"), r.get("description"), r.get("category"), r.get("price"))
+            self.terms = sorted(self.postings)
+            self.built_at = time.monotonic()
+
+    def add(self, product_id, title, description, category, price=None):
+        with self._lock:
+            self._remove(product_id)
+            for term in self._add(product_id, title, description, category, price):
+                i = bisect.bisect_left(self.terms, term)
+                if i == len(self.terms) or self.terms[i] != term:
+                    self.terms.insert(i, term)
+
+    def remove(self, product_id):
+        with self._lock:
+            for term in self._remove(product_id):
+                i = bisect.bisect_left(self.terms, term)
+                if i < len(self.terms) and self.terms[i] == term:
+                    del self.terms[i]
+
+    def _add(self, product_id, title, description, category, price=None):
+        # returns terms that did not exist before this document
+        weights = Counter()
+        for field, text in (("title", title), ("description", description), ("category", category)):
+            for term in tokenize(text):
+                weights[term] += FIELD_WEIGHTS[field]
+        new_terms = []
+        for term, w in weights.items():
+            plist = self.postings.get(term)
+            if plist is None:
+                plist = self.postings[term] = {}
+                new_terms.append(term)
+            # dampen repeated words so keyword stuffing does not dominate
+            plist[product_id] = 1.0 + math.log(w)
+        category = category or ""
+        try:
+            price = float(price) if price is not None else None
+        except ValueError:
+            price = None
+        self.docs[product_id] = (set(weights), category, price)
+        if category:
+            self.category_counts[category] += 1
+        return new_terms
+
+    def _remove(self, product_id):
+        # returns terms that no longer have any documents
+        doc = self.docs.pop(product_id, None)
+        if doc is None:
+            return []
+        terms, category, _ = doc
+        if category:
+            self.category_counts[category] -= 1
+            if self.category_counts[category] <= 0:
+                del self.category_counts[category]
+        gone = []
+        for term in terms:
+            plist = self.postings.get(term)
+            if plist is None:
+                continue
+            plist.pop(product_id, None)
+            if not plist:
+                del self.postings[term]
+                gone.append(term)
+        return gone
+
+    # ---- reads ----
+    def _expand(self, token):
+        # exact term plus every indexed term that starts with it
+        i = bisect.bisect_left(self.terms, token)
+        out = []
+        while i < len(self.terms) and self.terms[i].startswith(token):
+            out.append(self.terms[i])
+            i += 1
+        return out
+
+    def search(self, query, category=None, limit=None, min_price=None, max_price=None, sort=None):
+        # Returns (ranked product ids, {category: count}) for a query.
+        # Every query token has to match (exactly or as a prefix); facet counts
+        # are computed after the price filters but before the category filter
+        # so the dropdown can show them. Results are ordered by relevance unless
+        # sort is one of pagination.SORTS (price orders leave out listings
+        # without a price). With a limit only the top results are ranked (heap
+        # instead of full sort).
+        tokens = tokenize(query)
+        if not tokens:
+            return [], {}
+        with self._lock:
+            n_docs = max(len(self.docs), 1)
+            scores = None
+            for token in tokens:
+                token_scores = {}
+                for term in self._expand(token):
+                    plist = self.postings[term]
+                    idf = math.log(1.0 + n_docs / len(plist))
+                    # prefix matches rank slightly below exact ones
+                    boost = 1.0 if term == token else 0.8
+                    factor = idf * boost
+                    if not token_scores:
+                        token_scores = {pid: w * factor for pid, w in plist.items()}
+                        continue
+                    for pid, w in plist.items():
+                        s = w * factor
+                        if s > token_scores.get(pid, 0.0):
+                            token_scores[pid] = s
+                if scores is None:
+                    scores = token_scores
+                else:
+                    scores = {pid: s + token_scores[pid] for pid, s in scores.items() if pid in token_scores}
+                if not scores:
+                    return [], {}
+            if min_price is not None or max_price is not None or sort in ("price_asc", "price_desc"):
+                low = -math.inf if min_price is None else min_price
+                high = math.inf if max_price is None else max_price
+                prices = {pid: self.docs[pid][2] for pid in scores}
+                scores = {pid: s for pid, s in scores.items()
+                          if prices[pid] is not None and low <= prices[pid] <= high}
+            facets = Counter()
+            for pid in scores:
+                cat = self.docs[pid][1]
+                if cat:
+                    facets[cat] += 1
+            if category:
+                scores = {pid: s for pid, s in scores.items() if self.docs[pid][1] == category}
+        if sort == "newest":
+            key = lambda pid: pid  # noqa: E731
+        elif sort in ("price_asc", "price_desc"):
+            sign = 1 if sort == "price_desc" else -1
+            key = lambda pid: (sign * prices[pid], sign * pid)  # noqa: E731
+        else:
+            key = lambda pid: (scores[pid], pid)  # noqa: E731
+        if limit is not None:
+            ranked = heapq.nlargest(limit, scores, key=key)
+        else:
+            ranked = sorted(scores, key=key, reverse=True)
+        return ranked, dict(facets)
+
+    def categories(self):
+        with self._lock:
+            return sorted(self.category_counts)
+
+
+_index = SearchIndex()
+_rebuild_lock = threading.Lock()
+
+
+def get_index():
+    # (re)build from the database on first use and after REBUILD_INTERVAL.
+    # Only one thread rebuilds; the others keep searching the current index.
+    if _index.built_at is None:
+        with _rebuild_lock:
+            if _index.built_at is None:
+                rebuild()
+    elif time.monotonic() - _index.built_at > REBUILD_INTERVAL and _rebuild_lock.acquire(blocking=False):
+        try:
+            rebuild()
+        finally:
+            _rebuild_lock.release()
+    return _index
+
+
+def rebuild():
+    global _index
+    conn = db.get_db_connection()
+    cursor = conn.cursor(dictionary=True)
+    cursor.execute("SELECT id, title, description, category, price FROM products")
+    rows = cursor.fetchall()
+    cursor.close()
+    conn.close()
+    # build off to the side and swap, so searches never wait for a build
+    fresh = SearchIndex()
+    fresh.build(rows)
+    _index = fresh
+
+
+def search(query, category=None, limit=None, min_price=None, max_price=None, sort=None):
+    return get_index().search(query, category, limit, min_price, max_price, sort)
+
+
+def categories():
+    return get_index().categories()
+
+
+def index_product(product_id, title, description, category, price=None):
+    # only maintain an index that has been built; otherwise the next read builds it
+    if _index.built_at is not None:
+        _index.add(product_id, title, description, category, price)
+
+
+def remove_product(product_id):
+    if _index.built_at is not None:
+        _index.remove(product_id)
@@ -0,0 +1,206 @@
+import argparse
+import io
+import json
+import random
+import time
+
+from werkzeug.datastructures import FileStorage
+
+import credentials
+import db
+import facets
+import images
+
+# Synthetic data for local development, benchmarks and load tests.
+# Creates users (emails user<n>@example.com, all with the same password),
+# product listings spread over CATALOG's categories with plausible titles,
+# descriptions and prices, a pool of generated product photos stored through
+# the normal upload pipeline (content keys, reference counts, variants), and
+# order histories over the last --days days. Works on whichever backend db.py
+# is configured for:
+#   ECOFINDS_DB_BACKEND=sqlite ECOFINDS_SQLITE_PATH=/tmp/big.sqlite3 \
+#       python seed.py --users 2000 --products 50000 --orders 20000 --images 40
+# Rows are appended (ids continue after existing rows); --reset empties the
+# tables first.
+
+# category -> (weight, adjectives, nouns, (min price, max price))
+CATALOG = {
+    "Furniture": (14, ["Oak", "Vintage", "Folding", "Mid-century", "Solid wood", "Upholstered"],
+                  ["chair", "desk", "bookshelf", "coffee table", "wardrobe", "bed frame", "sofa"], (800, 25000)),
+    "Electronics": (18, ["Refurbished", "Wireless", "Used", "Portable", "Smart", "4K"],
+                    ["headphones", "monitor", "laptop", "speaker", "phone", "camera", "router"], (500, 60000)),
+    "Books": (16, ["Hardcover", "Paperback", "Signed", "First edition", "Illustrated"],
+              ["novel", "cookbook", "textbook", "atlas", "poetry collection", "biography"], (50, 1500)),
+    "Clothing": (14, ["Denim", "Woollen", "Leather", "Linen", "Handmade", "Kids"],
+                 ["jacket", "kurta", "sweater", "shoes", "saree", "scarf", "jeans"], (150, 6000)),
+    "Music": (8, ["Acoustic", "Electric", "Vintage", "Student", "Digital"],
+              ["guitar", "keyboard", "violin", "tabla", "drum kit", "ukulele"], (1000, 40000)),
+    "Sports": (10, ["Carbon", "Junior", "Pro", "Foldable", "Lightweight"],
+               ["bicycle", "cricket bat", "badminton racket", "yoga mat", "dumbbells", "helmet"], (200, 30000)),
+    "Home & Kitchen": (12, ["Steel", "Ceramic", "Non-stick", "Glass", "Copper"],
+                       ["pressure cooker", "mixer", "dinner set", "kettle", "lamp", "mirror"], (150, 8000)),
+    "Toys": (8, ["Wooden", "Remote control", "Educational", "Plush", "Vintage"],
+             ["train set", "puzzle", "doll house", "building blocks", "board game"], (100, 5000)),
+}
+CONDITIONS = ["like new", "gently used", "well loved", "barely used", "in good condition", "needs minor repair"]
+FIRST_NAMES = ["Aarav", "Priya", "Rohan", "Ananya", "Vikram", "Meera", "Arjun", "Kavya", "Ishaan", "Diya",
+               "Kabir", "Sara", "Nikhil", "Aisha", "Dev", "Tara", "Rahul", "Neha", "Yash", "Pooja"]
+PASSWORD = "password"
+
+
+def _product(rng, category):
+    _, adjectives, nouns, (low, high) = CATALOG[category]
+    adjective, noun = rng.choice(adjectives), rng.choice(nouns)
+    title = f"{adjective} {noun}"
+    description = (f"{title} for sale, {rng.choice(CONDITIONS)}. "
+                   f"Bought {rng.randint(1, 8)} years ago, {rng.choice(['pickup only', 'can ship', 'price negotiable'])}.")
+    # prices cluster at the cheap end of the range, like real listings
+    price = round(low + (high - low) * rng.random() ** 2, -1) or low
+    return title, description, price
+
+
+def _photo(rng, index):
+    # a plain gradient with a few shapes; enough to exercise resizing and encoding.
+    # Only called when Pillow is installed (images.Image is set).
+    from PIL import ImageDraw
+    width, height = rng.choice([(1600, 1200), (1200, 1600), (1400, 1400)])
+    base = tuple(rng.randint(40, 215) for _ in range(3))
+    img = images.Image.new("RGB", (width, height), base)
+    draw = ImageDraw.Draw(img)
+    for y in range(0, height, 8):
+        shade = tuple(min(255, c + y * 60 // height) for c in base)
+        draw.rectangle([0, y, width, y + 8], fill=shade)
+    for _ in range(6):
+        x, y = rng.randint(0, width), rng.randint(0, height)
+        r = rng.randint(60, 400)
+        draw.ellipse([x - r, y - r, x + r, y + r], fill=tuple(rng.randint(0, 255) for _ in range(3)))
+    out = io.BytesIO()
+    img.save(out, "JPEG", quality=90)
+    out.seek(0)
+    return FileStorage(out, filename=f"seed_{index}.jpg")
+
+
+def _next_id(cursor, table):
+    cursor.execute(f"SELECT MAX(id) FROM {table}")
+    return (cursor.fetchone()[0] or 0) + 1
+
+
+def _insert(conn, cursor, query, rows, batch):
+    for i in range(0, len(rows), batch):
+        cursor.executemany(query, rows[i:i + batch])
+        conn.commit()
+
+
+def reset():
+    conn = db.get_db_connection()
+    cursor = conn.cursor()
+    for table in ("order_items", "orders", "purchase_summary", "products", "uploads", "users"):
+        cursor.execute(f"DELETE FROM {table}")
+    conn.commit()
+    cursor.close()
+    conn.close()
+
+
+def seed(users=100, products=1000, orders=500, n_images=0, stock=1, days=365, seed=1, batch=1000, log=print):
+    # returns {"users": [first id, last id], "products": [...], "orders": [...], "images": n}
+    rng = random.Random(seed)
+    started = time.perf_counter()
+    conn = db.get_db_connection()
+    cursor = conn.cursor()
+
+    # users: one hash shared by all rows, hashing each would dominate the run
+    password_hash = credentials.hash_password(PASSWORD)
+    first_user = _next_id(cursor, "users")
+    user_ids = list(range(first_user, first_user + users))
+    _insert(conn, cursor, "INSERT INTO users (id, username, email, password) VALUES (%s,%s,%s,%s)",
+            [(uid, f"{rng.choice(FIRST_NAMES)}{uid}", f"user{uid}@example.com", password_hash) for uid in user_ids],
+            batch)
+    log(f"users      {users:>8}  ids {first_user}..{first_user + users - 1}")
+
+    photos = []
+    if n_images and images.Image is None:
+        log("Pillow is not installed; seeding products without images")
+    elif n_images:
+        for i in range(n_images):
+            key = images.save_upload(_photo(rng, i))
+            photos.append((key, json.dumps(images.build_variants(key))))
+        log(f"images     {len(photos):>8}")
+
+    # products: a fifth of the users sell, some of them a lot
+    sellers = rng.sample(user_ids, max(1, len(user_ids) // 5)) if user_ids else [None]
+    power_sellers = sellers[:max(1, len(sellers) // 4)]
+    categories = list(CATALOG)
+    weights = [CATALOG[c][0] for c in categories]
+    first_product = _next_id(cursor, "products")
+    product_rows = []
+    image_refs = {}
+    for pid in range(first_product, first_product + products):
+        category = rng.choices(categories, weights)[0]
+        title, description, price = _product(rng, category)
+        key, manifest = rng.choice(photos) if photos and rng.random() < 0.8 else (None, None)
+        if key:
+            image_refs[key] = image_refs.get(key, 0) + 1
+        seller = rng.choice(power_sellers if rng.random() < 0.5 else sellers)
+        product_rows.append([pid, seller, title, description, category, price, key, manifest, stock])
+    prices = {row[0]: row[5] for row in product_rows}
+
+    # orders: spread over the last `days` days, oldest first so ids follow time
+    first_order = _next_id(cursor, "orders")
+    now = int(time.time())
+    times = sorted(now - rng.randint(0, days * 86400) for _ in range(orders))
+    order_rows, item_rows = [], []
+    for oid, created_at in zip(range(first_order, first_order + orders), times):
+        order_rows.append((oid, rng.choice(user_ids) if user_ids else None, created_at))
+        for pid in rng.sample(range(first_product, first_product + products), min(products, rng.randint(1, 4))):
+            qty = 1 if rng.random() < 0.9 else 2
+            item_rows.append((oid, pid, qty))
+            row = product_rows[pid - first_product]
+            row[8] = max(0, row[8] - qty)
+
+    _insert(conn, cursor, "INSERT INTO products (id, user_id, title, description, category, price, image_url, "
+            "image_variants, stock) VALUES (%s,%s,%s,%s,%s,%s,%s,%s,%s)", [tuple(r) for r in product_rows], batch)
+    log(f"products   {products:>8}  ids {first_product}..{first_product + products - 1}")
+    # save_upload took one reference per photo; one per listing using it replaces that
+    for key, manifest in photos:
+        cursor.execute("UPDATE uploads SET refcount=%s, variants=%s, orphaned_at=%s WHERE file_key=%s",
+                       (image_refs.get(key, 0), manifest, now if not image_refs.get(key) else None, key))
+    facets.refill(cursor)
+    conn.commit()
+    facets.invalidate()
+    _insert(conn, cursor, "INSERT INTO orders (id, user_id, created_at) VALUES (%s,%s,%s)", order_rows, batch)
+    _insert(conn, cursor, "INSERT INTO order_items (order_id, product_id, quantity, price) VALUES (%s,%s,%s,%s)",
+            [(oid, pid, qty, prices[pid]) for oid, pid, qty in item_rows], batch)
+    log(f"orders     {orders:>8}  ({len(item_rows)} items, "
+        f"{sum(prices[pid] * qty for _, pid, qty in item_rows):,.0f} total)")
+    cursor.close()
+    conn.close()
+    log(f"seeded in {time.perf_counter() - started:.1f}s")
+    return {
+        "users": [first_user, first_user + users - 1],
+        "products": [first_product, first_product + products - 1],
+        "orders": [first_order, first_order + orders - 1],
+        "images": len(photos),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fill the configured database with synthetic marketplace data.")
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--products", type=int, default=1000)
+    parser.add_argument("--orders", type=int, default=500)
+    parser.add_argument("--images", type=int, default=0, help="distinct generated product photos")
+    parser.add_argument("--stock", type=int, default=1, help="units per listing before seeded orders")
+    parser.add_argument("--days", type=int, default=365, help="order history length")
+    parser.add_argument("--seed", type=int, default=1, help="random seed")
+    parser.add_argument("--batch", type=int, default=1000, help="rows per INSERT batch")
+    parser.add_argument("--reset", action="store_true", help="delete existing rows first")
+    args = parser.parse_args()
+
+    if args.reset:
+        reset()
+    seed(args.users, args.products, args.orders, args.images, args.stock, args.days, args.seed, args.batch)
+    print(f"log in as any user<id>@example.com with password '{PASSWORD}'")
+
+
+if __name__ == "__main__":
+    main()
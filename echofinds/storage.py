@@ -0,0 +1,312 @@
+import hashlib
+import os
+import shutil
+import tempfile
+import time
+
+from flask import url_for
+
+import db
+import jobs
+
+# Content-addressed upload storage.
+# Files are stored under a key derived from the SHA-256 of the uploaded bytes,
+# so identical uploads share one stored file. Every product or profile that
+# points at a key holds a reference in the uploads table; when the count drops
+# to zero the file is marked orphaned and a periodic job (register_cleanup)
+# queues its removal, with its variants, after ORPHAN_GRACE seconds. Files
+# stored before reference counting got their rows in migration 10.
+UPLOAD_DIR = os.environ.get("ECOFINDS_UPLOAD_DIR",
+                            os.path.join(os.path.dirname(__file__), "static", "uploads"))
+BACKEND = os.environ.get("ECOFINDS_STORAGE", "local")
+CHUNK_SIZE = 64 * 1024
+MAX_UPLOAD_BYTES = int(os.environ.get("ECOFINDS_MAX_UPLOAD_MB", "20")) * 1024 * 1024
+ORPHAN_GRACE = float(os.environ.get("ECOFINDS_ORPHAN_GRACE", "3600"))
+SWEEP_INTERVAL = float(os.environ.get("ECOFINDS_ORPHAN_SWEEP_INTERVAL", "300"))
+
+
+class UploadTooLarge(Exception):
+    pass
+
+
+# ------------------ BACKENDS ------------------
+class LocalStorage:
+    # files live in a directory served under /static/uploads
+    def __init__(self, root, base_url=None):
+        self.root = root
+        self.base_url = base_url
+        os.makedirs(root, exist_ok=True)
+
+    def path(self, key):
+        return os.path.join(self.root, key)
+
+    def exists(self, key):
+        return os.path.isfile(self.path(key))
+
+    def temp_dir(self):
+        # same filesystem as root so put_file can rename atomically
+        incoming = os.path.join(self.root, ".incoming")
+        os.makedirs(incoming, exist_ok=True)
+        return incoming
+
+    def put_file(self, key, src_path):
+        os.replace(src_path, self.path(key))
+
+    def fetch(self, key, dest_path):
+        shutil.copyfile(self.path(key), dest_path)
+
+    def delete(self, key):
+        try:
+            os.remove(self.path(key))
+        except FileNotFoundError:
+            pass
+
+    def url(self, key):
+        if self.base_url:
+            return f"{self.base_url.rstrip('/')}/{key}"
+        return url_for('static', filename='uploads/' + key)
+
+
+class S3Storage:
+    # any client with the boto3 upload_file/download_file/head_object/delete_object
+    # methods works, including LocalS3Client below
+    def __init__(self, client, bucket, base_url, prefix=""):
+        self.client = client
+        self.bucket = bucket
+        self.base_url = base_url.rstrip("/")
+        self.prefix = prefix
+
+    def _key(self, key):
+        return self.prefix + key
+
+    def exists(self, key):
+        try:
+            self.client.head_object(Bucket=self.bucket, Key=self._key(key))
+            return True
+        except Exception:
+            return False
+
+    def temp_dir(self):
+        return tempfile.gettempdir()
+
+    def put_file(self, key, src_path):
+        # upload_file streams (multipart for large files) rather than reading it all
+        self.client.upload_file(src_path, self.bucket, self._key(key))
+        os.remove(src_path)
+
+    def fetch(self, key, dest_path):
+        self.client.download_file(self.bucket, self._key(key), dest_path)
+
+    def delete(self, key):
+        self.client.delete_object(Bucket=self.bucket, Key=self._key(key))
+
+    def url(self, key):
+        return f"{self.base_url}/{self._key(key)}"
+
+
+class LocalS3Client:
+    # directory-backed stand-in for an S3 client (development and benchmarks)
+    def __init__(self, root):
+        self.root = root
+
+    def _path(self, bucket, key):
+        return os.path.join(self.root, bucket, key)
+
+    def upload_file(self, filename, bucket, key):
+        dest = self._path(bucket, key)
+        os.makedirs(os.path.dirname(dest), exist_ok=True)
+        shutil.copyfile(filename, dest)
+
+    def download_file(self, bucket, key, filename):
+        shutil.copyfile(self._path(bucket, key), filename)
+
+    def head_object(self, Bucket, Key):
+        path = self._path(Bucket, Key)
+        if not os.path.isfile(path):
+            raise KeyError(Key)
+        return {"ContentLength": os.path.getsize(path)}
+
+    def delete_object(self, Bucket, Key):
+        try:
+            os.remove(self._path(Bucket, Key))
+        except FileNotFoundError:
+            pass
+
+
+def _make_backend():
+    if BACKEND == "s3":
+        bucket = os.environ["ECOFINDS_S3_BUCKET"]
+        base_url = os.environ["ECOFINDS_S3_PUBLIC_URL"]
+        local_root = os.environ.get("ECOFINDS_S3_LOCAL_ROOT")
+        if local_root:
+            client = LocalS3Client(local_root)
+        else:
+            import boto3
+            client = boto3.client("s3", endpoint_url=os.environ.get("ECOFINDS_S3_ENDPOINT"))
+        return S3Storage(client, bucket, base_url, os.environ.get("ECOFINDS_S3_PREFIX", ""))
+    return LocalStorage(UPLOAD_DIR, os.environ.get("ECOFINDS_UPLOAD_URL"))
+
+
+_backend = None
+
+
+def get_backend():
+    global _backend
+    if _backend is None:
+        _backend = _make_backend()
+    return _backend
+
+
+def set_backend(backend):
+    global _backend
+    _backend = backend
+
+
+# ------------------ STREAMING ------------------
+def stream_to_temp(stream, temp_dir):
+    # copy an upload to a temp file in fixed-size chunks while hashing it;
+    # returns (path, sha256 hex digest, size)
+    digest = hashlib.sha256()
+    size = 0
+    fd, path = tempfile.mkstemp(dir=temp_dir, suffix=".part")
+    try:
+        with os.fdopen(fd, "wb") as out:
+            while True:
+                chunk = stream.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if size > MAX_UPLOAD_BYTES:
+                    raise UploadTooLarge(f"upload exceeds {MAX_UPLOAD_BYTES // (1024 * 1024)} MB")
+                digest.update(chunk)
+                out.write(chunk)
+    except Exception:
+        os.remove(path)
+        raise
+    return path, digest.hexdigest(), size
+
+
+# ------------------ REFERENCES ------------------
+def acquire(key, size=0):
+    # take a reference on key; returns True if the stored file can be reused
+    conn = db.get_db_connection()
+    cursor = conn.cursor()
+    for _ in range(5):
+        cursor.execute('UPDATE uploads SET refcount = refcount + 1, orphaned_at = NULL '
+                       'WHERE file_key=%s AND refcount >= 0', (key,))
+        if cursor.rowcount:
+            conn.commit()
+            cursor.close()
+            conn.close()
+            return get_backend().exists(key)
+        try:
+            cursor.execute('INSERT INTO uploads (file_key, refcount, size, created_at) VALUES (%s,1,%s,%s)',
+                           (key, size, int(time.time())))
+            conn.commit()
+            cursor.close()
+            conn.close()
+            return False
+        except Exception:
+            # the sweeper is deleting this key right now; wait for it to finish
+            conn.rollback()
+            time.sleep(0.05)
+    cursor.close()
+    conn.close()
+    raise RuntimeError(f"could not reference upload {key}")
+
+
+def referenced(key):
+    # whether any product or profile holds a reference on key
+    conn = db.get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute('SELECT refcount FROM uploads WHERE file_key=%s', (key,))
+    row = cursor.fetchone()
+    cursor.close()
+    conn.close()
+    return bool(row) and row[0] > 0
+
+
+def add_references(cursor, counts):
+    # bulk acquire inside the caller's transaction for keys already tracked in
+    # uploads; counts is {key: references to add}. Returns the keys that got no
+    # reference: the sweep is deleting them right now (refcount -1) or has
+    # deleted them.
+    keys = list(counts)
+    placeholders = ','.join(['%s'] * len(keys))
+    cursor.execute(f'SELECT file_key, refcount FROM uploads WHERE file_key IN ({placeholders})', tuple(keys))
+    live = {k for k, refcount in cursor.fetchall() if refcount >= 0}
+    updates = [(counts[k], k) for k in keys if k in live]
+    if updates:
+        cursor.executemany('UPDATE uploads SET refcount = refcount + %s, orphaned_at = NULL '
+                           'WHERE file_key=%s AND refcount >= 0', updates)
+    return set(keys) - live
+
+
+def release(key):
+    # drop a reference; unreferenced files are deleted later by the sweep
+    if not key:
+        return
+    conn = db.get_db_connection()
+    cursor = conn.cursor()
+    now = int(time.time())
+    cursor.execute('UPDATE uploads SET refcount = refcount - 1 WHERE file_key=%s AND refcount > 0', (key,))
+    if cursor.rowcount:
+        cursor.execute('UPDATE uploads SET orphaned_at=%s WHERE file_key=%s AND refcount = 0', (now, key))
+    conn.commit()
+    cursor.close()
+    conn.close()
+
+
+def queue_orphans(grace=ORPHAN_GRACE):
+    # queue a removal job per file unreferenced for longer than grace seconds;
+    # returns the number queued. Keyed by orphaning time, so a file that is
+    # reused and orphaned again gets a new job.
+    conn = db.get_db_connection()
+    cursor = conn.cursor()
+    cutoff = int(time.time() - grace)
+    cursor.execute('SELECT file_key, orphaned_at FROM uploads WHERE refcount = 0 AND orphaned_at <= %s', (cutoff,))
+    queued = 0
+    for key, orphaned_at in cursor.fetchall():
+        queued += jobs.enqueue("remove_upload", {"key": key, "grace": grace},
+                               key=f"remove_upload:{key}:{orphaned_at}", cursor=cursor)
+    conn.commit()
+    cursor.close()
+    conn.close()
+    return queued
+
+
+def remove_orphan(key, delete_files, grace=ORPHAN_GRACE):
+    # delete an unreferenced file; delete_files(key) removes a key and everything
+    # derived from it. Returns False if the file was referenced again meanwhile.
+    conn = db.get_db_connection()
+    cursor = conn.cursor()
+    try:
+        # claim the row (refcount -1) so a concurrent acquire can't revive it mid-delete
+        cursor.execute('UPDATE uploads SET refcount = -1 WHERE file_key=%s AND refcount = 0 AND orphaned_at <= %s',
+                       (key, int(time.time() - grace)))
+        claimed = cursor.rowcount
+        conn.commit()
+        if not claimed:
+            return False
+        try:
+            delete_files(key)
+        except Exception:
+            # back to orphaned; the job is retried
+            cursor.execute('UPDATE uploads SET refcount = 0 WHERE file_key=%s', (key,))
+            conn.commit()
+            raise
+        cursor.execute('DELETE FROM uploads WHERE file_key=%s', (key,))
+        conn.commit()
+        return True
+    finally:
+        cursor.close()
+        conn.close()
+
+
+def register_cleanup(delete_files, interval=SWEEP_INTERVAL):
+    # orphaned files are removed by the job queue (see jobs.py): a periodic
+    # sweep queues one idempotent removal job per orphaned key
+    jobs.register("remove_upload", lambda key, grace=ORPHAN_GRACE: remove_orphan(key, delete_files, grace),
+                  concurrency=2)
+    jobs.register("sweep_uploads", queue_orphans)
+    jobs.every("sweep_uploads", interval)
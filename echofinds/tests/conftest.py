@@ -0,0 +1,27 @@
+import os
+import sys
+import tempfile
+
+# The tests run against a throwaway sqlite database and upload directory,
+# whatever the environment points the app at; set before any app module is
+# imported, since they read their settings at import.
+_tmp = tempfile.mkdtemp(prefix="ecofinds-tests-")
+os.environ.update({
+    "ECOFINDS_DB_BACKEND": "sqlite",
+    "ECOFINDS_SQLITE_PATH": os.path.join(_tmp, "test.sqlite3"),
+    "ECOFINDS_DB_REPLICAS": "",
+    "ECOFINDS_CART_STORE": "sqlite",
+    "ECOFINDS_CART_KV_PATH": os.path.join(_tmp, "carts.sqlite3"),
+    "ECOFINDS_STORAGE": "local",
+    "ECOFINDS_UPLOAD_DIR": os.path.join(_tmp, "uploads"),
+    "ECOFINDS_ARCHIVE_DIR": os.path.join(_tmp, "archive"),
+    # nothing running in the background: tests run jobs themselves
+    "ECOFINDS_JOB_WORKERS": "0",
+    "ECOFINDS_RECOMMEND": "0",
+    "ECOFINDS_HASH_WORKERS": "0",
+    "ECOFINDS_FRAGMENT_CACHE": "0",
+    "ECOFINDS_LOGIN_IP_BURST": "1000000000",
+    "ECOFINDS_LOGIN_EMAIL_BURST": "1000000000",
+})
+os.makedirs(os.environ["ECOFINDS_UPLOAD_DIR"])
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
@@ -0,0 +1,83 @@
+"""Bulk imports naming a stored image must not let the orphan sweep delete a
+file other listings still show: import, delete the imported listing, sweep,
+and the original listing's file is still there.
+"""
+import io
+import os
+import shutil
+
+import pytest
+
+import app as ecofinds
+import db
+import jobs
+import migrations
+import storage
+
+SOURCE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "static", "uploads",
+                      "1_1757154748_laptop.jpg")
+
+
+@pytest.fixture()
+def client():
+    c = ecofinds.app.test_client()
+    email = f"seller{os.urandom(4).hex()}@example.com"
+    c.post("/signup", data={"username": "seller", "email": email, "password": "pw"})
+    c.post("/login", data={"email": email, "password": "pw"})
+    return c
+
+
+def _execute(query, params=()):
+    conn = db.get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute(query, params)
+    rows = cursor.fetchall() if cursor.description else None
+    conn.commit()
+    cursor.close()
+    conn.close()
+    return rows
+
+
+def _legacy_listing(name, backfill):
+    # a listing pointing at a file stored before reference counting
+    shutil.copy(SOURCE, os.path.join(storage.UPLOAD_DIR, name))
+    _execute("INSERT INTO products (user_id, title, category, price, image_url) VALUES (1, 'Laptop', 'Tech', 1, %s)",
+             (name,))
+    if backfill:
+        conn = db.get_db_connection()
+        cursor = conn.cursor()
+        migrations._upload_references(cursor)
+        conn.commit()
+        cursor.close()
+        conn.close()
+
+
+def _import_delete_sweep(client, image_url):
+    # import one listing with image_url, delete it and run the orphan sweep; returns its image key
+    body = f"title,description,category,price,stock,image_url\nImported,x,Tech,5,1,{image_url}\n".encode()
+    report = client.post("/products/import", data={"file": (io.BytesIO(body), "listings.csv")},
+                         content_type="multipart/form-data").get_json()
+    assert report["imported"] == 1, report
+    product_id, key = _execute("SELECT id, image_url FROM products WHERE title = 'Imported' ORDER BY id DESC")[0]
+    client.post(f"/delete_product/{product_id}")
+    storage.queue_orphans(grace=0)
+    while jobs.run_one("test"):
+        pass
+    return key
+
+
+@pytest.mark.parametrize("backfill", [True, False], ids=["counted", "untracked"])
+def test_import_keeps_shared_file(client, backfill):
+    name = f"legacy_{os.urandom(4).hex()}_laptop.jpg"
+    _legacy_listing(name, backfill)
+    key = _import_delete_sweep(client, f"/static/uploads/{name}")
+    assert os.path.exists(os.path.join(storage.UPLOAD_DIR, name))
+    # a file nothing references is stored again rather than shared
+    assert (key == name) == backfill
+
+
+def test_import_rejects_variants(client):
+    body = b"title,description,category,price,stock,image_url\nV,x,Tech,5,1,abc-1600__thumb.webp\n"
+    report = client.post("/products/import", data={"file": (io.BytesIO(body), "listings.csv")},
+                         content_type="multipart/form-data").get_json()
+    assert report["imported"] == 0 and "variant" in report["errors"][0]["error"]
@@ -0,0 +1,72 @@
+"""Query plans of the product listings (HTML and API) on a small seeded sqlite
+database: for every sort x category x price range combination, and the page
+after it, no statement may scan a large table or sort rows in a temp B-tree.
+benchmarks/explain_check.py runs the same checks (query_plans.py) over every
+route on a large dataset.
+"""
+import re
+
+import pytest
+
+import app as ecofinds
+import db
+import metrics
+import query_plans
+
+_statements = []
+
+
+def _listener(query, params, seconds):
+    if isinstance(params, (list, tuple)) and not (params and isinstance(params[0], (list, tuple))):
+        _statements.append((query, tuple(params)))
+
+
+@pytest.fixture(scope="module")
+def client():
+    with ecofinds.app.app_context():
+        query_plans.seed(500, 5000, 2000)
+    db.add_query_listener(_listener)
+    yield ecofinds.app.test_client()
+    db.remove_query_listener(_listener)
+
+
+def _listing_urls():
+    urls = [u for u in query_plans.filter_urls() if "q=" not in u]
+    return urls + ["/api/v1" + u for u in urls] + ["/api/v1/products?category=Books&sort=price_desc&fields=id,price"]
+
+
+def _next_page(resp):
+    # the URL of the page after resp, if any
+    if resp.is_json:
+        token = resp.get_json()["next_cursor"]
+        return f"{resp.request.path}?{resp.request.query_string.decode()}&cursor={token}" if token else None
+    older = re.search(r'href="([^"]+)">(?:Older|Next)', resp.get_data(as_text=True))
+    return older.group(1).replace("&amp;", "&") if older else None
+
+
+def _problems(query, params):
+    conn = db.get_pool().acquire()
+    cursor = conn.cursor()
+    try:
+        plan, problems = query_plans.explain(cursor, query, params, {"products", "orders", "order_items", "users"})
+    finally:
+        cursor.close()
+        conn.release()
+    if metrics.normalize_query(query) in query_plans.ALLOWED_SCANS:
+        return []
+    return problems + query_plans.sorts(plan)
+
+
+@pytest.mark.parametrize("url", _listing_urls())
+def test_listing_uses_indexes(client, url):
+    pages = 0
+    while url and pages < 2:
+        del _statements[:]
+        resp = client.get(url)
+        assert resp.status_code == 200
+        selects = [s for s in _statements if re.match(r"\s*SELECT\b", s[0], re.IGNORECASE)]
+        assert selects
+        for query, params in selects:
+            assert not _problems(query, params), query
+        url = _next_page(resp)
+        pages += 1